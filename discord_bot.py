@@ -5,13 +5,16 @@ import datetime
 
 import discord  # type: ignore
 
-from discord_game import DiscordGame
-
 import seat_commands as commands
 
 from seat_typing import SeatException, SeatChannel
+from seat_archive import GameArchive
+from seat_dispatch import Dispatcher
+from seat_journal import DEFAULT_JOURNAL_DIR
+from seat_persistence import GameStore, SAVE_INTERVAL
 
-# TODO: police nickname changes
+# DMs sent at once at the start of a round
+DM_CONCURRENCY = 8
 
 
 class DiscordBotException(SeatException):
@@ -21,8 +24,10 @@ class DiscordBotException(SeatException):
 class DiscordBot(discord.Client):  # type: ignore
     def __init__(self) -> None:
         super().__init__()
-        self.games: Dict[SeatChannel, DiscordGame] = {}
-        # self.players: Dict[discord.user, DiscordGame] = {}
+        self.games = commands.GameDict(Dispatcher(DM_CONCURRENCY),
+                                       GameStore(), DEFAULT_JOURNAL_DIR,
+                                       GameArchive())
+        self._restored = False
 
         self.command_list: List[commands.CommandType] = []
         self.command_dict: Dict[str, List[commands.CommandType]] = {}
@@ -46,6 +51,7 @@ class DiscordBot(discord.Client):  # type: ignore
 
             commands.Leave(self.games),
             commands.AddBot(self.games),
+            commands.AddStrategicBot(self.games),
             commands.RemoveBot(self.games),
 
             commands.Ready(self.games),
@@ -55,6 +61,7 @@ class DiscordBot(discord.Client):  # type: ignore
             commands.StreakLength(self.games),
             commands.XCount(self.games),
             commands.RoundLength(self.games),
+            commands.BotResolution(self.games),
             commands.RevealLongestStreak(self.games),
 
             # game info
@@ -66,6 +73,7 @@ class DiscordBot(discord.Client):  # type: ignore
             commands.PrintSeating(self.games),
             commands.AssignNumber(self.games),
             commands.UnassignNumber(self.games),
+            commands.WhatIf(self.games),
 
             # gameplay
             commands.ProposeSeatSwap(self.games),
@@ -87,6 +95,7 @@ class DiscordBot(discord.Client):  # type: ignore
             commands.ForceStart(self.games),
             commands.ForceStop(self.games),
             commands.ForceSwap(self.games),
+            commands.Undo(self.games),
             commands.ForceNewRound(self.games),
             commands.ForceSeatNumbers(self.games),
         ]
@@ -101,11 +110,44 @@ class DiscordBot(discord.Client):  # type: ignore
     async def on_ready(self) -> None:
         print('Logged in as {0.user} at {1}'.format(
             self, datetime.datetime.now()))
+        # on_ready is also called on reconnecting
+        if not self._restored:
+            self._restored = True
+            await self._restore_games()
         # for guild in self.guilds:
         #     for channel in guild.channels:
         #         if channel.name == 'testing':
         #             await channel.send('Seat Exchange Bot v0.1')
 
+    async def _get_user(self, user_id: int) -> discord.User:
+        return self.get_user(user_id) or await self.fetch_user(user_id)
+
+    def owns_channel(self, channel_id: int) -> bool:
+        """Whether this bot runs the games of the channel, which is all of
+        them unless it's a worker behind seat_gateway."""
+        # pylint: disable=unused-argument,no-self-use
+        return True
+
+    async def _restore_games(self) -> None:
+        assert self.games.store is not None
+        start = datetime.datetime.now()
+        restored = await self.games.store.load_all(
+            self.get_channel, self._get_user, self.owns_channel)
+        for game, round_remaining in restored:
+            self.games[game.channel] = game
+            await game.resume_restored(round_remaining)
+        print('Restored {} games in {}'.format(
+            len(restored), datetime.datetime.now() - start))
+        self.games.scheduler.schedule(SAVE_INTERVAL, self._save_games)
+
+    async def _save_games(self) -> None:
+        assert self.games.store is not None
+        self.games.store.save_all(list(self.games.values()))
+        evicted = self.games.archive_finished()
+        if evicted:
+            print('Archived {} finished games'.format(evicted))
+        self.games.scheduler.schedule(SAVE_INTERVAL, self._save_games)
+
     async def on_message(self, message: discord.message) -> None:
         if message.author == self.user:
             return
@@ -127,27 +169,34 @@ class DiscordBot(discord.Client):  # type: ignore
                 except SeatException as error:
                     errors.append(error)
             print(errors)
-            await message.channel.send('\n'.join(str(x) for x in errors))
-
-    async def on_reaction_add(self,
-                              reaction: discord.Reaction,
-                              user: discord.User) -> None:  # TODO
-        print('reaction added')
-        message = reaction.message
-        channel = SeatChannel(message.channel)
-
-        if channel not in self.games:
-            print('no channel')
+            await self.reply_errors(message, errors)
+
+    async def reply_errors(self, message: discord.message,
+                           errors: List[SeatException]) -> None:
+        """Reply to a command that failed with what went wrong."""
+        await message.channel.send('\n'.join(str(x) for x in errors))
+
+    async def on_member_update(self,
+                               before: discord.Member,
+                               after: discord.Member) -> None:
+        if (before.name, before.display_name) == (after.name,
+                                                  after.display_name):
             return
-
-        game = self.games[channel]
-
-        if message.id not in game.reactable_messages:
-            print(message, '\n', game.reactable_messages)
-            return
-
-        await game.reactable_messages[message.id].on_react(
-            reaction, user)
+        game = self.games.users.game(after)
+        if game is not None:
+            game.rename_user(after)
+
+    async def on_raw_reaction_add(
+            self, payload: discord.RawReactionActionEvent) -> None:
+        handler = self.games.reactions.get(payload.message_id)
+        if handler is not None:
+            await handler.on_react(payload)
+
+    async def on_raw_reaction_remove(
+            self, payload: discord.RawReactionActionEvent) -> None:
+        handler = self.games.reactions.get(payload.message_id)
+        if handler is not None:
+            await handler.on_unreact(payload)
 
 
 def main() -> None:
@@ -1,9 +1,17 @@
 # pragma pylint: disable=missing-docstring
 from __future__ import annotations
 
+import json
+import time
 import random
 import asyncio
 import math
+import heapq
+import bisect
+import functools
+import collections
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor
 
 from enum import Enum, auto
 import typing
@@ -13,13 +21,28 @@ from typing import Dict, Optional, Any, cast
 import discord  # type: ignore
 
 import strings
-from seat_game import SeatPlayer, SeatGame
+import seat_search
+from seat_dispatch import Dispatcher
+from seat_journal import Event, Journal
+from seat_timers import Scheduler, Timer
+if typing.TYPE_CHECKING:
+    # pylint: disable=cyclic-import
+    from seat_persistence import GameStore
+from seat_game import SeatPlayer, SeatGame, SeatSnapshot
 from seat_typing import (Seat, PrivateNumber, SeatException, SeatChannel,
                          Findable, GenF)
 
 DEFAULT_ROUND_LENGTH = 300
 DEFAULT_PUBLIC_SWAPS = False
+DEFAULT_BOT_RESOLUTION = 'greedy'
+DEFAULT_BOT_SEARCH_TIME = 2
+MAX_UNDO = 20
+COUNTDOWN_STEP = 5
+MAX_EDIT_DISTANCE = 2
 BOT_ID = 573077970445402113
+# how long a message's reactions are handled, if not dropped by its game
+REACTION_TTL = 24 * 60 * 60
+MAX_REACTABLE_MESSAGES = 10000
 MIN_HUMAN_PLAYERS = 1
 MIN_PLAYERS = 2
 
@@ -55,18 +78,26 @@ class CommonPlayer(SeatPlayer, Findable):
         self.garnets = garnets
         self.public_seat: Seat = Seat(-1)
 
-        self.proposals: ListProposals = []
         self.botswaps: typing.List[BotSwap] = []
 
+    @property
+    def proposal_index(self) -> ProposalIndex:
+        if not isinstance(self.game, ProposalGame):
+            raise DiscordGameException(
+                '{} is not in a game.'.format(self))
+        return self.game.proposal_index
+
+    @property
+    def proposals(self) -> ListProposals:
+        return self.proposal_index.of_player(self)
+
     @property
     def incoming_proposals(self) -> ListProposals:
-        return [p for p in self.proposals
-                if p.target == self]
+        return self.proposal_index.incoming(self)
 
     @property
     def outgoing_proposals(self) -> ListProposals:
-        return [p for p in self.proposals
-                if p.source == self]
+        return self.proposal_index.outgoing(self)
 
     async def send(self, *args: Any, **kwargs: str) -> None:
         raise NotImplementedError('Pure virtual method')
@@ -75,36 +106,90 @@ class CommonPlayer(SeatPlayer, Findable):
                                amount: int) -> None:
         pass
 
+    def add_proposal_to(self,
+                        target: CommonPlayer,
+                        garnets: int = 0) -> Proposal[CommonPlayer]:
+        if self.proposal_index.get(self, target) is not None:
+            raise DiscordGameException(
+                'You already have a proposal to {}'.format(target))
+
+        proposal = Proposal(self, target, garnets)
+        self.proposal_index.add(proposal)
+        self._record(Event.PROPOSE, self, target, garnets)
+
+        return proposal
+
+    def cancel_proposal(self, proposal: Proposal[CommonPlayer]) -> None:
+        proposal.cancel()
+        self.proposal_index.remove(proposal)
+        self._record(Event.CANCEL, proposal.source, proposal.target)
+
+    def add_botswap(self, botswap: BotSwap) -> None:
+        for party in self, botswap.source, botswap.target:
+            party.botswaps.append(botswap)
+        self._record(Event.BOTSWAP, botswap.source, botswap.target,
+                     botswap.guarantor, botswap.garnets)
+
+    def cancel_botswap(self, botswap: BotSwap) -> None:
+        botswap.cancel()
+        for party in self, botswap.source, botswap.target:
+            party.botswaps.remove(botswap)
+        self._record(Event.CANCEL_BOTSWAP, botswap.source, botswap.target,
+                     botswap.guarantor, botswap.garnets)
+
+    def give_garnets(self, target: CommonPlayer, amount: int) -> None:
+        if amount > self.garnets:
+            raise DiscordGameException(
+                'Error: cannot donate more garnets than you have.')
+        if amount <= 0:
+            raise DiscordGameException(
+                'Error: invalid garnet amount')
+        self.garnets -= amount
+        target.garnets += amount
+        self._record(Event.DONATE, self, target, amount)
+
+    def _record(self, event: Event, *values: Any) -> None:
+        """Mark the game as changed, and record event in its journal, with
+        players as their index."""
+        game = self.game
+        if not isinstance(game, ProposalGame):
+            return
+        game.dirty = True
+        if game.journal is not None:
+            game.record(event, *(
+                game.players.index(x) if isinstance(x, CommonPlayer) else x
+                for x in values))
+
+    # TODO: Move to Proposal, so there is only one visible entry point
+    # having both Player.accept_proposal and proposal.accept it's not
+    # intuitive which one should be called from the outside.
+
+    def accept_proposal(self, proposal: Proposal[CommonPlayer]) -> None:
+        proposal.accept()
+        self.proposal_index.remove(proposal)
+        self._record(Event.ACCEPT, proposal.source, proposal.target)
+
     def new_round(self) -> None:
         super().new_round()
-        for proposal in self.proposals:
-            proposal.cancel()
-        self.proposals.clear()
-
+        # Proposals are cleared all at once by the game. Botswaps are shared
+        # with both bots, so only the guarantor releases the garnets.
         for botswap in self.botswaps:
-            botswap.cancel()
+            if botswap.guarantor == self:
+                botswap.cancel()
         self.botswaps.clear()
 
         self.public_seat = self.seat
 
-    def matches(self, search_key: str) -> bool:
-        raise NotImplementedError('Virtual method matches.')
+    def search_keys(self) -> typing.List[str]:
+        """Lowercase keys this player can be found by."""
+        raise NotImplementedError('Virtual method search_keys.')
 
     @classmethod
     def find(cls: typing.Type[GenF], search_key: str, **kwargs: Any) -> GenF:
         assert 'game' in kwargs
-        game: DiscordGame = kwargs['game']  # DiscordGame?
+        game: ProposalGame = kwargs['game']
 
-        for player in game.players:
-            if player.matches(search_key):
-                if isinstance(player, cls):
-                    return player
-                raise DiscordGameException(
-                    'Error: Found {} which is a {} and not a {}.'.format(
-                        player, type(player).__name__, cls.__name__))
-        raise DiscordGameException(
-            'Error: Found no {} matching `{}`.'.format(
-                cls.__name__, search_key))
+        return game.find_player(search_key, cls)
 
 
 class DiscordPlayer(CommonPlayer):
@@ -120,78 +205,34 @@ class DiscordPlayer(CommonPlayer):
     def __str__(self) -> str:
         return cast(str, self.user.display_name)
 
-    def matches(self, search_key: str) -> bool:
-        if search_key.lower() in (self.user.name.lower(),
-                                  self.user.display_name.lower()):
-            return True
-        if search_key.isdigit():
-            if (int(search_key) == self.user.id
-                    or int(search_key) == self.seat):
-                return True
-        return False
+    def search_keys(self) -> typing.List[str]:
+        return [self.user.name.lower(), self.user.display_name.lower(),
+                str(self.user.id)]
 
-    async def send(self, *args: Any, **kwargs: str) -> discord.Message:
+    @property
+    def discord_game(self) -> DiscordGame:
+        if not isinstance(self.game, DiscordGame):
+            raise DiscordGameException(
+                '{} is not in a game.'.format(self))
+        return self.game
+
+    async def dm_channel(self) -> SeatChannel:
         if self._channel is None:
             self._channel = await SeatChannel.from_user(self.user)
-        return await self._channel.send(*args, **kwargs)
+        return self._channel
+
+    async def send(self, *args: Any, **kwargs: str) -> discord.Message:
+        channel = await self.dm_channel()
+        return await channel.send(*args, **kwargs)
 
     @property
     def assigned_numbers(self) -> Dict[SeatPlayer, PrivateNumber]:
-        if self not in self._assigned_numbers:
-            self._assigned_numbers[self] = self.number
+        # players are reseated when the game starts
+        self._assigned_numbers[self] = self.number
         return self._assigned_numbers
 
-    def add_proposal_to(self,
-                        target: CommonPlayer,
-                        garnets: int = 0) -> Proposal[CommonPlayer]:
-        for prop in self.outgoing_proposals:
-            if prop.target == target:
-                raise DiscordGameException(
-                    'You already have a proposal to {}'.format(target))
-
-        proposal = Proposal(self, target, garnets)
-
-        self.proposals.append(proposal)
-        target.proposals.append(proposal)
-
-        return proposal
-
-    def add_botswap(self, botswap: BotSwap) -> None:
-        for party in self, botswap.source, botswap.target:
-            party.botswaps.append(botswap)
-
-    # TODO: Move to Proposal, so there is only one visible entry point
-    # having both Player.accept_proposal and proposal.accept it's not
-    # intuitive which one should be called from the outside.
-
-    def accept_proposal(self, proposal: Proposal[CommonPlayer]) -> None:
-        proposal.accept()
-        for party in self, proposal.source:
-            party.proposals.remove(proposal)
-
-    def cancel_proposal(self, proposal: Proposal[CommonPlayer]) -> None:
-        proposal.cancel()
-        self.proposals.remove(proposal)
-        if proposal.source == self:
-            proposal.target.proposals.remove(proposal)
-        else:
-            proposal.source.proposals.remove(proposal)
-
-    def cancel_botswap(self, botswap: BotSwap) -> None:
-        botswap.cancel()
-        for party in self, botswap.source, botswap.target:
-            party.botswaps.remove(botswap)
-
     async def donate_garnets(self, target: CommonPlayer, amount: int) -> None:
-        if amount > self.garnets:
-            raise DiscordGameException(
-                'Error: cannot donate more garnets than you have.')
-        if amount <= 0:
-            raise DiscordGameException(
-                'Error: invalid garnet amount')
-        self.garnets -= amount
-        target.garnets += amount
-
+        self.give_garnets(target, amount)
         await target.received_garnets(self, amount)
 
 
@@ -205,8 +246,8 @@ class BotPlayer(CommonPlayer):
     def __str__(self) -> str:
         return self.name.title()
 
-    def matches(self, search_key: str) -> bool:
-        return search_key.lower() == self.name.lower()
+    def search_keys(self) -> typing.List[str]:
+        return [self.name.lower()]
 
     async def send(self, *args: Any, **kwargs: str) -> discord.Message:
         # The return value should never be used, so we're fine with an
@@ -221,9 +262,85 @@ class BotPlayer(CommonPlayer):
                 'their secret number is {}'.format(
                     self.name, self.number))
 
+    def accepts(self, proposal: Proposal[CommonPlayer]) -> bool:
+        # pylint: disable=unused-argument,no-self-use
+        return True
+
+
+_SEARCH_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def search_pool() -> ProcessPoolExecutor:
+    """Process pool for bot searches, so they never block the event loop."""
+    global _SEARCH_POOL  # pylint: disable=global-statement
+    if _SEARCH_POOL is None:
+        _SEARCH_POOL = ProcessPoolExecutor()
+    return _SEARCH_POOL
+
+
+class StrategicBotPlayer(BotPlayer):
+    """A bot that each round searches for the fewest swaps giving a winning
+    streak including itself. It proposes the first swap of that plan if it's
+    part of it, and only accepts proposals that don't shorten its streak.
+
+    Unlike players it sees the whole table."""
+    def __init__(self,
+                 name: str,
+                 garnets: int = 0) -> None:
+        super().__init__(name, garnets)
+        self.accepted_numbers: Optional[typing.Set[int]] = None
+
+    def accepts(self, proposal: Proposal[CommonPlayer]) -> bool:
+        return (self.accepted_numbers is None
+                or proposal.source.number in self.accepted_numbers)
+
+    def new_round(self) -> None:
+        super().new_round()
+        self.accepted_numbers = None
+
+    async def plan_round(self, game: DiscordGame) -> None:
+        """Search for the best swaps from the current seating, and act on
+        the result if the seating is still the same once it's done."""
+        current_round = game.current_round
+        seat_numbers = list(game.seat_numbers)
+        time_budget = game.options['bot_search_time']
+        if game.options['round_length'] >= 0:
+            time_budget = min(time_budget, game.options['round_length'])
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            search_pool(),
+            functools.partial(
+                seat_search.search,
+                seat_numbers, [int(x) for x in game.current_x],
+                game.win_streak_length, int(self.seat), time_budget))
+
+        # players may have swapped, joined or left during the search
+        if (not game.running or game.current_round != current_round
+                or list(game.seat_numbers) != seat_numbers):
+            return
+
+        self.accepted_numbers = set(result.acceptable)
+        game.record(Event.BOT_PLAN, game.players.index(self),
+                    tail=bytes(sorted(self.accepted_numbers)))
+
+        if result.first_swap is None or self.seat not in result.first_swap:
+            return
+
+        other_seat = sum(result.first_swap) - self.seat
+        target = game.player_in_seat(other_seat)
+        if (target.swapped
+                or self.proposal_index.get(self, target) is not None):
+            return
+
+        self.add_proposal_to(target)
+        await target.send(
+            'Proposal received from {} offering 0.'.format(self))
+
 
 CP = typing.TypeVar('CP', bound=CommonPlayer)
 ListProposals = typing.List['Proposal[CommonPlayer]']
+ProposalHeap = typing.List[
+    typing.Tuple[int, float, int, 'Proposal[CommonPlayer]']]
 
 
 class Proposal(Findable, typing.Generic[CP]):
@@ -242,14 +359,18 @@ class Proposal(Findable, typing.Generic[CP]):
         assert 'player' in kwargs
         player: DiscordPlayer = kwargs['player']
 
-        for proposal in player.proposals:
-            if (proposal.source.matches(search_key)
-                    or proposal.target.matches(search_key)):
-                if not isinstance(proposal, cls):
-                    raise DiscordGameException(
-                        'Expected type {}, found {}'.format(
-                            cls, type(proposal)))
-                return proposal
+        index = player.proposal_index
+        # errors finding the player, e.g. an ambiguous name, are raised as
+        # they are, with their suggestions
+        other = CommonPlayer.find(search_key, game=player.game)
+
+        proposal = index.get(player, other) or index.get(other, player)
+        if proposal is not None:
+            if not isinstance(proposal, cls):
+                raise DiscordGameException(
+                    'Expected type {}, found {}'.format(
+                        cls, type(proposal)))
+            return proposal
         raise DiscordGameException(
             'Error: Found no {} with a player matching `{}`.'.format(
                 cls.__name__.lower(), search_key))
@@ -305,7 +426,7 @@ class BotSwap(Proposal[BotPlayer]):
     def __init__(self,
                  source: BotPlayer,
                  target: BotPlayer,
-                 guarantor: DiscordPlayer,
+                 guarantor: CommonPlayer,
                  garnets: int = 0):
         self.guarantor = guarantor
         super().__init__(source, target, garnets)
@@ -321,7 +442,7 @@ class BotSwap(Proposal[BotPlayer]):
                     self.source, self.target,
                     self.guarantor, self.garnets))
 
-    def __keys(self) -> typing.Tuple[BotPlayer, BotPlayer, DiscordPlayer, int]:
+    def __keys(self) -> typing.Tuple[BotPlayer, BotPlayer, CommonPlayer, int]:
         return (self.source, self.target, self.guarantor, self.garnets)
 
     def __eq__(self, other: typing.Any) -> bool:
@@ -345,7 +466,9 @@ class BotSwap(Proposal[BotPlayer]):
 
     def _award_garnets(self) -> None:
         rewards = [math.ceil(self.garnets/2), math.floor(self.garnets/2)]
-        random.shuffle(rewards)
+        game = self.source.game
+        assert game is not None
+        game.rng.shuffle(rewards)
         self.source.garnets += rewards[0]
         self.target.garnets += rewards[1]
 
@@ -353,6 +476,514 @@ class BotSwap(Proposal[BotPlayer]):
         self.guarantor.garnets += self.garnets
 
 
+def _top_proposals(heap: ProposalHeap) -> ListProposals:
+    """The two highest proposals in a heap, highest first."""
+    res = [entry[3] for entry in heap[:1]]
+    if len(heap) > 1:
+        res.append(min(heap[1:3])[3])
+    return res
+
+
+def resolve_botswaps_proposals(
+        bots: typing.Iterable[BotPlayer],
+        rng: random.Random
+) -> typing.Tuple[typing.List[BotSwap], ListProposals]:
+    """Accept botswaps and proposals to bots at the end of a round, returns
+    the ones that were accepted.
+
+    Botswaps are accepted, in order of garnets, if they offer more than the
+    highest proposals to their bots. The remaining proposals are then
+    accepted in order of garnets. Ties are resolved in a random order, drawn
+    from rng.
+
+    Proposals are kept in a max-heap per bot, and a bot's heap is dropped
+    once a botswap with it wins, so this is O((P + B) log P)."""
+    heaps: Dict[BotPlayer, ProposalHeap] = {}
+    # a dict rather than a set, so the order doesn't depend on hashes
+    botswap_set: Dict[BotSwap, None] = {}
+    accepted_botswaps: typing.List[BotSwap] = []
+    accepted_proposals: ListProposals = []
+
+    for bot in bots:
+        heap = [(-x.garnets, rng.random(), id(x), x)
+                for x in bot.incoming_proposals
+                if not x.source.swapped and bot.accepts(x)]
+        heapq.heapify(heap)
+        heaps[bot] = heap
+        botswap_set.update(dict.fromkeys(bot.botswaps))
+
+    botswaps = sorted(botswap_set,
+                      key=lambda x: (-x.garnets, rng.random()))
+
+    def garnets(proposals: ListProposals, index: int) -> int:
+        if index < len(proposals):
+            return proposals[index].garnets
+        return 0
+
+    for botswap in botswaps:
+        source_proposals = _top_proposals(heaps.get(botswap.source, []))
+        target_proposals = _top_proposals(heaps.get(botswap.target, []))
+
+        source_max = garnets(source_proposals, 0)
+        target_max = garnets(target_proposals, 0)
+        total = source_max+target_max
+
+        # to avoid exploit where another player screws a botswap
+        # by proposing to both targets
+        if (source_proposals and target_proposals and
+                source_proposals[0].source == target_proposals[0].source):
+            total = max(source_max + garnets(target_proposals, 1),
+                        target_max + garnets(source_proposals, 1))
+
+        if (botswap.garnets > total
+                or (not source_proposals and not target_proposals)):
+            try:
+                botswap.accept()
+            except SeatException:
+                pass
+            else:
+                accepted_botswaps.append(botswap)
+                for party in (botswap.guarantor, botswap.source,
+                              botswap.target):
+                    party.botswaps.remove(botswap)
+            # proposals to these bots are dropped, even if the botswap
+            # failed because one of them had already swapped
+            heaps.pop(botswap.source, None)
+            heaps.pop(botswap.target, None)
+
+    remaining = sorted(entry for heap in heaps.values() for entry in heap)
+    for entry in remaining:
+        proposal = entry[3]
+        if proposal.source.swapped or proposal.target.swapped:
+            continue
+        try:
+            proposal.accept()
+        except SeatException:
+            pass
+        else:
+            accepted_proposals.append(proposal)
+            proposal.source.proposal_index.remove(proposal)
+
+    return accepted_botswaps, accepted_proposals
+
+
+def resolve_botswaps_proposals_optimally(
+        bots: typing.Iterable[BotPlayer],
+        rng: random.Random
+) -> typing.Tuple[typing.List[BotSwap], ListProposals]:
+    """Accept the botswaps and proposals to bots that pay the most garnets in
+    total, where every player swaps at most once. Among those, as many swaps
+    as possible are made. Returns the ones that were accepted.
+
+    Players are vertices and botswaps and proposals are edges, so this is a
+    maximum weight matching, solved with networkx in O(V^3). A botswap
+    between a bot and itself is an edge to a vertex of its own. Proposing to
+    both bots of a botswap can't block it, as a player only counts once."""
+    # only needed for this mode
+    import networkx  # type: ignore # pylint: disable=import-outside-toplevel
+
+    candidates: typing.List[Proposal[typing.Any]] = []
+    # a dict rather than a set, so the order doesn't depend on hashes
+    botswap_set: Dict[BotSwap, None] = {}
+    for bot in bots:
+        candidates += [x for x in bot.incoming_proposals
+                       if not x.source.swapped and bot.accepts(x)]
+        botswap_set.update(dict.fromkeys(bot.botswaps))
+    candidates += [x for x in botswap_set
+                   if not x.source.swapped and not x.target.swapped]
+    rng.shuffle(candidates)
+
+    # weights count garnets first, then swaps
+    scale = len(candidates) + 1
+    graph = networkx.Graph()
+    edges: Dict[typing.Tuple[Any, Any], Proposal[typing.Any]] = {}
+    for candidate in candidates:
+        source: Any = candidate.source
+        target: Any = candidate.target
+        if source is target:
+            target = candidate
+        weight = candidate.garnets*scale + 1
+        if (graph.has_edge(source, target)
+                and graph[source][target]['weight'] >= weight):
+            continue
+        graph.add_edge(source, target, weight=weight)
+        edges[source, target] = edges[target, source] = candidate
+
+    accepted_botswaps: typing.List[BotSwap] = []
+    accepted_proposals: ListProposals = []
+    # accepted in the order of candidates, as the matching is a set, so
+    # botswaps draw their garnet split from rng in the same order every time
+    matched = set(id(edges[edge])
+                  for edge in networkx.max_weight_matching(graph))
+    for candidate in candidates:
+        if id(candidate) not in matched:
+            continue
+        matched.discard(id(candidate))
+        candidate.accept()
+        if isinstance(candidate, BotSwap):
+            accepted_botswaps.append(candidate)
+            for party in (candidate.guarantor, candidate.source,
+                          candidate.target):
+                party.botswaps.remove(candidate)
+        else:
+            accepted_proposals.append(candidate)
+            candidate.source.proposal_index.remove(candidate)
+
+    return accepted_botswaps, accepted_proposals
+
+
+BOT_RESOLUTION_STRINGS = {
+    'greedy': 'in order of garnets',
+    'optimal': 'to get the most garnets in total',
+}
+
+BOT_RESOLUTIONS = {
+    'greedy': resolve_botswaps_proposals,
+    'optimal': resolve_botswaps_proposals_optimally,
+}
+
+
+def award_win_garnets(game: SeatGame[CommonPlayer],
+                      options: Dict[str, Any]) -> None:
+    for player in game.winners:
+        player.garnets += options['win_garnets']
+    for player in game.current_x_players:
+        player.garnets += options['x_garnets']
+
+    streak_length = game.win_streak_length
+    middle_garnets = options['middle_garnets']
+    winners = game.winners
+    if streak_length % 2 == 0:
+        winners[streak_length//2].garnets += middle_garnets//2
+        winners[streak_length//2-1].garnets += middle_garnets//2
+    else:
+        winners[(streak_length-1)//2].garnets += middle_garnets
+
+
+def _edit_distance(first: str, second: str) -> int:
+    previous = list(range(len(second)+1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1,
+                               current[j-1] + 1,
+                               previous[j-1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+
+class PlayerIndex:
+    """Players of a game by their lowercase search keys, i.e. names, display
+    names and user ids, so finding a player by key is O(1).
+
+    Keys are also kept sorted, for finding players by a prefix of a key."""
+    def __init__(self) -> None:
+        self._players: Dict[str, typing.List[CommonPlayer]] = {}
+        self._keys: Dict[CommonPlayer, typing.List[str]] = {}
+        self._sorted_keys: typing.List[str] = []
+
+    def add(self, player: CommonPlayer) -> None:
+        keys = list(dict.fromkeys(player.search_keys()))
+        self._keys[player] = keys
+        for key in keys:
+            if key not in self._players:
+                self._players[key] = []
+                bisect.insort(self._sorted_keys, key)
+            self._players[key].append(player)
+
+    def remove(self, player: CommonPlayer) -> None:
+        for key in self._keys.pop(player, ()):
+            self._players[key].remove(player)
+            if not self._players[key]:
+                del self._players[key]
+                del self._sorted_keys[
+                    bisect.bisect_left(self._sorted_keys, key)]
+
+    def update(self, player: CommonPlayer) -> None:
+        """Reindex a player whose keys have changed, e.g. a new nickname."""
+        self.remove(player)
+        self.add(player)
+
+    def exact(self, key: str) -> typing.List[CommonPlayer]:
+        return list(self._players.get(key, ()))
+
+    def prefixed(self, prefix: str) -> typing.List[CommonPlayer]:
+        """Players with a key starting with prefix."""
+        res: Dict[CommonPlayer, None] = {}
+        index = bisect.bisect_left(self._sorted_keys, prefix)
+        for key in self._sorted_keys[index:]:
+            if not key.startswith(prefix):
+                break
+            res.update(dict.fromkeys(self._players[key]))
+        return list(res)
+
+    def similar(self, key: str) -> typing.List[CommonPlayer]:
+        """Players with a key at the smallest edit distance from key, if it's
+        at most MAX_EDIT_DISTANCE, or 1 for short keys."""
+        max_distance = 1 if len(key) <= 4 else MAX_EDIT_DISTANCE
+        res: Dict[CommonPlayer, None] = {}
+        for other in self._sorted_keys:
+            if abs(len(other) - len(key)) > max_distance:
+                continue
+            distance = _edit_distance(key, other)
+            if distance < max_distance:
+                max_distance = distance
+                res.clear()
+            if distance == max_distance:
+                res.update(dict.fromkeys(self._players[other]))
+        return list(res)
+
+
+class ProposalIndex:
+    """All proposals in a game keyed by (source, target), with each player's
+    incoming and outgoing proposals keyed by the other player, so adding,
+    finding and removing a proposal is O(1)."""
+    def __init__(self) -> None:
+        self._proposals: Dict[typing.Tuple[CommonPlayer, CommonPlayer],
+                              Proposal[CommonPlayer]] = {}
+        self._incoming: Dict[CommonPlayer,
+                             Dict[CommonPlayer, Proposal[CommonPlayer]]] = {}
+        self._outgoing: Dict[CommonPlayer,
+                             Dict[CommonPlayer, Proposal[CommonPlayer]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._proposals)
+
+    def __iter__(self) -> typing.Iterator[Proposal[CommonPlayer]]:
+        return iter(list(self._proposals.values()))
+
+    def get(self, source: CommonPlayer,
+            target: CommonPlayer) -> Optional[Proposal[CommonPlayer]]:
+        return self._proposals.get((source, target))
+
+    def add(self, proposal: Proposal[CommonPlayer]) -> None:
+        source, target = proposal.source, proposal.target
+        if (source, target) in self._proposals:
+            raise DiscordGameException(
+                '{} already has a proposal to {}'.format(source, target))
+        self._proposals[source, target] = proposal
+        self._outgoing.setdefault(source, {})[target] = proposal
+        self._incoming.setdefault(target, {})[source] = proposal
+
+    def remove(self, proposal: Proposal[CommonPlayer]) -> None:
+        source, target = proposal.source, proposal.target
+        del self._proposals[source, target]
+        del self._outgoing[source][target]
+        del self._incoming[target][source]
+
+    def incoming(self, player: CommonPlayer) -> ListProposals:
+        return list(self._incoming.get(player, {}).values())
+
+    def outgoing(self, player: CommonPlayer) -> ListProposals:
+        return list(self._outgoing.get(player, {}).values())
+
+    def of_player(self, player: CommonPlayer) -> ListProposals:
+        return self.incoming(player) + self.outgoing(player)
+
+    def clear(self) -> None:
+        """Cancel all proposals at once, releasing their garnets."""
+        for proposal in self._proposals.values():
+            proposal.cancel()
+        self._proposals.clear()
+        self._incoming.clear()
+        self._outgoing.clear()
+
+
+class ProposalGame(SeatGame[CommonPlayer]):
+    """A SeatGame where players make proposals to each other and to bots,
+    which are resolved at the end of each round.
+
+    Every change of the game is recorded in its journal, if it has one, from
+    which seat_replay rebuilds it."""
+    def __init__(self,
+                 options: Optional[Dict[str, Any]] = None,
+                 seed: Optional[int] = None) -> None:
+        super().__init__(options, seed)
+        self.bots: Dict[str, BotPlayer] = {}
+        self.proposal_index = ProposalIndex()
+        self.player_index = PlayerIndex()
+        self.journal: Optional[Journal] = None
+        # whether the game changed since it was last saved
+        self.dirty = True
+
+        # admin swaps, with the swapped flags of the players before them,
+        # cleared each round
+        self.undo_stack: typing.List[typing.Tuple[
+            CommonPlayer, CommonPlayer, bool, bool]] = []
+
+    def record(self, event: Event, *values: Any, tail: bytes = b'') -> None:
+        self.dirty = True
+        if self.journal is not None:
+            self.journal.append(event, *values, tail=tail)
+
+    def attach_journal(self, journal: Journal) -> None:
+        """Record the game in journal from now on, starting with its seed
+        and options. The game must not have any players yet."""
+        if self.players:
+            raise DiscordGameException(
+                "Can't journal a game that already has players.")
+        self.journal = journal
+        self.record(Event.CREATE, self.seed,
+                    tail=json.dumps(self._options).encode())
+
+    def close_journal(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def set_option(self, name: str, value: Any) -> None:
+        encoded = name.encode()
+        self.record(Event.OPTION, len(encoded),
+                    tail=encoded + json.dumps(value).encode())
+        self._options[name] = value
+
+    def add_player(self, player: CommonPlayer) -> None:
+        super().add_player(player)
+        self.player_index.add(player)
+
+    def add_players(self, players: typing.Iterable[CommonPlayer]) -> None:
+        players = list(players)
+        super().add_players(players)
+        for player in players:
+            self.player_index.add(player)
+
+    def remove_player(self, player: CommonPlayer) -> None:
+        super().remove_player(player)
+        self.player_index.remove(player)
+
+    def restore_players(self, players: typing.Iterable[CommonPlayer],
+                        snapshot: SeatSnapshot) -> None:
+        """Add players with the seats and numbers they have in snapshot, e.g.
+        when loading a saved game."""
+        players = list(players)
+        self.players += players
+        for player in players:
+            player.game = self
+            self.player_index.add(player)
+        self.restore(snapshot)
+
+    def _player_by_seat(self, search_key: str) -> Optional[CommonPlayer]:
+        """The player in the seat given by number or letter, if any."""
+        if search_key.isdigit():
+            seat = int(search_key)
+        elif len(search_key) == 1 and search_key.isalpha():
+            seat = ord(search_key.upper()) - ord('A')
+        else:
+            return None
+        if not 0 <= seat < self.player_count:
+            return None
+        return self.player_in_seat(seat)
+
+    def find_player(self, search_key: str,
+                    player_type: typing.Type[GenF]) -> GenF:
+        """Find a player of player_type by name, display name, user id or
+        seat, or by an unambiguous prefix of a name. Errors suggest players
+        with similar names."""
+        key = search_key.lower()
+        index = self.player_index
+        matches = index.exact(key)
+        if not matches:
+            seat_player = self._player_by_seat(key)
+            matches = [seat_player] if seat_player else index.prefixed(key)
+
+        if len(matches) > 1:
+            typed: typing.List[CommonPlayer] = [
+                x for x in matches if isinstance(x, player_type)]
+            matches = typed or matches
+        if len(matches) > 1:
+            raise DiscordGameException(
+                'Error: `{}` matches several players, did you mean {}?'
+                ''.format(search_key, ' or '.join(str(x) for x in matches)))
+
+        if matches:
+            if isinstance(matches[0], player_type):
+                return matches[0]
+            raise DiscordGameException(
+                'Error: Found {} which is a {} and not a {}.'.format(
+                    matches[0], type(matches[0]).__name__,
+                    player_type.__name__))
+
+        suggestions = [x for x in index.similar(key)
+                       if isinstance(x, player_type)]
+        did_you_mean = ''
+        if suggestions:
+            did_you_mean = ' Did you mean {}?'.format(
+                ' or '.join(str(x) for x in suggestions))
+        raise DiscordGameException(
+            'Error: Found no {} matching `{}`.{}'.format(
+                player_type.__name__, search_key, did_you_mean))
+
+    def resolve_bots(
+            self) -> typing.Tuple[typing.List[BotSwap], ListProposals]:
+        """Accept botswaps and proposals to bots, as chosen by the
+        bot_resolution option."""
+        resolution = self._options.get('bot_resolution',
+                                       DEFAULT_BOT_RESOLUTION)
+        return BOT_RESOLUTIONS[resolution](self.bots.values(), self.rng)
+
+    def begin(self) -> None:
+        """Seat the players for the first round."""
+        self.record(Event.START)
+        if self.journal is not None:
+            self.journal.release()
+        self.seat_players()
+        for player in self.players:
+            player.new_round()
+
+    def next_round(self) -> bool:
+        """Start the next round, after bots have been resolved, or award the
+        win garnets if the game is over. Returns whether it is."""
+        if self.game_over:
+            award_win_garnets(self, self._options)
+            return True
+
+        for player in self.players:
+            player.new_round()
+        self.new_round()
+        self.undo_stack.clear()
+        return False
+
+    def new_round(self) -> None:
+        self.proposal_index.clear()
+        super().new_round()
+
+    def snapshot(self) -> SeatSnapshot:
+        return dataclasses.replace(
+            super().snapshot(),
+            garnets=tuple(player.garnets for player in self.players))
+
+    def restore(self, snapshot: SeatSnapshot) -> None:
+        super().restore(snapshot)
+        for player, garnets in zip(self.players, snapshot.garnets):
+            player.garnets = garnets
+
+    def undoable_swap(self, source: CommonPlayer, target: CommonPlayer,
+                      force: bool = False) -> None:
+        swapped = (source.swapped, target.swapped)
+        source.swap(target, force)
+        self.record(Event.SWAP, self.players.index(source),
+                    self.players.index(target), force)
+        self.undo_stack.append((source, target, *swapped))
+        del self.undo_stack[:-MAX_UNDO]
+
+    def undo(self) -> None:
+        """Swap back the players of the last undoable swap. Only their seats
+        and swapped flags change, garnets and proposals are left as they
+        are."""
+        if not self.undo_stack:
+            raise DiscordGameException('Nothing to undo.')
+        source, target, source_swapped, target_swapped = self.undo_stack[-1]
+        if source not in self.players or target not in self.players:
+            raise DiscordGameException(
+                "Can't undo the swap of {} and {}, as one of them has left."
+                "".format(source, target))
+        self.undo_stack.pop()
+        self.record(Event.UNDO)
+        self.swap_seats(int(source.seat), int(target.seat))
+        source.swapped = source_swapped
+        target.swapped = target_swapped
+
+
 class ReactFunction:  # pylint: disable=too-few-public-methods
     def __init__(self,
                  message: discord.Message,
@@ -363,61 +994,190 @@ class ReactFunction:  # pylint: disable=too-few-public-methods
         self.react_needed = react_needed
 
     async def on_react(self,
-                       reaction: discord.Reaction,
-                       user: discord.User) -> None:
+                       payload: discord.RawReactionActionEvent) -> None:
         raise NotImplementedError('Virtual function.')
 
+    async def on_unreact(self,
+                         payload: discord.RawReactionActionEvent) -> None:
+        pass
+
 
 class NewRoundEarly(ReactFunction):  # pylint: disable=too-few-public-methods
+    """The vote of the players of game for starting the next round early,
+    which starts it the moment react_needed of them have reacted with emoji.
+
+    Votes are tallied from raw reaction events, as the reaction count also
+    has the bot and anyone else reacting. Reactions of users that may not
+    vote are removed later, in a batch by the dispatcher."""
     def __init__(self, game: DiscordGame,
                  message: discord.Message,
                  emoji: str,
                  react_needed: int) -> None:
         super().__init__(message, emoji, react_needed)
         self.game = game
+        self.eligible = frozenset(
+            user.id for user in game.discord_players)
+        self.voters: typing.Set[int] = set()
+        self.passed = False
 
     async def on_react(self,
-                       reaction: discord.Reaction,
-                       user: discord.User) -> None:
-        print('on_react')
-        if reaction.emoji != self.emoji:
-            print('wrong_emoji')
+                       payload: discord.RawReactionActionEvent) -> None:
+        if self.passed or str(payload.emoji) != self.emoji:
             return
-        if user not in self.game and user.id != BOT_ID:
-            await reaction.remove(user)
-            await user.send(
-                'Error: You are not allowed to vote on that message.')
+        if payload.user_id not in self.eligible:
+            if payload.user_id != BOT_ID:
+                self.game.dispatcher.remove_reaction(
+                    self.message, payload.emoji, payload.user_id)
             return
-        if reaction.count < self.react_needed:
+        self.voters.add(payload.user_id)
+        if len(self.voters) < self.react_needed:
             return
 
+        self.passed = True
         await self.game.force_new_round()
 
+    async def on_unreact(self,
+                         payload: discord.RawReactionActionEvent) -> None:
+        if str(payload.emoji) != self.emoji:
+            return
+        self.voters.discard(payload.user_id)
+        self.game.dispatcher.keep_reaction(self.message.id, payload.emoji,
+                                           payload.user_id)
 
-class DiscordGame(SeatGame[CommonPlayer]):
+
+class ReactionRegistry:
+    """The ReactFunction of each message over all games of the bot, by
+    message id, so a raw reaction event is dispatched in O(1) without the
+    message having to be in discord.py's cache.
+
+    Games drop the handler of their vote message when the round ends.
+    Handlers are dropped anyway after ttl seconds, and the oldest first
+    when there are more than limit."""
+    def __init__(self,
+                 ttl: float = REACTION_TTL,
+                 limit: int = MAX_REACTABLE_MESSAGES) -> None:
+        self.ttl = ttl
+        self.limit = limit
+        # in the order added, which is also the order they expire
+        self._handlers: typing.OrderedDict[
+            int, typing.Tuple[float, ReactFunction]] = (
+                collections.OrderedDict())
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def add(self, message_id: int, handler: ReactFunction) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        self._handlers[message_id] = (now + self.ttl, handler)
+        while len(self._handlers) > self.limit:
+            self._handlers.popitem(last=False)
+
+    def remove(self, message_id: int) -> None:
+        self._handlers.pop(message_id, None)
+
+    def get(self, message_id: int) -> Optional[ReactFunction]:
+        entry = self._handlers.get(message_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._handlers[message_id]
+            return None
+        return entry[1]
+
+    def _expire(self, now: float) -> None:
+        while self._handlers:
+            expires, _ = next(iter(self._handlers.values()))
+            if expires > now:
+                return
+            self._handlers.popitem(last=False)
+
+
+class UserRegistry:
+    """The DiscordPlayer of each user over all games of the bot, by user id,
+    so finding the game and player of a command's author is O(1) regardless
+    of the number of games.
+
+    A user is in at most one active game, which is the one registered.
+    Players of a finished game stay registered, so they can still use it,
+    until they join another game or the game is replaced."""
+    def __init__(self) -> None:
+        self._players: Dict[int, DiscordPlayer] = {}
+
+    def add(self, player: DiscordPlayer) -> None:
+        self._players[player.user.id] = player
+
+    def remove(self, player: DiscordPlayer) -> None:
+        if self._players.get(player.user.id) is player:
+            del self._players[player.user.id]
+
+    def remove_game(self, game: DiscordGame) -> None:
+        for player in game.discord_players.values():
+            self.remove(player)
+
+    def finish_game(self, game: DiscordGame) -> None:
+        """Called once game is over or stopped, its players stay
+        registered."""
+
+    def player(self, user: discord.User) -> Optional[DiscordPlayer]:
+        return self._players.get(user.id)
+
+    def game(self, user: discord.User) -> Optional[DiscordGame]:
+        player = self._players.get(user.id)
+        return player.discord_game if player is not None else None
+
+    def active_player(self, user: discord.User) -> Optional[DiscordPlayer]:
+        """The player of user if its game is neither over nor stopped."""
+        player = self._players.get(user.id)
+        if player is None or not player.discord_game.active:
+            return None
+        return player
+
+
+class DiscordGame(ProposalGame):
     default_options: typing.Dict[str, Any] = strings.DEFAULT_OPTIONS
 
     def __init__(self,
                  channel: SeatChannel,
-                 options: Optional[Dict[str, Any]] = None) -> None:
+                 options: Optional[Dict[str, Any]] = None,
+                 seed: Optional[int] = None) -> None:
         self.options = options if options is not None else {}
         if 'round_length' not in self.options:
             self.options['round_length'] = DEFAULT_ROUND_LENGTH
         if 'public_swaps' not in self.options:
             self.options['public_swaps'] = DEFAULT_PUBLIC_SWAPS
+        if 'bot_resolution' not in self.options:
+            self.options['bot_resolution'] = DEFAULT_BOT_RESOLUTION
+        if 'bot_search_time' not in self.options:
+            self.options['bot_search_time'] = DEFAULT_BOT_SEARCH_TIME
         for key in self.default_options:
             if key not in self.options:
                 self.options[key] = self.default_options[key]
 
-        super().__init__(self.options)
+        super().__init__(self.options, seed)
 
         self.channel: SeatChannel = channel
         self.state: GameState = GameState.CREATED
-        self.reactable_messages: Dict[discord.Message, ReactFunction] = {}
 
         # TODO: Remove, but requires some refactoring
         self.discord_players: Dict[discord.User, DiscordPlayer] = {}
-        self.bots: Dict[str, BotPlayer] = {}
+
+        # replaced by those of the bot when added to its games
+        self.users = UserRegistry()
+        self.reactions = ReactionRegistry()
+        self.dispatcher = Dispatcher()
+        self.scheduler = Scheduler()
+
+        self._round_timer: Optional[Timer] = None
+        self._countdown_timer: Optional[Timer] = None
+        # the message voted on for starting the next round early
+        self._vote_message_id: Optional[int] = None
+        # searches of strategic bots, kept so they aren't garbage collected
+        self._planning: typing.Set[asyncio.Task[None]] = set()
+        # set by the bot to save the game on every transition
+        self.store: Optional[GameStore] = None
+        # when the game was over or stopped, in seconds since the epoch
+        self.finished_at: Optional[float] = None
 
     async def send(self,
                    *args: Any,
@@ -428,6 +1188,7 @@ class DiscordGame(SeatGame[CommonPlayer]):
         if author.ready:
             raise DiscordGameException('{} already ready.'.format(author))
         author.ready = True
+        self.dirty = True
 
         await self.send('{} ready.'.format(author))
 
@@ -447,26 +1208,40 @@ class DiscordGame(SeatGame[CommonPlayer]):
             return
 
         self.state = GameState.STARTING
+        if self._countdown_timer is not None:
+            self._countdown_timer.cancel()
+        await self._countdown(timer)
 
-        for time in range(timer, 0, -5):
-            await self.send('Starting game in {} seconds.'.format(time))
-            await asyncio.sleep(time)
+    async def _countdown(self, remaining: int) -> None:
+        if self.state != GameState.STARTING:
+            return
+        if remaining <= 0:
+            self._countdown_timer = None
+            await self.start()
+            return
 
-            if self.state != GameState.STARTING:
-                await self.send('Countdown canceled.')
-                return
+        await self.send('Starting game in {} seconds.'.format(remaining))
+        step = remaining % COUNTDOWN_STEP or COUNTDOWN_STEP
+        self._countdown_timer = self.scheduler.schedule(
+            step, functools.partial(self._countdown, remaining - step))
 
-        await self.start()
+    async def _cancel_countdown(self) -> None:
+        self.state = GameState.CREATED
+        if self._countdown_timer is not None:
+            self._countdown_timer.cancel()
+            self._countdown_timer = None
+            await self.send('Countdown canceled.')
 
     async def unready(self, author: DiscordPlayer) -> None:
         if not author.ready:
             raise DiscordGameException("{} player already unready.")
         author.ready = False
+        self.dirty = True
 
         await self.send('{} unready.'.format(author))
 
         if self.state == GameState.STARTING:
-            self.state = GameState.CREATED
+            await self._cancel_countdown()
 
     # Tihi, don't feel like this is correct usage of this operator, but I
     # couldn't refrain.
@@ -479,185 +1254,211 @@ class DiscordGame(SeatGame[CommonPlayer]):
     def running(self) -> bool:
         return self.state == GameState.RUNNING
 
+    @property
+    def active(self) -> bool:
+        return self.state not in (GameState.GAME_OVER, GameState.STOPPED)
+
     async def start(self) -> None:
         if self.state not in (GameState.CREATED, GameState.STARTING):
             raise DiscordGameException(
                 'Error: Invalid game state: {}'.format(self.state))
 
-        for player in self.players:
-            player.new_round()
+        self.begin()
 
         await self._message_start_game()
         self.state = GameState.RUNNING
-
-        await self._round_loop()
+        self._plan_bot_rounds()
+        self._schedule_round_end()
+        self.save()
 
     async def force_new_round(self) -> None:
         await self.new_discord_round()
-        await self._round_loop()
 
-    async def _round_loop(self) -> None:
-        while True:
-            current_round = self.current_round
-            if self.options['round_length'] < 0:
-                return
-            await asyncio.sleep(self.options['round_length'])
-            if self.state != GameState.RUNNING:
-                print('Game not running, quitting silently.')
-                return
-            if current_round != self.current_round:
-                print('Next round prematurely started.')
-                return
-            await self.new_discord_round()
+    def _schedule_round_end(self, delay: Optional[float] = None) -> None:
+        """Start the timer for the current round, replacing the timer of the
+        previous round. The round lasts delay seconds, or the round length
+        by default."""
+        if self._round_timer is not None:
+            self._round_timer.cancel()
+            self._round_timer = None
+        if self.options['round_length'] < 0:
+            return
+        self._round_timer = self.scheduler.schedule(
+            self.options['round_length'] if delay is None else delay,
+            functools.partial(self._end_round, self.current_round))
 
-    async def _message_start_game(self) -> None:  # TODO
-        await self.channel.wait_send(self._current_options_string())
-        await self._message_new_round()
+    @property
+    def round_remaining(self) -> Optional[float]:
+        """Seconds left of the current round, if it has a timer."""
+        if self._round_timer is None:
+            return None
+        return self._round_timer.remaining
+
+    async def resume_restored(self, round_remaining: Optional[float]) -> None:
+        """Continue a game loaded after a restart, with round_remaining
+        seconds left of the round. The early new round vote is posted again,
+        as reactions to the old message aren't tracked any more."""
+        if self.state not in (GameState.RUNNING, GameState.PAUSED):
+            return
+        self._schedule_round_end(round_remaining)
+        if self.state == GameState.PAUSED:
+            if self._round_timer is not None:
+                self._round_timer.pause()
+            return
+        self._plan_bot_rounds()
         await self._message_react_earlynewround()
 
-    async def _resolve_botswaps_proposals(self) -> None:
-        def garnet_key(proposal: Proposal[CP]) -> int:
-            return proposal.garnets
+    def save(self) -> None:
+        if self.store is not None:
+            self.store.save(self)
 
-        bot_proposals: ListProposals = []
-        botswap_set: typing.Set[BotSwap] = set()
-
-        for bot in self.bots.values():
-            bot_proposals += [x for x in bot.incoming_proposals
-                              if not x.source.swapped]
-            botswap_set.update(bot.botswaps)
+    async def _end_round(self, current_round: int) -> None:
+        if self.state != GameState.RUNNING:
+            print('Game not running, quitting silently.')
+            return
+        if current_round != self.current_round:
+            print('Next round prematurely started.')
+            return
+        await self.new_discord_round()
 
-        botswaps = list(botswap_set)
-        random.shuffle(botswaps)
-        botswaps.sort(key=garnet_key, reverse=True)
+    async def _message_start_game(self) -> None:  # TODO
+        await self.channel.send(self._current_options_string())
+        await self._message_new_round()
+        await self._message_react_earlynewround()
 
+    async def _message_resolved(self, botswaps: typing.List[BotSwap],
+                                proposals: ListProposals) -> None:
         for botswap in botswaps:
-            source_proposals = [x for x in bot_proposals
-                                if x.target == botswap.source]
-            target_proposals = [x for x in bot_proposals
-                                if x.target == botswap.target]
-
-            source_proposals.sort(key=garnet_key)
-            target_proposals.sort(key=garnet_key)
-
-            def list_get(proposals: typing.List[Proposal[CommonPlayer]],
-                         index: int) -> int:
-                if index < len(proposals):
-                    return proposals[index].garnets
-                return 0
-
-            source_max = list_get(source_proposals, 0)
-            target_max = list_get(target_proposals, 0)
-            total = source_max+target_max
-
-            # to avoid exploit where another player screws a botswap
-            # by proposing to both targets
-            if (source_proposals and target_proposals and
-                    source_proposals[0].source == target_proposals[0].source):
-                total = max(source_max + list_get(target_proposals, 1),
-                            target_max + list_get(source_proposals, 1))
-
-            if (botswap.garnets > total
-                    or (not source_proposals and not target_proposals)):
-                try:
-                    botswap.accept()
-                except SeatException:
-                    pass
-                else:
-                    await botswap.guarantor.send(
-                        'Your botswap between {} and {} was accepted.'.format(
-                            botswap.source, botswap.target))
-                bot_proposals = [x for x in bot_proposals
-                                 if cast(BotPlayer, x.target) not in botswap]
-
-        random.shuffle(bot_proposals)
-        bot_proposals.sort(key=garnet_key, reverse=True)
-        for proposal in bot_proposals:
-            try:
-                proposal.accept()
-            except SeatException:
-                pass
-            else:
-                await proposal.source.send(
-                    '{proposal.target} accepted your proposal, '
-                    'gaining {proposal.garnets}.\n'
-                    'Your new seat is {proposal.source.seat}.\n'
-                    "{proposal.target}'s new seat is {proposal.target.seat}"
-                    ''.format(proposal=proposal))
+            await botswap.guarantor.send(
+                'Your botswap between {} and {} was accepted.'.format(
+                    botswap.source, botswap.target))
+
+        for proposal in proposals:
+            await proposal.source.send(
+                '{proposal.target} accepted your proposal, '
+                'gaining {proposal.garnets}.\n'
+                'Your new seat is {proposal.source.seat}.\n'
+                "{proposal.target}'s new seat is {proposal.target.seat}"
+                ''.format(proposal=proposal))
 
     async def new_discord_round(self) -> None:
-        await self._resolve_botswaps_proposals()
-
-        if self.game_over:
-            self.state = GameState.GAME_OVER
-            self._award_win_garnets()
+        # the round changes before any message is sent, so no command can
+        # come in between resolving the bots and the new round
+        self.record(Event.NEW_ROUND)
+        self._drop_vote()
+        botswaps, proposals = self.resolve_bots()
+        if self.next_round():
+            self._finish(GameState.GAME_OVER)
+            await self._message_resolved(botswaps, proposals)
             await self._message_game_over()
             return
 
-        for player in self.players:
-            player.new_round()
-        self.new_round()
+        self._schedule_round_end()
+        self.save()
 
+        await self._message_resolved(botswaps, proposals)
         await self._message_new_round()
         await self._message_react_earlynewround()
+        self._plan_bot_rounds()
 
-    def _award_win_garnets(self) -> None:
-        for player in self.winners:
-            player.garnets += self.options['win_garnets']
-        for player in self.current_x_players:
-            player.garnets += self.options['x_garnets']
-
-        streak_length = self.win_streak_length
-        middle_garnets = self.options['middle_garnets']
-        if streak_length % 2 == 0:
-            self.winners[streak_length//2].garnets += middle_garnets//2
-            self.winners[streak_length//2-1].garnets += middle_garnets//2
-        else:
-            self.winners[(streak_length-1)//2].garnets += middle_garnets
+    def _plan_bot_rounds(self) -> None:
+        for bot in self.bots.values():
+            if isinstance(bot, StrategicBotPlayer):
+                task = asyncio.create_task(bot.plan_round(self))
+                self._planning.add(task)
+                task.add_done_callback(self._finish_planning)
+
+    def _finish_planning(self, task: asyncio.Task[None]) -> None:
+        self._planning.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print('bot planning failed in {}: {!r}'.format(
+                self.channel, task.exception()))
 
     async def _message_react_earlynewround(self) -> None:
-        react_needed = max(2, math.ceil(len(self.discord_players)/2)+1)
+        react_needed = max(1, math.ceil(len(self.discord_players)/2))
         emoji = '✅'  # :white_check_mark:
         message = await self.channel.wait_send(
             'React {} to this message to vote for starting the next round '
-            'early. {} reactions needed, only players may vote.'.format(
+            'early. {} votes needed, only players may vote.'.format(
                 emoji,
                 react_needed))
+        self._drop_vote()
+        self._vote_message_id = message.id
+        self.reactions.add(message.id, NewRoundEarly(
+            self, message, emoji, react_needed))
         await message.add_reaction(emoji)
-        self.reactable_messages[message.id] = NewRoundEarly(
-            self, message, emoji, react_needed)
+
+    def _drop_vote(self) -> None:
+        if self._vote_message_id is not None:
+            self.reactions.remove(self._vote_message_id)
+            self._vote_message_id = None
+
+    def _cancel_timers(self) -> None:
+        for timer in (self._round_timer, self._countdown_timer):
+            if timer is not None:
+                timer.cancel()
+        self._round_timer = self._countdown_timer = None
+
+    def _finish(self, state: GameState) -> None:
+        self.state = state
+        self.finished_at = time.time()
+        self._cancel_timers()
+        self._drop_vote()
+        self.close_journal()
+        self.users.finish_game(self)
+        self.save()
 
     def stop(self) -> None:
-        self.state = GameState.STOPPED
+        self.record(Event.STOP)
+        self._finish(GameState.STOPPED)
 
     def pause(self) -> None:
+        """Stop the round timer, keeping the time left of the round."""
         self.state = GameState.PAUSED
+        if self._round_timer is not None:
+            self._round_timer.pause()
+        self.save()
 
     def resume(self) -> None:
         self.state = GameState.RUNNING
-        # TODO: Sleep reduced time
-        self._round_loop()
+        if self._round_timer is not None and self._round_timer.paused:
+            self._round_timer.resume()
+        else:
+            self._schedule_round_end()
+        self.save()
 
     async def add_user(self, user: discord.user) -> None:
         if self.state == GameState.STARTING:
-            self.state = GameState.CREATED
+            await self._cancel_countdown()
 
         player = DiscordPlayer(user,
                                garnets=self.options['start_garnets'])
+        self.record(Event.JOIN, user.id, tail=str(player).encode())
         self.discord_players[user] = player
         self.add_player(player)
+        self.users.add(player)
         await self.send('{} joined the game'.format(player))
 
+    def rename_user(self, user: discord.User) -> None:
+        """Reindex a player after a change of name or nickname."""
+        player = self.discord_players.get(user)
+        if player is not None:
+            player.user = user
+            self.player_index.update(player)
+
     async def remove_discord_player(self, player: DiscordPlayer) -> None:
+        self.record(Event.LEAVE, self.players.index(player))
         self.discord_players.pop(player.user)
         self.remove_player(player)
+        self.users.remove(player)
         await self.send('{} left the game'.format(player))
 
         if self._all_players_ready():
             await self.start_game_countdown()
 
-    async def add_bot(self, name: str) -> None:
-        bot = BotPlayer(name)
+    async def add_bot(self, name: str, strategic: bool = False) -> None:
+        bot = StrategicBotPlayer(name) if strategic else BotPlayer(name)
+        self.record(Event.ADD_BOT, strategic, tail=name.encode())
         self.bots[name] = bot
         self.add_player(bot)
         await self.send('Bot player {} added to the game'.format(bot))
@@ -666,6 +1467,7 @@ class DiscordGame(SeatGame[CommonPlayer]):
             await self.start_game_countdown()
 
     async def remove_bot(self, bot: BotPlayer) -> None:
+        self.record(Event.REMOVE_BOT, self.players.index(bot))
         self.bots.pop(bot.name)
         self.remove_player(bot)
         await self.send('Bot player {} removed from the game'.format(bot))
@@ -691,8 +1493,11 @@ class DiscordGame(SeatGame[CommonPlayer]):
             'Any players who have the number X in the final round will '
             'lose {x_garnets} garnets.\n'
             'Each round will last {o[round_length]} seconds.\n'
+            'Bots resolve proposals and botswaps {bot_resolution}.\n'
             '```'.format(
                 swap_info_str=swap_info_str,
+                bot_resolution=BOT_RESOLUTION_STRINGS[
+                    self.options['bot_resolution']],
                 o=self.options,
                 x_garnets=self.options['x_garnets']*-1)
         )
@@ -710,21 +1515,28 @@ class DiscordGame(SeatGame[CommonPlayer]):
                     current_x=' '.join(
                         [str(x) for x in self.current_x])))
 
-        for player in self.discord_players.values():
-            await player.send(
-                '**Round {current_round} started.**\n'
-                'All your proposals have been canceled\n'
-                'Your seat is {player.seat} and your number is '
-                '{player.number}.\n'
-                'You have {player.garnets} garnets.\n'
-                '{message_current_x}'
-                'Type `!help` for help or `!commands` for commands.'.format(
-                    player=player,
-                    current_round=self.current_round,
-                    message_current_x=message_current_x
-                ))
-
-        await self.channel.wait_send(
+        players = list(self.discord_players.values())
+        channels = await asyncio.gather(
+            *(player.dm_channel() for player in players))
+        messages = [
+            (channel,
+             '**Round {current_round} started.**\n'
+             'All your proposals have been canceled\n'
+             'Your seat is {player.seat} and your number is '
+             '{player.number}.\n'
+             'You have {player.garnets} garnets.\n'
+             '{message_current_x}'
+             'Type `!help` for help or `!commands` for commands.'.format(
+                 player=player,
+                 current_round=self.current_round,
+                 message_current_x=message_current_x))
+            for player, channel in zip(players, channels)]
+        report = await self.dispatcher.fan_out(messages)
+        print('Round {} announced in {}: {}'.format(
+            self.current_round, self.channel, report))
+
+        # queued, to be merged with the vote message following it
+        await self.channel.send(
             '**Round {current_round} started.**\n'
             '```\nSeat  Player\n'
             '{table_layout}```\n'
@@ -0,0 +1,78 @@
+"""Defines GameArchive, where finished games are kept once the bot no longer
+holds them in memory.
+
+A finished or stopped game stays in DiscordBot.games for ARCHIVE_GRACE
+seconds, so its players can still look at it, and is then summarized here
+and evicted. At most MAX_FINISHED_GAMES finished games are kept in memory,
+the ones that finished first are evicted first.
+
+Each summary is one line of json, appended to a file named by the channel
+id, with the options, seed, final state and round, the players with their
+seat, number and garnets, and the journal of the game if it has one. The
+last summary of a channel is what !recreate uses once its game is evicted."""
+from __future__ import annotations
+
+import os
+import json
+import typing
+from typing import Any, Dict, Optional
+
+from discord_game import DiscordGame, GameState
+from seat_typing import SeatChannel
+
+ARCHIVE_GRACE = 15 * 60
+MAX_FINISHED_GAMES = 1000
+DEFAULT_ARCHIVE_DIR = 'archived_games'
+
+
+def summarize(game: DiscordGame,
+              journal: Optional[str] = None) -> Dict[str, Any]:
+    """What's archived of a finished game."""
+    return {
+        'channel': game.channel.id,
+        'seed': game.seed,
+        'state': game.state.name,
+        'round': game.current_round,
+        'finished_at': game.finished_at,
+        'options': game.options,
+        'players': [[str(player), player.seat, player.number,
+                     player.garnets] for player in game.table_layout],
+        'journal': journal,
+    }
+
+
+class GameArchive:
+    """Summaries of finished games in directory, one file per channel."""
+    def __init__(self, directory: str = DEFAULT_ARCHIVE_DIR) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, channel_id: int) -> str:
+        return os.path.join(self.directory, '{}.jsonl'.format(channel_id))
+
+    def add(self, game: DiscordGame, journal: Optional[str] = None) -> None:
+        with open(self._path(game.channel.id), 'a') as archive_file:
+            archive_file.write(json.dumps(summarize(game, journal),
+                                          separators=(',', ':')) + '\n')
+
+    def last(self, channel_id: int) -> Optional[Dict[str, Any]]:
+        """The summary of the last game archived from channel_id."""
+        path = self._path(channel_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as archive_file:
+            lines = archive_file.read().splitlines()
+        if not lines:
+            return None
+        return typing.cast(Dict[str, Any], json.loads(lines[-1]))
+
+    def restore(self, channel: SeatChannel) -> Optional[DiscordGame]:
+        """A game without players in the final state of the last game
+        archived from channel, with its options, or None."""
+        summary = self.last(channel.id)
+        if summary is None:
+            return None
+        game = DiscordGame(channel, summary['options'], summary['seed'])
+        game.state = GameState[summary['state']]
+        game.finished_at = summary['finished_at']
+        return game
@@ -0,0 +1,91 @@
+"""Defines evaluate_streaks, which calculates the longest streak of many
+seatings at once with numpy.
+
+Meant for analysis, bots and simulations, where thousands of seatings are
+scored at a time. Gives exactly the same results as SeatGame.longest_streak
+would for each seating."""
+from __future__ import annotations
+
+import typing
+from typing import Iterable
+from dataclasses import dataclass
+
+import numpy as np  # type: ignore
+
+from seat_streak import next_numbers
+
+
+@dataclass
+class StreakArrays:
+    """StreakResult for each seating, as arrays with one element per row."""
+    longest_streak: np.ndarray
+    instances: np.ndarray
+    starting_seat: np.ndarray
+    direction: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.longest_streak)
+
+
+def _run_lengths(links: np.ndarray) -> np.ndarray:
+    """Number of consecutive linked edges starting at each edge, wrapping
+    around and capped at the number of edges - 1."""
+    size = links.shape[1]
+    doubled = np.concatenate((links, links), axis=1)
+    positions = np.where(doubled, 2*size, np.arange(2*size))
+    next_break = np.minimum.accumulate(positions[:, ::-1], axis=1)[:, ::-1]
+    return np.minimum(next_break[:, :size] - np.arange(size), size-1)
+
+
+def evaluate_streaks(seatings: typing.Any,
+                     current_x: Iterable[int]) -> StreakArrays:
+    """Longest streak of every row in seatings, a 2-D array where each row
+    is a seat-to-number permutation.
+
+    Like SeatGame, starting seats are checked in increasing order in
+    direction 1, then decreasing in direction -1, and the streak from every
+    non-X seat counts towards instances."""
+    seatings = np.asarray(seatings, dtype=np.int64)
+    if seatings.ndim != 2:
+        raise ValueError('seatings must be a 2-D array.')
+    rows, size = seatings.shape
+
+    if size == 0:
+        zeros = np.zeros(rows, dtype=np.int64)
+        return StreakArrays(zeros, zeros.copy(), zeros.copy(), zeros.copy())
+
+    x_list = [x for x in current_x if 0 <= x < size]
+    following = np.array(next_numbers(size, set(x_list)), dtype=np.int64)
+    is_x = np.zeros(size, dtype=bool)
+    is_x[x_list] = True
+
+    # edge e is between seat e and seat e+1
+    next_seat = np.roll(seatings, -1, axis=1)
+    up_links = following[seatings] == next_seat
+    down_links = following[next_seat] == seatings
+
+    up_streaks = _run_lengths(up_links) + 1
+
+    # from seat s in direction -1 we walk edges s-1, s-2, ...
+    down_runs = _run_lengths(down_links[:, ::-1])
+    down_streaks = down_runs[:, (size - np.arange(size)) % size] + 1
+
+    x_seats = is_x[seatings]
+    up_streaks[x_seats] = 0
+    down_streaks[x_seats] = 0
+
+    streaks = np.concatenate((up_streaks, down_streaks[:, ::-1]), axis=1)
+    longest = streaks.max(axis=1)
+    is_longest = streaks == longest[:, np.newaxis]
+    instances = is_longest.sum(axis=1)
+    first = is_longest.argmax(axis=1)
+
+    starting_seat = np.where(first < size, first, 2*size - 1 - first)
+    direction = np.where(first < size, 1, -1)
+
+    empty = longest == 0
+    instances[empty] = 0
+    starting_seat[empty] = 0
+    direction[empty] = 0
+
+    return StreakArrays(longest, instances, starting_seat, direction)
@@ -2,8 +2,11 @@
 """
 from __future__ import annotations
 
+import os
+import time
 import itertools
 import asyncio
+import importlib.util
 from enum import Enum, auto
 import typing
 from typing import Optional, List, Any, Sequence
@@ -14,7 +17,13 @@ import discord  # type: ignore
 import seat_typing
 import discord_game
 from discord_game import (DiscordGame, GameState,
-                          DiscordPlayer, BotPlayer, CommonPlayer)
+                          DiscordPlayer, BotPlayer, CommonPlayer,
+                          UserRegistry, ReactionRegistry)
+from seat_archive import GameArchive, ARCHIVE_GRACE, MAX_FINISHED_GAMES
+from seat_dispatch import Dispatcher
+from seat_journal import Journal
+from seat_timers import Scheduler
+from seat_persistence import GameStore
 # from player_game import Findable, Player, Proposal
 
 import strings
@@ -22,8 +31,100 @@ import strings
 OPTIONAL_STR = "Brackets around an argument means that it's optional."
 OWNER_ID = 84627464709472256
 REVEAL_TIME = 5
+WHATIF_COUNT = 10
 
-GameDict = typing.Dict[discord.TextChannel, DiscordGame]
+
+class GameDict(typing.Dict[seat_typing.SeatChannel, DiscordGame]):
+    """The game of each channel, with the registries of users in them and of
+    messages they handle reactions to, which every game added here keeps up
+    to date, and the dispatcher, scheduler and store they share for
+    messaging many players at once, for round timers and for saving games.
+
+    New games are journaled in journal_dir, if given, in a file named by
+    their channel and seed, which is only written once they start, so games
+    abandoned before that don't hold a file open. Games restored from a save
+    already have players and aren't journaled.
+
+    Finished games are evicted by archive_finished, and summarized in
+    archive if given, from which archived_game recreates them."""
+    def __init__(self,
+                 dispatcher: Optional[Dispatcher] = None,
+                 store: Optional[GameStore] = None,
+                 journal_dir: Optional[str] = None,
+                 archive: Optional[GameArchive] = None) -> None:
+        super().__init__()
+        self.users = UserRegistry()
+        self.reactions = ReactionRegistry()
+        self.dispatcher = dispatcher or Dispatcher()
+        self.scheduler = Scheduler()
+        self.store = store
+        self.journal_dir = journal_dir
+        self.archive = archive
+        if journal_dir is not None:
+            os.makedirs(journal_dir, exist_ok=True)
+
+    def _journal_path(self, game: DiscordGame) -> Optional[str]:
+        if self.journal_dir is None:
+            return None
+        return os.path.join(self.journal_dir, '{}_{:016x}.journal'.format(
+            game.channel.id, game.seed))
+
+    def __setitem__(self, channel: seat_typing.SeatChannel,
+                    game: DiscordGame) -> None:
+        if channel in self:
+            self.users.remove_game(self[channel])
+            if self[channel] is not game:
+                self[channel].close_journal()
+        journal_path = self._journal_path(game)
+        if (journal_path is not None and game.journal is None
+                and not game.players):
+            game.attach_journal(Journal(journal_path, held=True))
+        game.users = self.users
+        game.reactions = self.reactions
+        game.dispatcher = self.dispatcher
+        game.scheduler = self.scheduler
+        game.store = self.store
+        for player in game.discord_players.values():
+            self.users.add(player)
+        super().__setitem__(channel, game)
+
+    def __delitem__(self, channel: seat_typing.SeatChannel) -> None:
+        self.users.remove_game(self[channel])
+        self[channel].close_journal()
+        super().__delitem__(channel)
+
+    def archive_finished(self, now: Optional[float] = None) -> int:
+        """Archive and evict games finished more than ARCHIVE_GRACE seconds
+        ago, and the ones that finished first while more than
+        MAX_FINISHED_GAMES remain. Returns the number evicted."""
+        if now is None:
+            now = time.time()
+        finished = sorted((game for game in self.values()
+                           if game.finished_at is not None),
+                          key=lambda game: typing.cast(float,
+                                                       game.finished_at))
+        evicted = 0
+        for game in finished:
+            assert game.finished_at is not None
+            if (game.finished_at > now - ARCHIVE_GRACE
+                    and len(finished) - evicted <= MAX_FINISHED_GAMES):
+                break
+            if self.archive is not None:
+                journal = self._journal_path(game)
+                if journal is not None and not os.path.exists(journal):
+                    journal = None
+                self.archive.add(game, journal)
+            del self[game.channel]
+            evicted += 1
+        return evicted
+
+    def archived_game(self, channel: seat_typing.SeatChannel
+                      ) -> Optional[DiscordGame]:
+        """The last game evicted from channel, without its players, if it
+        was archived."""
+        if self.archive is None:
+            return None
+        return self.archive.restore(channel)
 
 
 class CommandException(seat_typing.SeatException):
@@ -243,12 +344,10 @@ class CommandType():
 
         self._validate_channel(command.channel)
 
-        if self.requirements.not_active_player and self.games:
-            for other_game in self.games.values():
-                if (command.author in other_game and other_game.state not in
-                        (GameState.GAME_OVER, GameState.STOPPED)):
-                    raise CommandException(
-                        self, 'You are a player in an active game.')
+        if (self.requirements.not_active_player and self.games is not None
+                and self.games.users.active_player(command.author)):
+            raise CommandException(
+                self, 'You are a player in an active game.')
 
         if not self.game_only:
             await self._do_execute(command)
@@ -267,18 +366,17 @@ class CommandType():
             await self._do_execute(command)
             return
 
-        player = self._find_player(command.author)
+        player = self._find_player(command.author, game)
 
         if not player:
+            if (self.games is not None
+                    and self.games.users.active_player(command.author)):
+                raise CommandException(
+                    self,
+                    'You are already a player in a different active game')
             raise CommandException(self,
                                    'You are not a player in this game.')
 
-        if (player not in game and game.state not in
-                (GameState.GAME_OVER, GameState.STOPPED)):
-            raise CommandException(
-                self,
-                'You are already a player in a different active game')
-
         command.player = player
 
         await self._do_execute(command)
@@ -287,25 +385,16 @@ class CommandType():
         assert self.games is not None
 
         if command.channel.is_public:
-            if command.channel in self.games:
-                return self.games[command.channel]
-        else:
-            for game in self.games.values():
-                if command.author in game:
-                    return game
-        return None
+            return self.games.get(command.channel)
+        return self.games.users.game(command.author)
 
     def _find_player(self, author: discord.User,
                      game: Optional[DiscordGame] = None
                      ) -> Optional[DiscordPlayer]:
         assert self.games is not None
         if game:
-            if author in game:
-                return game.discord_players[author]
-        for other_game in self.games.values():
-            if author in other_game:
-                return other_game.discord_players[author]
-        return None
+            return game.discord_players.get(author)
+        return self.games.users.player(author)
 
     def _validate_game_state(self, state: GameState) -> None:
         if state not in self.requirements.valid_game_states:
@@ -810,6 +899,62 @@ class PrintSeating(CommandType):
         )
 
 
+class WhatIf(CommandType):
+    def __init__(self, games: GameDict) -> None:
+        requirements = Requirements(
+            player_only=True,
+            private_only=True,
+            valid_game_states=[GameState.RUNNING,
+                               GameState.PAUSED])
+        help_text = ('List the swaps giving streaks closest to a winning '
+                     'streak, optionally only swaps involving a player.\n'
+                     'Only uses the numbers you know or have assigned with '
+                     '`!assign`, so the streaks may be longer in reality.')
+        args = (ArgType(CommonPlayer, optional=True),)
+        super().__init__('whatif', 'swaps',
+                         games=games,
+                         requirements=requirements,
+                         args=args,
+                         help_text=help_text,
+                         tag=CommandTag.GAMEPLAY)
+
+    async def _do_execute(self, command: CommandMessage) -> None:
+        assert command.game
+        assert command.player
+
+        game = command.game
+        target: Optional[CommonPlayer] = command.convert_arguments(
+            self.args, game=game)[0]
+
+        seat_numbers = [-1] * game.player_count
+        for player, number in command.player.assigned_numbers.items():
+            if player.game is game and 0 <= number < game.player_count:
+                seat_numbers[player.seat] = number
+
+        win_length = game.win_streak_length
+        outcomes = [
+            (seats, longest, instances,
+             game.is_winning_streak(longest, instances))
+            for seats, (longest, instances)
+            in game.swap_outcomes(seat_numbers).items()
+            if target is None or target.seat in seats]
+        outcomes.sort(key=lambda x: (not x[3], x[1] > win_length,
+                                     -x[1], x[2]))
+
+        if not outcomes:
+            raise CommandException(self, 'Found no swaps.')
+
+        await command.player.send(
+            'Swap  Streak',
+            *('{0} {1}  {2:>6} x{3}{4}   {5} - {6}'.format(
+                first, second, longest, instances,
+                ' wins' if winning else '     ',
+                game.player_in_seat(first), game.player_in_seat(second))
+              for (first, second), longest, instances, winning
+              in outcomes[:WHATIF_COUNT]),
+            start='```\n', end='```', sep='\n')
+
+
 class AssignNumber(CommandType):
     def __init__(self, games: GameDict) -> None:
         requirements = Requirements(
@@ -836,6 +981,7 @@ class AssignNumber(CommandType):
                                                    game=command.game)
 
         command.player.assigned_numbers[target] = number
+        command.game.dirty = True
 
         await command.player.send('Assigned {} to {}.'.format(
             target, number))
@@ -863,6 +1009,7 @@ class UnassignNumber(CommandType):
         target: CommonPlayer = command.convert_arguments(
             self.args, game=command.game)[0]
         number = command.player.assigned_numbers.pop(target)
+        command.game.dirty = True
 
         await command.player.send('Unassigned {} from {}.'.format(
             number, command.args[0]))
@@ -895,7 +1042,18 @@ class Create(CommandType):
                 discord_game.MIN_HUMAN_PLAYERS))
 
 
-class Recreate(CommandType):
+class RecreateCommandType(CommandType):
+    """Finds the game of the channel in the archive too, if it has been
+    evicted."""
+    def _find_game(self, command: CommandMessage) -> Optional[DiscordGame]:
+        assert self.games is not None
+        game = super()._find_game(command)
+        if game is None and command.channel.is_public:
+            return self.games.archived_game(command.channel)
+        return game
+
+
+class Recreate(RecreateCommandType):
     def __init__(self, games: GameDict) -> None:
         requirements = Requirements(
             public_only=True,
@@ -967,7 +1125,7 @@ class CreateJoin(CommandType):
         await game.add_user(command.author)
 
 
-class RecreateJoin(CommandType):
+class RecreateJoin(RecreateCommandType):
     def __init__(self, games: GameDict) -> None:
         requirements = Requirements(
             public_only=True,
@@ -1042,6 +1200,35 @@ class AddBot(CommandType):
         await command.game.add_bot(name.lower())
 
 
+class AddStrategicBot(CommandType):
+    def __init__(self, games: GameDict) -> None:
+        requirements = Requirements(
+            game_only=True,
+            public_only=True,
+            valid_game_states=[GameState.CREATED])
+        args = (ArgType(str, name='name'),)
+        help_text = ('Add a strategic bot with the specified name to the '
+                     'game. It sees the whole table, and each round proposes '
+                     'swaps towards a winning streak including itself.')
+        super().__init__('addstrategicbot', 'addsmartbot',
+                         games=games,
+                         requirements=requirements,
+                         args=args,
+                         help_text=help_text,
+                         tag=CommandTag.MANAGEMENT)
+
+    async def _do_execute(self, command: CommandMessage) -> None:
+        assert command.game
+
+        name: str = command.convert_arguments(self.args, game=command.game)[0]
+
+        if not name.isalnum() or not name[0].isalpha():
+            raise CommandException(
+                self, 'Give the bot a proper name!')
+
+        await command.game.add_bot(name.lower(), strategic=True)
+
+
 class RemoveBot(CommandType):
     def __init__(self, games: GameDict) -> None:
         requirements = Requirements(
@@ -1090,11 +1277,55 @@ class RoundLength(CommandType):
                     command.game.options['round_length']))
             return
 
-        command.game.options['round_length'] = arg
+        command.game.set_option('round_length', arg)
         await command.channel.send('Round length set to {} seconds.'.format(
             arg))
 
 
+class BotResolution(CommandType):
+    def __init__(self, games: GameDict) -> None:
+        help_text = (
+            'Print or set how bots resolve proposals and botswaps at the end '
+            'of a round. `greedy` accepts botswaps and then proposals in '
+            'order of garnets, `optimal` accepts the ones that pay the most '
+            'garnets in total.')
+        args = (ArgType(str, optional=True, name='greedy/optimal'),)
+        requirements = Requirements(
+            public_only=True,
+            game_only=True)
+        super().__init__('botresolution',
+                         games=games,
+                         requirements=requirements,
+                         args=args,
+                         help_text=help_text,
+                         tag=CommandTag.OPTIONS)
+
+    async def _do_execute(self, command: CommandMessage) -> None:
+        assert command.game
+
+        arg: Optional[str] = command.convert_arguments(
+            self.args, game=command.game)[0]
+
+        if arg is None:
+            await command.channel.send(
+                'Current bot resolution is: {}.'.format(
+                    command.game.options['bot_resolution']))
+            return
+
+        arg = arg.lower()
+        if arg not in discord_game.BOT_RESOLUTIONS:
+            raise CommandException(
+                self, 'Bot resolution must be one of {}.'.format(
+                    format_list_with_conjunction_and_comma(
+                        discord_game.BOT_RESOLUTIONS, 'or')))
+        if arg == 'optimal' and importlib.util.find_spec('networkx') is None:
+            raise CommandException(
+                self, 'Optimal bot resolution needs networkx installed.')
+
+        command.game.set_option('bot_resolution', arg)
+        await command.channel.send('Bot resolution set to {}.'.format(arg))
+
+
 class StreakLength(CommandType):
     def __init__(self, games: GameDict) -> None:
         help_text = ('Print or set the streak length.')
@@ -1121,7 +1352,7 @@ class StreakLength(CommandType):
                     command.game.win_streak_length))
             return
 
-        command.game.options['win_streak_length'] = arg
+        command.game.set_option('win_streak_length', arg)
         await command.channel.send('Streak length set to {}.'.format(
             arg))
 
@@ -1152,7 +1383,7 @@ class XCount(CommandType):
                     command.game.x_count))
             return
 
-        command.game.options['x_count'] = arg
+        command.game.set_option('x_count', arg)
         await command.channel.send('X count set to {}.'.format(
             arg))
 
@@ -1189,7 +1420,7 @@ class RevealLongestStreak(CommandType):
 
         argvalue = arg.lower() == 'true'
 
-        command.game.options['reveal_longest_streak'] = argvalue
+        command.game.set_option('reveal_longest_streak', argvalue)
         await command.channel.send('Reveal longest streak set to {}.'.format(
             argvalue))
 
@@ -1414,7 +1645,7 @@ class Swap(CommandType):
         source, target = command.convert_arguments(
             self.args, game=command.game)
 
-        source.swap(target)
+        command.game.undoable_swap(source, target)
 
         await command.game.send('Swapped {} and {}.'.format(source, target))
 
@@ -1495,7 +1726,7 @@ class ForceStop(CommandType):
     async def _do_execute(self, command: CommandMessage) -> None:
         assert command.game
 
-        command.game.state = GameState.STOPPED
+        command.game.stop()
         await command.game.send('Game stopped.')
 
 
@@ -1505,7 +1736,7 @@ class ForceSwap(CommandType):
         requirements = Requirements(
             game_only=True,
             admin_only=True)
-        args = (ArgType(Player), ArgType(Player))
+        args = (ArgType(CommonPlayer), ArgType(CommonPlayer))
         super().__init__('forceswap',
                          games=games,
                          requirements=requirements,
@@ -1516,17 +1747,38 @@ class ForceSwap(CommandType):
     async def _do_execute(self, command: CommandMessage) -> None:
         assert command.game is not None
 
-        source: Player
-        target: Player
+        source: CommonPlayer
+        target: CommonPlayer
 
         source, target = command.convert_arguments(
             self.args, game=command.game)
 
-        source.swap(target, force=True)
+        command.game.undoable_swap(source, target, force=True)
 
         await command.game.send('Swapped {} and {}.'.format(source, target))
 
 
+class Undo(CommandType):
+    def __init__(self, games: GameDict) -> None:
+        help_text = ('Undo the last `!swap` or `!forceswap` this round, '
+                     'swapping the players back.')
+        requirements = Requirements(
+            game_only=True,
+            admin_only=True)
+        super().__init__('undo',
+                         games=games,
+                         requirements=requirements,
+                         help_text=help_text,
+                         tag=CommandTag.ADMIN)
+
+    async def _do_execute(self, command: CommandMessage) -> None:
+        assert command.game is not None
+
+        command.game.undo()
+
+        await command.game.send('Undid the last swap.')
+
+
 class ForceNewRound(CommandType):
     def __init__(self, games: GameDict):
         help_text = ('Forces next round to start.')
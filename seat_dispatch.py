@@ -0,0 +1,174 @@
+"""Defines Dispatcher, which sends messages to many channels at once, e.g.
+every player's DM at the start of a round, without tripping Discord's rate
+limits.
+
+Sends run concurrently, at most concurrency at a time. Discord rate limits
+messages per channel, so each channel is a bucket. discord.py 1.x already
+sleeps and retries a request that gets a 429 response, and only raises
+HTTPException once it gives up, so the buckets and retries here only come
+into play after that: the 429 then blocks its bucket, or every bucket if
+the limit is global, for as long as Discord asks, so the other sends queued
+for it wait instead of failing too, before the send is retried.
+
+Reactions are removed the same way, in batches of those asked for within
+CLEANUP_DELAY seconds, so handling a reaction only queues its removal."""
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List, Optional,
+                    Tuple, TypeVar)
+from dataclasses import dataclass
+
+import discord  # type: ignore
+
+from seat_typing import SeatChannel
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRIES = 3
+TOO_MANY_REQUESTS = 429
+CLEANUP_DELAY = 2.0
+
+T = TypeVar('T')
+# message id, emoji and user id of a reaction
+ReactionKey = Tuple[int, str, int]
+
+
+def retry_after(error: discord.HTTPException) -> Tuple[float, bool]:
+    """Seconds to wait after a 429 response, and whether the rate limit is
+    global."""
+    headers = getattr(error.response, 'headers', None) or {}
+    try:
+        delay = float(headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+    except ValueError:
+        delay = DEFAULT_RETRY_AFTER
+    return delay, headers.get('X-RateLimit-Global', '').lower() == 'true'
+
+
+@dataclass
+class FanOutReport:
+    messages: int
+    failures: int
+    latency: float
+
+    def __str__(self) -> str:
+        return '{} messages, {} failed, in {:.2f} seconds'.format(
+            self.messages, self.failures, self.latency)
+
+
+class Dispatcher:
+    """Sends messages concurrently, with at most concurrency sends in flight,
+    retrying sends that are rate limited up to max_retries times."""
+    def __init__(self,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES) -> None:
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._blocked_until: Dict[int, float] = {}
+        self._global_blocked_until = 0.0
+        # reactions to remove in the next batch, with their message
+        self._removals: Dict[ReactionKey, discord.Message] = {}
+        self._cleanup: Optional[asyncio.Task[None]] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created on first use, as older versions of asyncio bind it to the
+        # event loop running when it's created
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _wait_for_bucket(self, bucket: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = max(self._blocked_until.get(bucket, 0.0),
+                        self._global_blocked_until) - loop.time()
+            if delay <= 0:
+                self._blocked_until.pop(bucket, None)
+                return
+            await asyncio.sleep(delay)
+
+    def _block(self, bucket: int, delay: float, is_global: bool) -> None:
+        until = asyncio.get_running_loop().time() + delay
+        if is_global:
+            self._global_blocked_until = max(self._global_blocked_until,
+                                             until)
+        else:
+            self._blocked_until[bucket] = max(
+                self._blocked_until.get(bucket, 0.0), until)
+
+    async def call(self, bucket: int, request: Callable[[], Awaitable[T]],
+                   target: Any) -> T:
+        """The result of request, run when bucket isn't blocked, and retried
+        if it's still rate limited after discord.py's own retries. target
+        is what the request is to, for logging."""
+        for attempt in itertools.count():
+            await self._wait_for_bucket(bucket)
+            async with self.semaphore:
+                try:
+                    return await request()
+                except discord.HTTPException as error:
+                    if (error.status != TOO_MANY_REQUESTS
+                            or attempt >= self.max_retries):
+                        raise
+                    delay, is_global = retry_after(error)
+                    print('rate limited in {}, retrying in {} seconds'.format(
+                        target, delay))
+                    self._block(bucket, delay, is_global)
+        raise AssertionError('unreachable')
+
+    async def send(self, channel: SeatChannel,
+                   content: str) -> discord.Message:
+        return await self.call(channel.id,
+                               lambda: channel.wait_send(content), channel)
+
+    def remove_reaction(self, message: discord.Message, emoji: Any,
+                        user_id: int) -> None:
+        """Remove the reaction of user_id with emoji to message in the next
+        batch."""
+        self._removals[(message.id, str(emoji), user_id)] = message
+        if self._cleanup is None:
+            self._cleanup = asyncio.create_task(self._remove_reactions())
+
+    def keep_reaction(self, message_id: int, emoji: Any,
+                      user_id: int) -> None:
+        """Don't remove the reaction, e.g. as the user removed it."""
+        self._removals.pop((message_id, str(emoji), user_id), None)
+
+    async def _remove_reactions(self) -> None:
+        await asyncio.sleep(CLEANUP_DELAY)
+        removals, self._removals = self._removals, {}
+        self._cleanup = None
+        results = await asyncio.gather(
+            *(self.call(message.channel.id,
+                        functools.partial(message.remove_reaction, emoji,
+                                          discord.Object(user_id)),
+                        message.channel)
+              for (_, emoji, user_id), message in removals.items()),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                print(result)
+
+    async def fan_out(self, messages: Iterable[Tuple[SeatChannel, str]]
+                      ) -> FanOutReport:
+        """Send every (channel, content) message concurrently, and report
+        how many failed and how long it took for all to be sent."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        message_list = list(messages)
+        results = await asyncio.gather(
+            *(self.send(channel, content)
+              for channel, content in message_list),
+            return_exceptions=True)
+
+        failures: List[BaseException] = [
+            result for result in results
+            if isinstance(result, BaseException)]
+        for failure in failures:
+            print(failure)
+        return FanOutReport(len(message_list), len(failures),
+                            loop.time() - start)
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+"""Defines DistanceTable, which holds the fewest swaps from every seating of
+a small table to one where the game is over.
+
+Tables are built offline by a breadth first search out from all winning
+seatings, one swap of two seats at a time, with seatings stored by their
+rank in lexicographic order (their Lehmer code). Each distance is a byte,
+so 9 seats take 363 kB, and the tables are saved as .npy files which are
+memory-mapped when loaded. Looking up a seating is ranking it, which is
+O(n^2) for n of at most 9.
+
+Distances are in swaps with X fixed, like seat_search, as X moving each
+round and any number of swaps per round would make the search space too
+large. Each player swaps at most once per round, so several swaps may fit in
+a round.
+
+X sets that are relabellings of each other share a table, the seating is
+relabelled along with X on lookup.
+
+Run as a script to build the tables, e.g.
+    ./seat_distance.py --players 4 9"""
+from __future__ import annotations
+
+import os
+import math
+import argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore
+
+from seat_batch import evaluate_streaks
+from seat_game import default_win_streak_length, default_x_count
+from seat_outcomes import permutations, relabelling
+
+MAX_SIZE = 9
+UNREACHABLE = 255
+DEFAULT_TABLE_DIR = 'distance_tables'
+
+
+def rank(seatings: np.ndarray) -> np.ndarray:
+    """Lexicographic rank of each row of seatings, a 2-D array of
+    permutations of range(n)."""
+    rows, size = seatings.shape
+    res = np.zeros(rows, dtype=np.int64)
+    for seat in range(size-1):
+        smaller = (seatings[:, seat+1:] < seatings[:, seat:seat+1]).sum(
+            axis=1)
+        res += smaller * math.factorial(size-1-seat)
+    return res
+
+
+def _winning(seatings: np.ndarray,
+             current_x: Sequence[int],
+             win_length: int) -> np.ndarray:
+    """SeatGame.game_over for each row of seatings."""
+    size = seatings.shape[1]
+    if size < 4:
+        return np.ones(len(seatings), dtype=bool)
+    streaks = evaluate_streaks(seatings, current_x)
+    return ((streaks.longest_streak == win_length)
+            & ((streaks.instances == 1) | (size == win_length)))
+
+
+def build_table(size: int,
+                current_x: Sequence[int],
+                win_length: int) -> np.ndarray:
+    """Fewest swaps from each seating, by rank, to a winning seating, or
+    UNREACHABLE."""
+    seatings = permutations(size)
+    res = np.full(len(seatings), UNREACHABLE, dtype=np.uint8)
+    res[_winning(seatings, current_x, win_length)] = 0
+
+    swaps = [(first, second) for first in range(size)
+             for second in range(first+1, size)]
+    distance = 0
+    frontier = np.flatnonzero(res == distance)
+    while len(frontier) and distance + 1 < UNREACHABLE:
+        for first, second in swaps:
+            swapped = seatings[frontier]
+            swapped[:, [first, second]] = swapped[:, [second, first]]
+            ranks = rank(swapped)
+            ranks = ranks[res[ranks] == UNREACHABLE]
+            res[ranks] = distance + 1
+        distance += 1
+        frontier = np.flatnonzero(res == distance)
+    return res
+
+
+def _table_path(table_dir: str, size: int, current_x: Tuple[int, ...],
+                win_length: int) -> str:
+    return os.path.join(table_dir, 'distance_{}_x{}_w{}.npy'.format(
+        size, '-'.join(str(x) for x in current_x), win_length))
+
+
+class DistanceTable:
+    """Distance table for size seats, with current_x being X. Loaded from
+    table_dir if there, otherwise built and saved."""
+    def __init__(self,
+                 size: int,
+                 current_x: Iterable[int] = (),
+                 win_length: Optional[int] = None,
+                 table_dir: str = DEFAULT_TABLE_DIR) -> None:
+        if not 1 <= size <= MAX_SIZE:
+            raise ValueError(
+                'size must be between 1 and {}.'.format(MAX_SIZE))
+        x_set = set(current_x)
+        if any(not 0 <= x < size for x in x_set):
+            raise ValueError('X must be numbers below size.')
+
+        self.size = size
+        self.win_length = (win_length if win_length is not None
+                           else default_win_streak_length(size))
+        self._sign, self._offset = relabelling(size, x_set)
+        self.current_x = tuple(sorted(
+            (self._sign*x + self._offset) % size for x in x_set))
+
+        path = _table_path(table_dir, size, self.current_x, self.win_length)
+        if not os.path.exists(path):
+            os.makedirs(table_dir, exist_ok=True)
+            # save to a temporary file first, so other processes never load
+            # a partial table
+            with open(path + '.tmp', 'wb') as table_file:
+                np.save(table_file, build_table(
+                    size, self.current_x, self.win_length))
+            os.replace(path + '.tmp', path)
+        self._table = np.load(path, mmap_mode='r')
+
+    def _rank(self, seat_numbers: Sequence[int]) -> int:
+        if sorted(seat_numbers) != list(range(self.size)):
+            raise ValueError(
+                'seat_numbers must be a permutation of range({}).'.format(
+                    self.size))
+        numbers = [(self._sign*number + self._offset) % self.size
+                   for number in seat_numbers]
+        res = 0
+        for seat, number in enumerate(numbers):
+            smaller = sum(other < number for other in numbers[seat+1:])
+            res += smaller * math.factorial(self.size-1-seat)
+        return res
+
+    def distance(self, seat_numbers: Sequence[int]) -> int:
+        """Fewest swaps to a winning seating, UNREACHABLE if there is
+        none."""
+        return int(self._table[self._rank(seat_numbers)])
+
+    def improving_swaps(self,
+                        seat_numbers: Sequence[int]) -> List[Tuple[int, int]]:
+        """The swaps of two seats that are the first step of a shortest way
+        to a winning seating."""
+        current = self.distance(seat_numbers)
+        if current in (0, UNREACHABLE):
+            return []
+
+        res = []
+        numbers = list(seat_numbers)
+        for first in range(self.size):
+            for second in range(first+1, self.size):
+                numbers[first], numbers[second] = (numbers[second],
+                                                   numbers[first])
+                if self.distance(numbers) < current:
+                    res.append((first, second))
+                numbers[first], numbers[second] = (numbers[second],
+                                                   numbers[first])
+        return res
+
+    def distance_counts(self) -> Dict[int, int]:
+        """Number of seatings at each distance."""
+        distances, counts = np.unique(self._table, return_counts=True)
+        return {int(distance): int(count)
+                for distance, count in zip(distances, counts)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Build distance tables for the X sets of the first '
+                    'round, with default win lengths.')
+    parser.add_argument('--players', type=int, nargs=2, default=(4, 8),
+                        metavar=('MIN', 'MAX'))
+    parser.add_argument('--x-count', type=int, default=None,
+                        help='Number of X, default as in the game.')
+    parser.add_argument('--table-dir', default=DEFAULT_TABLE_DIR)
+    args = parser.parse_args()
+
+    for size in range(args.players[0], args.players[1]+1):
+        x_count = (args.x_count if args.x_count is not None
+                   else default_x_count(size))
+        current_x = [(i*size)//x_count for i in range(x_count)]
+        table = DistanceTable(size, current_x, table_dir=args.table_dir)
+        print('{} players, {} X: '.format(size, x_count) + ', '.join(
+            '{}: {}'.format('-' if distance == UNREACHABLE else distance,
+                            count)
+            for distance, count in table.distance_counts().items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,47 +13,71 @@ from __future__ import annotations
 import math
 import random
 import typing
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Set, Tuple, Optional, Any
 from dataclasses import dataclass
 
 from seat_typing import Seat, PrivateNumber, SeatException
+from seat_streak import (StreakResult, StreakTracker, DIRECTIONS,
+                         next_number, next_numbers)
 
+MAX_SEATING_ATTEMPTS = 1000
 
-@dataclass
-class StreakResult:
-    longest_streak: int
-    instances: int
-    starting_seat: Seat
-    direction: int
 
-    def __lt__(self, other: typing.Any) -> bool:
-        if isinstance(other, StreakResult):
-            return self.longest_streak < other.longest_streak
-        if isinstance(other, int):
-            return self.longest_streak < other
-        return NotImplemented
+def default_x_count(count: int) -> int:
+    if count < 6:
+        return 0
 
-    def __le__(self, other: typing.Any) -> bool:
-        if isinstance(other, StreakResult):
-            return self.longest_streak <= other.longest_streak
-        if isinstance(other, int):
-            return self.longest_streak <= other
-        return NotImplemented
+    return 1
 
-    def __eq__(self, other: typing.Any) -> bool:
-        if isinstance(other, StreakResult):
-            return self.longest_streak == other.longest_streak
-        if isinstance(other, int):
-            return self.longest_streak == other
-        return NotImplemented
+
+def default_win_streak_length(count: int) -> int:
+    if count < 5:
+        return count
+
+    if count < 7:
+        return 3
+
+    if count == 8:
+        return 4
+
+    return math.floor((count-1)/2)
+
+
+@dataclass(frozen=True)
+class SeatSnapshot:
+    """The state of a SeatGame as an immutable, hashable value.
+
+    player_seats and swapped are per player, in the order of
+    SeatGame.players, and seat_numbers is the seat-to-number mapping, all
+    packed one byte per player. garnets is filled in by games with garnets.
+    """
+    player_seats: bytes
+    seat_numbers: bytes
+    swapped: bytes
+    current_x: Tuple[int, ...]
+    current_round: int
+    garnets: Tuple[int, ...] = ()
 
 
 class SeatPlayer:
-    """A player in a seat game."""
+    """A player in a seat game.
+
+    The seat and number are stored in the game, the player only keeps the
+    index of its seat so it can look them up."""
     def __init__(self) -> None:
-        self.number = PrivateNumber(-1)
-        self.seat = Seat(-1)
+        self._seat = -1
         self.swapped = False
+        self.game: Optional[SeatGame[Any]] = None
+
+    @property
+    def seat(self) -> Seat:
+        return Seat(self._seat)
+
+    @property
+    def number(self) -> PrivateNumber:
+        if self.game is None:
+            return PrivateNumber(-1)
+        return self.game.number_in_seat(self._seat)
 
     def __repr__(self) -> str:
         return 'SeatPlayer(number={}, seat={}, swapped={}'.format(
@@ -69,7 +93,11 @@ class SeatPlayer:
                     raise SeatException(
                         '{} has already swapped.'.format(player))
 
-        self.seat, target.seat = target.seat, self.seat
+        if self.game is None or self.game is not target.game:
+            raise SeatException(
+                '{} and {} are not in the same game.'.format(self, target))
+
+        self.game.swap_seats(self._seat, int(target.seat))
         self.swapped = True
         target.swapped = True
 
@@ -84,12 +112,17 @@ class SeatGame(typing.Generic[GenP]):
     """Implements the lowest abstraction of a seat game with only the concepts
     seats, numbers and X's.
 
-    self._seat_numbers is a seat-to-number mapping,
-    where the index is the seat
-    and the value is the number in that seat."""
+    The seating is stored as plain int lists, self._seat_players is a
+    seat-to-player mapping and self._streaks holds the seat-to-number and
+    number-to-seat mappings, where the index is the seat or number.
+    Seat and PrivateNumber are only created when handed out.
+
+    All randomness comes from self.rng, seeded with seed, so a game can be
+    replayed exactly."""
 
     def __init__(self,
-                 options: Optional[Dict[str, Any]] = None) -> None:
+                 options: Optional[Dict[str, Any]] = None,
+                 seed: Optional[int] = None) -> None:
 
         self._options: Dict[str, Any] = {}
 
@@ -98,8 +131,12 @@ class SeatGame(typing.Generic[GenP]):
 
         self.current_round = 1
         self.players: List[GenP] = []
+        self._seat_players: List[GenP] = []
         self.current_x: List[PrivateNumber] = []
-        self.__cached_streak_result: Optional[StreakResult] = None
+        self._streaks = StreakTracker()
+
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self.rng = random.Random(self.seed)
 
     @property
     def x_count(self) -> int:
@@ -107,10 +144,7 @@ class SeatGame(typing.Generic[GenP]):
             assert isinstance(self._options['x_count'], int)
             return self._options['x_count']
 
-        if len(self.players) < 6:
-            return 0
-
-        return 1
+        return default_x_count(self.player_count)
 
     @property
     def win_streak_length(self) -> int:
@@ -118,40 +152,42 @@ class SeatGame(typing.Generic[GenP]):
             assert isinstance(self._options['win_streak_length'], int)
             return self._options['win_streak_length']
 
-        count = self.player_count
-
-        if count < 5:
-            return count
+        return default_win_streak_length(self.player_count)
 
-        if count < 7:
-            return 3
+    def player_in_seat(self, seat: int) -> GenP:
+        if not 0 <= seat < self.player_count:
+            raise SeatException('Found no player in seat {}'.format(seat))
+        return self._seat_players[seat]
 
-        if count == 8:
-            return 4
+    def number_in_seat(self, seat: int) -> PrivateNumber:
+        return PrivateNumber(self._streaks.seat_numbers[seat])
 
-        return math.floor((self.player_count-1)/2)
+    def seat_of_number(self, number: int) -> Seat:
+        return Seat(self._streaks.number_seats[number])
 
-    def player_in_seat(self, seat: Seat) -> GenP:
-        for player in self.players:
-            if player.seat == seat:
-                return player
-        raise SeatException('Found no player in seat {}'.format(seat))
+    @property
+    def seat_numbers(self) -> List[int]:
+        """The seat-to-number mapping, must not be modified."""
+        return self._streaks.seat_numbers
 
     @property
     def current_x_players(self) -> List[GenP]:
-        return [p for p in self.players if p.number in self.current_x]
+        return [self._seat_players[self._streaks.number_seats[x]]
+                for x in self.current_x if x < self.player_count]
 
     def init_x(self) -> List[PrivateNumber]:
-        res = []
+        res: List[PrivateNumber] = []
+        if not self.players:
+            return res
 
         # Divide the series of numbers into x_count parts, take the beginning
         # of each part and offset by number of rounds-1, mod player count
         for i in range(self.x_count):
-            res.append(
+            res.append(PrivateNumber(
                 (
                     (i*self.player_count)//self.x_count
                     + self.current_round-1)
-                % self.player_count)
+                % self.player_count))
         return res
 
     @property
@@ -159,63 +195,269 @@ class SeatGame(typing.Generic[GenP]):
         return len(self.players)
 
     def new_round(self) -> None:
-        self.__cached_streak_result = None
         self.current_round += 1
         if len(self.current_x) == self.x_count:
             self.current_x = [(x+1) % self.player_count
                               for x in self.current_x]
         else:
             self.current_x = self.init_x()
+        self._streaks.set_x(self.current_x)
+
+    def swap_seats(self, first: int, second: int) -> None:
+        players = self._seat_players
+        players[first], players[second] = players[second], players[first]
+        # pylint: disable=protected-access
+        players[first]._seat = first
+        players[second]._seat = second
+        self._streaks.swap(first, second)
+
+    def _reseat(self, start: int) -> None:
+        """Update the seat index of players from seat start and up."""
+        for seat in range(start, self.player_count):
+            # pylint: disable=protected-access
+            self._seat_players[seat]._seat = seat
+
+    def _insert_player(self, player: GenP, seat: int, number: int,
+                       new_x: List[PrivateNumber]) -> None:
+        """Insert player, already in self.players, in seat with number,
+        shifting up the seats and numbers of other players."""
+        seat_numbers = [other + (other >= number)
+                        for other in self._streaks.seat_numbers]
+        seat_numbers.insert(seat, number)
+
+        self._seat_players.insert(seat, player)
+        player.game = self
+        self._reseat(seat)
+
+        self.current_x = new_x
+        self._streaks.reset(seat_numbers, self.current_x)
+
+    def _placement_longest(self, seat: int, number: int,
+                           new_x: List[PrivateNumber]) -> int:
+        """Longest streak if a player is inserted in seat with number,
+        calculated from scratch."""
+        seat_numbers = [other + (other >= number)
+                        for other in self._streaks.seat_numbers]
+        seat_numbers.insert(seat, number)
+        return StreakTracker(seat_numbers, new_x).longest
+
+    def _valid_placement(self, seat: int, number: int,
+                         new_x: List[PrivateNumber]) -> bool:
+        """Whether inserting a player in seat with number gives a longest
+        streak of 2, the player is already counted in self.player_count.
+
+        If there's no streak longer than 2 now, only edges around the new
+        seat and around seats of numbers at most len(X)+1 below the new number
+        or an X that changed can change, so only those are checked."""
+        size = self.player_count
+        if size < 4:
+            return True
 
-    def add_player(self, player: GenP) -> None:
-        """Add a player with a random number and seat, that doesn't increase
-        the streak length."""
-        valid_numbers = [*PrivateNumber.range(self.player_count+1)]
-        valid_seats = [*Seat.range(self.player_count+1)]
-
-        number: PrivateNumber
-        seat: Seat
-
-        longest_streak = self.longest_streak
-        random.shuffle(valid_numbers)
-        random.shuffle(valid_seats)
-
-        for number in valid_numbers:
-            for seat in valid_seats:
-                player.seat = seat
-                player.number = number
-
-                for other in self.players:
-                    if other.seat >= seat:
-                        other.seat += 1
-                    if other.number >= number:
-                        other.number += 1
+        old = self._streaks
+        if old.longest > 2:
+            return self._placement_longest(seat, number, new_x) == 2
+
+        old_size = old.size
+        x_set = set(new_x)
+
+        # old numbers whose X status or following number can have changed
+        changed = {number % old_size}
+        changed.update(x for x in self.current_x if x < old_size)
+        changed.update(x - (x > number) for x in x_set if x != number)
+        reach = max(len(x_set), len(self.current_x)) + 1
+        affected = {(old_number - i) % old_size
+                    for old_number in changed for i in range(reach+1)}
+
+        split_edge = (seat-1) % old_size
+        old_edges = {split_edge}
+        for old_number in affected:
+            old_seat = old.number_seats[old_number]
+            old_edges.update(((old_seat-1) % old_size, old_seat))
+
+        def new_edge(old_edge: int) -> int:
+            return old_edge + (old_edge >= seat)
+
+        def new_number(new_seat: int) -> int:
+            if new_seat == seat:
+                return number
+            old_number = old.seat_numbers[new_seat - (new_seat > seat)]
+            return old_number + (old_number >= number)
+
+        def new_link(edge: int, direction: int) -> bool:
+            first = new_number(edge)
+            second = new_number((edge+1) % size)
+            if direction == -1:
+                first, second = second, first
+            return (first not in x_set and second not in x_set
+                    and next_number(first, size, x_set) == second)
+
+        new_edges = {(seat-1) % size, seat}
+        new_edges.update(new_edge(edge) for edge in old_edges
+                         if edge != split_edge)
+
+        links = 0
+        for direction in DIRECTIONS:
+            new_links = {edge: new_link(edge, direction)
+                         for edge in new_edges}
+
+            def linked(edge: int) -> bool:
+                edge %= size
+                if edge in new_links:
+                    return new_links[edge]
+                # pylint: disable=cell-var-from-loop
+                return old.linked(edge - (edge > seat), direction)
+
+            for edge, is_linked in new_links.items():
+                if is_linked and (linked(edge-1) or linked(edge+1)):
+                    return False
+
+            links += (old.link_count(direction)
+                      - sum(old.linked(edge, direction) for edge in old_edges)
+                      + sum(new_links.values()))
+        return links > 0
 
-                self.players.append(player)
+    def add_player(self, player: GenP) -> None:
+        """Add a player with a random number and seat, such that the
+        longest streak is 2.
+
+        Seat and number pairs are drawn at random until a valid one is found,
+        so all valid pairs are equally likely."""
+        pair_count = (self.player_count+1)**2
+        self.players.append(player)
+        new_x = self.init_x()
+
+        tried: Set[int] = set()
+        while len(tried) < pair_count:
+            pair = self.rng.randrange(pair_count)
+            if pair in tried:
+                continue
+            tried.add(pair)
+
+            seat, number = divmod(pair, self.player_count)
+            if self._valid_placement(seat, number, new_x):
+                self._insert_player(player, seat, number, new_x)
+                return
 
-                self.current_x = self._init_x()
-                self.__cached_streak_result = None
+        self.players.remove(player)
+        raise SeatException('Unable to add player. Weird?')
 
-                if self.longest_streak == 2 or len(self.players) < 4:
-                    return
+    def _random_seating(self) -> List[int]:
+        """A random seat-to-number mapping for all players, with a longest
+        streak of 2.
+
+        Seats are filled in order with a random number that doesn't extend
+        a streak from the two previous seats, restarting if the streak from
+        the last seats to the first is too long or there's no streak."""
+        size = self.player_count
+        if size < 4:
+            order = list(range(size))
+            self.rng.shuffle(order)
+            return order
+
+        x_set = set(self.init_x())
+        following = next_numbers(size, x_set)
+
+        def linked(first: int, second: int, direction: int) -> bool:
+            if direction == -1:
+                first, second = second, first
+            return following[first] == second
+
+        for _ in range(MAX_SEATING_ATTEMPTS):
+            remaining = list(range(size))
+            self.rng.shuffle(remaining)
+            seating: List[int] = []
+
+            for seat in range(size):
+                for index in range(len(remaining)-1, -1, -1):
+                    number = remaining[index]
+                    if seat < 2 or not any(
+                            linked(seating[-2], seating[-1], direction)
+                            and linked(seating[-1], number, direction)
+                            for direction in DIRECTIONS):
+                        break
+                else:
+                    break
+                remaining[index] = remaining[-1]
+                remaining.pop()
+                seating.append(number)
+
+            if len(seating) < size:
+                continue
+
+            links = [[linked(seating[seat], seating[(seat+1) % size],
+                             direction)
+                      for seat in range(size)]
+                     for direction in DIRECTIONS]
+            if (any(any(edges) for edges in links)
+                    and not any(edges[seat-1] and edges[seat]
+                                for edges in links
+                                for seat in (0, size-1))):
+                return seating
+
+        raise SeatException('Unable to seat players. Weird?')
+
+    def seat_players(self) -> None:
+        """Give every player a new random seat and number in one pass,
+        such that the longest streak is 2."""
+        seating = self._random_seating()
+        self._seat_players = self.players.copy()
+        self.rng.shuffle(self._seat_players)
+        for player in self.players:
+            player.game = self
+        self._reseat(0)
 
-                self.remove_player(player)
+        self.current_x = self.init_x()
+        self._streaks.reset(seating, self.current_x)
 
-        raise SeatException('Unable to add player. Weird?')
+    def add_players(self, players: typing.Iterable[GenP]) -> None:
+        """Add several players at once, reseating everyone in one pass."""
+        self.players += players
+        self.seat_players()
 
     def remove_player(self, player: GenP) -> None:
-        self.__cached_streak_result = None
-        self.players.remove(player)
+        seat = player.seat
+        number = self._streaks.seat_numbers[seat]
 
-        for other in self.players:
-            if other.seat >= player.seat:
-                other.seat -= 1
-            if other.number >= player.number:
-                other.number -= 1
+        seat_numbers = [other - (other > number)
+                        for other in self._streaks.seat_numbers]
+        del seat_numbers[seat]
 
-        for i in range(len(self.current_x)):
-            if self.current_x[i] > player.number:
-                self.current_x[i] -= 1
+        self.players.remove(player)
+        del self._seat_players[seat]
+        player.game = None
+        player._seat = -1  # pylint: disable=protected-access
+        self._reseat(seat)
+
+        self.current_x = self.init_x()
+        self._streaks.reset(seat_numbers, self.current_x)
+
+    def snapshot(self) -> SeatSnapshot:
+        # pylint: disable=protected-access
+        return SeatSnapshot(
+            bytes(player._seat for player in self.players),
+            bytes(self._streaks.seat_numbers),
+            bytes(player.swapped for player in self.players),
+            tuple(self.current_x),
+            self.current_round)
+
+    def restore(self, snapshot: SeatSnapshot) -> None:
+        """Restore seats, numbers, X and round from a snapshot of this game,
+        taken with the same players."""
+        if len(snapshot.player_seats) != self.player_count:
+            raise SeatException(
+                "Can't restore a snapshot with {} players in a game with {}."
+                "".format(len(snapshot.player_seats), self.player_count))
+
+        self._seat_players = self.players.copy()
+        for player, seat, swapped in zip(self.players, snapshot.player_seats,
+                                         snapshot.swapped):
+            player._seat = seat  # pylint: disable=protected-access
+            player.swapped = bool(swapped)
+            self._seat_players[seat] = player
+
+        self.current_x = [PrivateNumber(x) for x in snapshot.current_x]
+        self.current_round = snapshot.current_round
+        self._streaks.reset(snapshot.seat_numbers, self.current_x)
 
     def is_x(self, number: int) -> bool:
         return number in self.current_x
@@ -226,14 +468,16 @@ class SeatGame(typing.Generic[GenP]):
             return True
 
         res = self.longest_streak
+        return self.is_winning_streak(res.longest_streak, res.instances)
 
+    def is_winning_streak(self, longest_streak: int, instances: int) -> bool:
         streak_length = self.win_streak_length
 
         if (self.player_count == streak_length
-                and res.longest_streak == streak_length):
+                and longest_streak == streak_length):
             return True
 
-        return res.longest_streak == streak_length and res.instances == 1
+        return longest_streak == streak_length and instances == 1
 
     def _adjacent_numbers(self, first: PrivateNumber,
                           second: PrivateNumber,
@@ -255,74 +499,33 @@ class SeatGame(typing.Generic[GenP]):
 
     @property
     def longest_streak(self) -> StreakResult:
-        if self.__cached_streak_result is None:
-            self.__cached_streak_result = self._longest_streak()
-
-        return self.__cached_streak_result
-
-    def _longest_streak(self) -> StreakResult:
-        # Go over all the seats in two different directions,
-        # reversing the second for loop.
-
-        # Wait a second this shit is dumb
-        # 1. Don't need to reverse the list, just check both directions from
-        # each seat.
-        # Oh nevermind, that's because I wanted it sorted in some way.
-
-        # 2. Even better is to start at a seat that is not neighbor with it's
-        # previous seat, go forward conting the streak length, when finished
-        # counting streak length, *continue from there* for next check.
-        # This one does a bunch of extra checks (although not that many)
-        player_count = self.player_count
-        seat_numbers: List[PrivateNumber] = [PrivateNumber(0)] * player_count
-
-        for other in self.players:
-            seat_numbers[other.seat] = other.number
-
-        longest_streak = 0
-        instances = 0
-        starting_seat = 0
-        direction = 0
-        for start, end, delta in ((0, player_count, +1),
-                                  (player_count-1, -1, -1)):
-
-            for i in range(start, end, delta):
-                if self.is_x(seat_numbers[i]):
-                    continue
-                streak = 1
-
-                while (streak < player_count
-                       and self._adjacent_numbers(
-                           seat_numbers[
-                               (i+delta*(streak-1)) % player_count],
-                           seat_numbers[
-                               (i+delta*(streak)) % player_count],
-                           1)):
-                    streak += 1
-
-                if streak > longest_streak:
-                    longest_streak = streak
-                    instances = 1
-                    starting_seat = i
-                    direction = delta
-                elif streak == longest_streak:
-                    instances += 1
-
-        return StreakResult(longest_streak, instances,
-                            Seat(starting_seat), direction)
+        return self._streaks.result()
+
+    def swap_outcomes(self,
+                      seat_numbers: Optional[typing.Sequence[int]] = None
+                      ) -> Dict[Tuple[Seat, Seat], Tuple[int, int]]:
+        """Longest streak and number of instances after each possible swap
+        of two seats, keyed by the seats.
+
+        seat_numbers defaults to the actual seating, a number of -1 is
+        unknown and never part of a streak."""
+        if seat_numbers is None:
+            seat_numbers = self.seat_numbers
+        tracker = StreakTracker(seat_numbers, self.current_x)
+        return {(Seat(first), Seat(second)): outcome
+                for (first, second), outcome
+                in tracker.swap_outcomes().items()}
 
     @property
     def winners(self) -> List[GenP]:
         res = self.longest_streak
 
         return [
-            self.player_in_seat(
-                (res.starting_seat + i*res.direction) % self.player_count)
-            for i in Seat.range(res.longest_streak)
+            self._seat_players[
+                (res.starting_seat + i*res.direction) % self.player_count]
+            for i in range(res.longest_streak)
         ]
 
     @property
     def table_layout(self) -> List[GenP]:
-        res = self.players.copy()
-        res.sort(key=lambda x: x.seat, reverse=True)
-        return res
+        return self._seat_players[::-1]
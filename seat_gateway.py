@@ -0,0 +1,723 @@
+#!/usr/bin/python3
+"""Defines Gateway, which runs the bot over several processes, so a game
+busy with heavy work, or a crash, only holds up the games sharing its
+process.
+
+The gateway is the only process connected to Discord. It forwards commands,
+reactions and name changes to worker processes over a Unix socket, and
+carries out the messages, reactions and user lookups the workers ask for.
+Games are sharded by channel id over the workers, and DMs go to the worker
+of the game the author last joined, which workers report as players join
+and leave, and as games finish. As the gateway knows the active game of
+each user, it refuses joins of users in an active game on another worker,
+so a user is in at most one active game over all workers.
+
+Each worker is a WorkerBot, a DiscordBot whose channels, users and messages
+are stand-ins that turn sends into requests to the gateway, so commands and
+games run unchanged. Requests that fail raise the same discord exceptions
+as in a single process, so rate limits are still retried by Dispatcher.
+
+A worker that dies is started again, and restores the games of its shard
+from their last save. A worker that keeps dying within RESTART_RESET
+seconds of starting is restarted after a delay, doubling from RESTART_DELAY
+up to MAX_RESTART_DELAY. Users whose games aren't restored are no longer
+in an active game once the worker is done restoring.
+
+Requests a worker makes of the gateway fail with a 504 HTTPException if
+they aren't answered within REQUEST_TIMEOUT seconds.
+
+Frames on the socket are a 4 byte length followed by a pickled tuple,
+starting with one of the message types below.
+
+Run as a script to start the bot with a number of workers, e.g.
+    ./seat_gateway.py --workers 4"""
+from __future__ import annotations
+
+import os
+import pickle
+import struct
+import asyncio
+import argparse
+import itertools
+import multiprocessing
+import multiprocessing.process
+import collections
+import typing
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord  # type: ignore
+
+from discord_bot import DiscordBot
+from discord_game import DiscordGame, DiscordPlayer, UserRegistry
+
+DEFAULT_SOCKET = 'seat_gateway.sock'
+MESSAGE_CACHE = 1000
+REQUEST_TIMEOUT = 60.0
+# how long a join forwarded to a worker blocks joins on other workers,
+# until the worker reports the user joined
+JOIN_TIMEOUT = 5.0
+# commands that join a game, which the gateway checks the author can
+JOIN_COMMANDS = ('join', 'createjoin', 'recreatejoin')
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 300.0
+RESTART_RESET = 60.0
+
+_FRAME = struct.Struct('<I')
+
+# gateway to worker
+MESSAGE = 'message'
+REACTION = 'reaction'
+REACTION_REMOVE = 'reaction_remove'
+RENAME = 'rename'
+REPLY = 'reply'
+# worker to gateway
+HELLO = 'hello'
+SEND = 'send'
+REACT = 'react'
+UNREACT = 'unreact'
+FETCH_USER = 'fetch_user'
+REGISTER = 'register'
+UNREGISTER = 'unregister'
+FINISH = 'finish'
+RESTORED = 'restored'
+SHUTDOWN = 'shutdown'
+
+TEXT = 'text'
+DM = 'dm'
+
+# id, name, display name and role names, None if not a guild member
+UserInfo = Tuple[int, str, str, Optional[Tuple[str, ...]]]
+
+
+def user_info(user: discord.User) -> UserInfo:
+    roles = None
+    if isinstance(user, discord.Member):
+        roles = tuple(role.name for role in user.roles)
+    return user.id, user.name, user.display_name, roles
+
+
+def write_frame(writer: asyncio.StreamWriter, item: Tuple[Any, ...]) -> None:
+    data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+    writer.write(_FRAME.pack(len(data)) + data)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Any, ...]:
+    """The next frame, raises asyncio.IncompleteReadError when the other
+    end is closed."""
+    length, = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    return typing.cast(Tuple[Any, ...],
+                       pickle.loads(await reader.readexactly(length)))
+
+
+class _RemoteResponse:
+    """What discord exceptions are created with, in place of the HTTP
+    response the gateway got."""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, status: int, reason: str,
+                 headers: Dict[str, str]) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+
+def remote_error(status: int, reason: str, headers: Dict[str, str],
+                 text: str) -> discord.HTTPException:
+    response = _RemoteResponse(status, reason, headers)
+    if status == 403:
+        return discord.Forbidden(response, text)
+    return discord.HTTPException(response, text)
+
+
+class Transport:
+    """How the proxies below reach Discord, the gateway for a Worker."""
+    def __init__(self, shard: int, shards: int) -> None:
+        self.shard = shard
+        self.shards = shards
+
+    def notify(self, kind: str, *args: Any) -> None:
+        raise NotImplementedError('Virtual method notify.')
+
+    async def request(self, kind: str, *args: Any) -> Any:
+        """Ask the gateway to do something, returning its result."""
+        raise NotImplementedError('Virtual method request.')
+
+
+class RemoteMessage:
+    """A message sent through the gateway."""
+    def __init__(self, worker: Transport, channel: Any,
+                 message_id: int) -> None:
+        self.worker = worker
+        self.channel = channel
+        self.id = message_id  # pylint: disable=invalid-name
+
+    async def add_reaction(self, emoji: str) -> None:
+        await self.worker.request(REACT, self.channel.id, self.id, emoji)
+
+    async def remove_reaction(self, emoji: Any, member: Any) -> None:
+        await self.worker.request(UNREACT, self.channel.id, self.id,
+                                  str(emoji), member.id)
+
+
+class RemoteReactionEvent(discord.RawReactionActionEvent):  # type: ignore
+    """A raw reaction event forwarded by the gateway."""
+    # pylint: disable=too-few-public-methods,super-init-not-called
+    def __init__(self, channel_id: int, message_id: int, emoji: str,
+                 user_id: int, member: Optional[_RemoteUser]) -> None:
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.emoji = emoji
+        self.user_id = user_id
+        self.member = member
+
+
+class _RemoteMessageable:
+    """Base of channels and users, which sends through the gateway."""
+    kind = TEXT
+
+    def __init__(self, worker: Transport, object_id: int, name: str) -> None:
+        self.worker = worker
+        self._id = object_id
+        self._name = name
+
+    @property
+    def id(self) -> int:  # pylint: disable=invalid-name
+        return self._id
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __str__(self) -> str:
+        return self._name
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, _RemoteMessageable)
+                and other.kind == self.kind and other.id == self.id)
+
+    def __hash__(self) -> int:
+        return self._id
+
+    async def send(self, content: Any) -> RemoteMessage:
+        message_id = await self.worker.request(SEND, self.kind, self._id,
+                                               str(content))
+        return RemoteMessage(self.worker, self, message_id)
+
+
+class RemoteTextChannel(_RemoteMessageable,
+                        discord.TextChannel):  # type: ignore
+    pass
+
+
+class RemoteDMChannel(_RemoteMessageable, discord.DMChannel):  # type: ignore
+    """The DM channel of a user, which has the id of the user, as the
+    gateway looks up the channel by the user."""
+    kind = DM
+
+
+class _RemoteRole:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class _RemoteUser(_RemoteMessageable):
+    kind = DM
+
+    def __init__(self, worker: Transport, info: UserInfo) -> None:
+        super().__init__(worker, info[0], info[1])
+        self._display_name = info[2]
+        self._roles = [_RemoteRole(name) for name in info[3] or ()]
+        self._dm_channel = RemoteDMChannel(worker, info[0], info[1])
+
+    @property
+    def display_name(self) -> str:
+        return self._display_name
+
+    @property
+    def roles(self) -> List[_RemoteRole]:
+        return self._roles
+
+    @property
+    def dm_channel(self) -> RemoteDMChannel:
+        return self._dm_channel
+
+    async def create_dm(self) -> RemoteDMChannel:
+        return self._dm_channel
+
+
+class RemoteUser(_RemoteUser, discord.User):  # type: ignore
+    pass
+
+
+class RemoteMember(_RemoteUser, discord.Member):  # type: ignore
+    pass
+
+
+def remote_user(worker: Transport, info: UserInfo) -> _RemoteUser:
+    if info[3] is None:
+        return RemoteUser(worker, info)
+    return RemoteMember(worker, info)
+
+
+def message_frame(message: discord.Message) -> Tuple[Any, ...]:
+    """The frame forwarding a message received from Discord to a worker.
+    A DM carries the id of its author rather than of its channel, as workers
+    look up DM channels by user."""
+    if isinstance(message.channel, discord.DMChannel):
+        kind, channel_id = DM, message.author.id
+    else:
+        kind, channel_id = TEXT, message.channel.id
+    return (MESSAGE, kind, channel_id, str(message.channel),
+            user_info(message.author), message.content)
+
+
+def remote_message(worker: Transport, channel_kind: str, channel_id: int,
+                   channel_name: str, author: UserInfo,
+                   content: str) -> RemoteMessage:
+    """A message received from Discord."""
+    channel = (RemoteTextChannel if channel_kind == TEXT
+               else RemoteDMChannel)(worker, channel_id, channel_name)
+    message = RemoteMessage(worker, channel, 0)
+    message.author = remote_user(worker, author)  # type: ignore
+    message.content = content  # type: ignore
+    return message
+
+
+def remote_reaction_event(worker: Transport, channel_id: int,
+                          message_id: int, emoji: str, user_id: int,
+                          member: Optional[UserInfo]) -> RemoteReactionEvent:
+    return RemoteReactionEvent(
+        channel_id, message_id, emoji, user_id,
+        None if member is None else remote_user(worker, member))
+
+
+class _ShardRegistry(UserRegistry):
+    """Tells the gateway about users joining and leaving games of this
+    worker, so their DMs are sent here, and about their games finishing,
+    so they may join games on other workers."""
+    def __init__(self, worker: Transport) -> None:
+        super().__init__()
+        self.worker = worker
+
+    def add(self, player: DiscordPlayer) -> None:
+        super().add(player)
+        self.worker.notify(REGISTER, player.user.id,
+                           player.discord_game.active)
+
+    def remove(self, player: DiscordPlayer) -> None:
+        if self.player(player.user) is player:
+            self.worker.notify(UNREGISTER, player.user.id)
+        super().remove(player)
+
+    def finish_game(self, game: DiscordGame) -> None:
+        for player in game.discord_players.values():
+            if self.player(player.user) is player:
+                self.worker.notify(FINISH, player.user.id)
+
+
+class WorkerBot(DiscordBot):
+    """A DiscordBot in a worker, running the games of one shard."""
+    def __init__(self, worker: Transport) -> None:
+        self.worker = worker
+        super().__init__()
+        self.games.users = _ShardRegistry(worker)
+
+    def owns_channel(self, channel_id: int) -> bool:
+        return channel_id % self.worker.shards == self.worker.shard
+
+    def get_channel(self, channel_id: int) -> Optional[RemoteTextChannel]:
+        if not self.owns_channel(channel_id):
+            return None
+        return RemoteTextChannel(self.worker, channel_id, str(channel_id))
+
+    def get_user(self, user_id: int) -> None:
+        # pylint: disable=unused-argument,no-self-use
+        return None
+
+    async def fetch_user(self, user_id: int) -> _RemoteUser:
+        info = await self.worker.request(FETCH_USER, user_id)
+        return remote_user(self.worker, info)
+
+    async def close(self) -> None:
+        self.worker.notify(SHUTDOWN)
+
+
+class Worker(Transport):
+    """The end of a worker process connected to the gateway."""
+    def __init__(self, shard: int, shards: int,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        super().__init__(shard, shards)
+        self._reader = reader
+        self._writer = writer
+        self._request_ids = itertools.count()
+        self._requests: Dict[int, asyncio.Future[Any]] = {}
+        # events being handled, kept so they aren't garbage collected
+        self._tasks: typing.Set[asyncio.Task[None]] = set()
+
+    def notify(self, kind: str, *args: Any) -> None:
+        write_frame(self._writer, (kind,) + args)
+
+    async def request(self, kind: str, *args: Any) -> Any:
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        write_frame(self._writer, (kind, request_id) + args)
+        try:
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise remote_error(
+                504, 'Gateway Timeout', {},
+                'No answer to {} in {} seconds'.format(
+                    kind, REQUEST_TIMEOUT)) from None
+        finally:
+            del self._requests[request_id]
+
+    def _reply(self, request_id: int, result: Any,
+               error: Optional[Tuple[int, str, Dict[str, str], str]]
+               ) -> None:
+        future = self._requests.get(request_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(remote_error(*error))
+        else:
+            future.set_result(result)
+
+    def _handle(self, bot: WorkerBot, frame: Tuple[Any, ...]) -> None:
+        kind = frame[0]
+        if kind == REPLY:
+            self._reply(*frame[1:])
+            return
+
+        if kind == MESSAGE:
+            coroutine = bot.on_message(remote_message(self, *frame[1:]))
+        elif kind in (REACTION, REACTION_REMOVE):
+            payload = remote_reaction_event(self, *frame[1:])
+            coroutine = (bot.on_raw_reaction_add(payload) if kind == REACTION
+                         else bot.on_raw_reaction_remove(payload))
+        elif kind == RENAME:
+            before, after = frame[1:]
+            coroutine = bot.on_member_update(remote_user(self, before),
+                                             remote_user(self, after))
+        else:
+            print('worker {}: unknown frame {}'.format(self.shard, kind))
+            return
+
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finish_event)
+
+    def _finish_event(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print('worker {}: {!r}'.format(self.shard, task.exception()))
+
+    async def run(self) -> None:
+        self.notify(HELLO, self.shard)
+        bot = WorkerBot(self)
+        reading = asyncio.create_task(self._read(bot))
+        await bot._restore_games()  # pylint: disable=protected-access
+        self.notify(RESTORED)
+        await reading
+
+    async def _read(self, bot: WorkerBot) -> None:
+        while True:
+            try:
+                frame = await read_frame(self._reader)
+            except asyncio.IncompleteReadError:
+                return
+            self._handle(bot, frame)
+
+
+async def _run_worker(socket_path: str, shard: int, shards: int) -> None:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    await Worker(shard, shards, reader, writer).run()
+
+
+def run_worker(socket_path: str, shard: int, shards: int) -> None:
+    """Entry point of a worker process."""
+    asyncio.run(_run_worker(socket_path, shard, shards))
+
+
+class Gateway(discord.Client):  # type: ignore
+    """The Discord client in front of the workers."""
+    def __init__(self, workers: int,
+                 socket_path: str = DEFAULT_SOCKET) -> None:
+        super().__init__()
+        self.shards = workers
+        self.socket_path = socket_path
+        self._processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._started_at: Dict[int, float] = {}
+        self._restart_delays: Dict[int, float] = {}
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        # frames for workers not connected yet, e.g. while restarting
+        self._backlog: Dict[int, List[Tuple[Any, ...]]] = {
+            shard: [] for shard in range(workers)}
+        # the shard of the game each user last joined, for their DMs
+        self._user_shards: Dict[int, int] = {}
+        # the shard of the active game of each user
+        self._active_shards: Dict[int, int] = {}
+        # users whose joins were forwarded, with the shard and until when
+        # they count as joining it
+        self._joining: Dict[int, Tuple[int, float]] = {}
+        # users in an active game of each restarted shard, as known before
+        # it restarted, which are dropped unless it restores their game
+        self._stale: Dict[int, typing.Set[int]] = {}
+        self._sent: typing.OrderedDict[
+            int, discord.Message] = collections.OrderedDict()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._closing = False
+        # requests being carried out, kept so they aren't garbage collected
+        self._tasks: typing.Set[asyncio.Task[None]] = set()
+
+    async def start_workers(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._serve,
+                                                       self.socket_path)
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def _spawn(self, shard: int) -> None:
+        if self._closing:
+            return
+        process = multiprocessing.get_context('spawn').Process(
+            target=run_worker, args=(self.socket_path, shard, self.shards),
+            daemon=True)
+        process.start()
+        self._processes[shard] = process
+        loop = asyncio.get_running_loop()
+        self._started_at[shard] = loop.time()
+        loop.add_reader(process.sentinel, self._exited, shard, process)
+
+    def _exited(self, shard: int,
+                process: multiprocessing.process.BaseProcess) -> None:
+        """Start a worker again once it dies, later the sooner it died."""
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(process.sentinel)
+        process.join()
+        if self._closing:
+            return
+        if loop.time() - self._started_at[shard] >= RESTART_RESET:
+            delay = 0.0
+        else:
+            delay = min(max(2 * self._restart_delays.get(shard, 0.0),
+                            RESTART_DELAY),
+                        MAX_RESTART_DELAY)
+        self._restart_delays[shard] = delay
+        print('worker {} stopped with exit code {}, restarting it in {} '
+              'seconds'.format(shard, process.exitcode, delay))
+        loop.call_later(delay, self._spawn, shard)
+
+    def channel_shard(self, channel_id: int) -> int:
+        return channel_id % self.shards
+
+    def _forward(self, shard: int, frame: Tuple[Any, ...]) -> None:
+        writer = self._writers.get(shard)
+        if writer is None:
+            self._backlog[shard].append(frame)
+            return
+        write_frame(writer, frame)
+
+    async def on_ready(self) -> None:
+        print('Logged in as {} with {} workers'.format(self.user,
+                                                       self.shards))
+        # on_ready is also called on reconnecting
+        if self._server is None:
+            await self.start_workers()
+
+    async def on_message(self, message: discord.Message) -> None:
+        if message.author == self.user or not message.content.startswith(
+                '!'):
+            return
+        frame = message_frame(message)
+        if frame[1] == DM:
+            shard = self._user_shards.get(frame[2],
+                                          self.channel_shard(frame[2]))
+        else:
+            shard = self.channel_shard(frame[2])
+            command = message.content.split(' ')[0][1:]
+            if command in JOIN_COMMANDS:
+                if self._in_other_game(message.author.id, shard):
+                    await message.channel.send(
+                        'Error running `{}`: You are a player in an active '
+                        'game.'.format(command))
+                    return
+                self._joining[message.author.id] = (
+                    shard, asyncio.get_running_loop().time() + JOIN_TIMEOUT)
+        self._forward(shard, frame)
+
+    def _in_other_game(self, user_id: int, shard: int) -> bool:
+        """Whether the user is in, or joining, an active game of a shard
+        other than shard."""
+        active = self._active_shards.get(user_id)
+        if active is not None and active != shard:
+            return True
+        joining, until = self._joining.get(user_id, (shard, 0.0))
+        return (joining != shard
+                and until > asyncio.get_running_loop().time())
+
+    def _forward_reaction(self, kind: str,
+                          payload: discord.RawReactionActionEvent) -> None:
+        member = None if payload.member is None else user_info(payload.member)
+        self._forward(self.channel_shard(payload.channel_id),
+                      (kind, payload.channel_id, payload.message_id,
+                       str(payload.emoji), payload.user_id, member))
+
+    async def on_raw_reaction_add(
+            self, payload: discord.RawReactionActionEvent) -> None:
+        self._forward_reaction(REACTION, payload)
+
+    async def on_raw_reaction_remove(
+            self, payload: discord.RawReactionActionEvent) -> None:
+        self._forward_reaction(REACTION_REMOVE, payload)
+
+    async def on_member_update(self, before: discord.Member,
+                               after: discord.Member) -> None:
+        shard = self._user_shards.get(after.id)
+        if shard is not None:
+            self._forward(shard, (RENAME, user_info(before),
+                                  user_info(after)))
+
+    async def _serve(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Handle the requests of one worker until it disconnects."""
+        try:
+            hello = await read_frame(reader)
+        except asyncio.IncompleteReadError:
+            return
+        shard = hello[1]
+        self._writers[shard] = writer
+        self._stale[shard] = {user_id for user_id, active_shard
+                              in self._active_shards.items()
+                              if active_shard == shard}
+        for frame in self._backlog[shard]:
+            write_frame(writer, frame)
+        self._backlog[shard].clear()
+
+        while True:
+            try:
+                frame = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+            self._handle(shard, writer, frame)
+
+        if self._writers.get(shard) is writer:
+            del self._writers[shard]
+
+    def _handle(self, shard: int, writer: asyncio.StreamWriter,
+                frame: Tuple[Any, ...]) -> None:
+        kind = frame[0]
+        if kind == REGISTER:
+            user_id, active = frame[1:]
+            self._user_shards[user_id] = shard
+            self._joining.pop(user_id, None)
+            self._stale.get(shard, set()).discard(user_id)
+            if active:
+                self._active_shards[user_id] = shard
+            else:
+                self._release(user_id, shard)
+        elif kind == UNREGISTER:
+            if self._user_shards.get(frame[1]) == shard:
+                del self._user_shards[frame[1]]
+            self._release(frame[1], shard)
+        elif kind == FINISH:
+            self._release(frame[1], shard)
+        elif kind == RESTORED:
+            for user_id in self._stale.pop(shard, set()):
+                self._release(user_id, shard)
+        elif kind == SHUTDOWN:
+            task = asyncio.create_task(self.close())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            task = asyncio.create_task(self._answer(writer, frame))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _release(self, user_id: int, shard: int) -> None:
+        """The user is no longer in an active game of shard."""
+        if self._active_shards.get(user_id) == shard:
+            del self._active_shards[user_id]
+
+    async def _answer(self, writer: asyncio.StreamWriter,
+                      frame: Tuple[Any, ...]) -> None:
+        kind, request_id = frame[:2]
+        result: Any = None
+        error = None
+        try:
+            if kind == SEND:
+                result = await self._send(*frame[2:])
+            elif kind == REACT:
+                message = await self._message(*frame[2:4])
+                await message.add_reaction(frame[4])
+            elif kind == UNREACT:
+                message = await self._message(*frame[2:4])
+                await message.remove_reaction(frame[4],
+                                              discord.Object(frame[5]))
+            elif kind == FETCH_USER:
+                result = user_info(self.get_user(frame[2])
+                                   or await self.fetch_user(frame[2]))
+            else:
+                raise ValueError('Unknown request {}'.format(kind))
+        except discord.HTTPException as http_error:
+            response = http_error.response
+            error = (http_error.status, getattr(response, 'reason', ''),
+                     dict(getattr(response, 'headers', None) or {}),
+                     str(http_error))
+        except Exception as other_error:  # pylint: disable=broad-except
+            error = (0, type(other_error).__name__, {}, str(other_error))
+        if not writer.is_closing():
+            write_frame(writer, (REPLY, request_id, result, error))
+
+    async def _channel(self, kind: str, target_id: int) -> Any:
+        if kind == DM:
+            user = (self.get_user(target_id)
+                    or await self.fetch_user(target_id))
+            return user.dm_channel or await user.create_dm()
+        return (self.get_channel(target_id)
+                or await self.fetch_channel(target_id))
+
+    async def _send(self, kind: str, target_id: int, content: str) -> int:
+        channel = await self._channel(kind, target_id)
+        message = await channel.send(content)
+        self._sent[message.id] = message
+        if len(self._sent) > MESSAGE_CACHE:
+            self._sent.popitem(last=False)
+        return typing.cast(int, message.id)
+
+    async def _message(self, channel_id: int,
+                       message_id: int) -> discord.Message:
+        """A message sent by the gateway, fetched if it's no longer
+        cached."""
+        message = self._sent.get(message_id)
+        if message is None:
+            channel = await self._channel(TEXT, channel_id)
+            message = await channel.fetch_message(message_id)
+        return message
+
+    async def close(self) -> None:
+        self._closing = True
+        for writer in self._writers.values():
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+        await super().close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Run the bot with games spread over worker processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    args = parser.parse_args()
+
+    with open('discord_token') as token_file:
+        token = token_file.read().strip()
+
+    Gateway(args.workers, args.socket).run(token)
+
+
+if __name__ == '__main__':
+    main()
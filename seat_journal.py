@@ -0,0 +1,207 @@
+"""Defines Journal, an append-only file of the events of one game, from which
+seat_replay rebuilds the game exactly.
+
+Each record is a 4 byte length followed by the event type and its fields,
+packed with the struct format in FORMATS, and for some events a variable
+length tail, e.g. a name. Players are referred to by their index in
+SeatGame.players at the time of the event.
+
+The file is memory-mapped and grown in chunks, with the unused end filled
+with zeros, which mark the end of the journal. Records are collected in a
+buffer and copied to the map once per iteration of the event loop, or when
+the buffer is full, so recording an event only costs packing it. The pages
+of the map are written by the OS, so they survive the bot crashing.
+
+A journal may hold its records back, e.g. those of a game that hasn't
+started, in which case nothing is written and the file isn't even opened
+until it's released, or the records held fill the buffer. Closing it while
+held drops the records."""
+from __future__ import annotations
+
+import os
+import mmap
+import struct
+import asyncio
+from enum import IntEnum
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'SEATJRNL'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 1 << 20
+BUFFER_LIMIT = 1 << 16
+DEFAULT_JOURNAL_DIR = 'journals'
+
+_FILE_HEADER = struct.Struct('<8sB')
+_LENGTH = struct.Struct('<I')
+
+
+class Event(IntEnum):
+    CREATE = 1
+    OPTION = 2
+    JOIN = 3
+    LEAVE = 4
+    ADD_BOT = 5
+    REMOVE_BOT = 6
+    START = 7
+    PROPOSE = 8
+    ACCEPT = 9
+    CANCEL = 10
+    BOTSWAP = 11
+    CANCEL_BOTSWAP = 12
+    DONATE = 13
+    SWAP = 14
+    UNDO = 15
+    BOT_PLAN = 16
+    NEW_ROUND = 17
+    STOP = 18
+
+
+# Fields of each event, after the event type. Tails are:
+# CREATE the options as json, OPTION the value as json, JOIN and ADD_BOT the
+# name, BOT_PLAN the numbers the bot accepts, one byte each.
+FORMATS: Dict[Event, str] = {
+    Event.CREATE: 'Q',  # seed
+    Event.OPTION: 'B',  # length of the name, followed by the name
+    Event.JOIN: 'Q',  # user id
+    Event.LEAVE: 'H',  # player
+    Event.ADD_BOT: '?',  # strategic
+    Event.REMOVE_BOT: 'H',  # bot
+    Event.START: '',
+    Event.PROPOSE: 'HHi',  # source, target, garnets
+    Event.ACCEPT: 'HH',  # source, target
+    Event.CANCEL: 'HH',  # source, target
+    Event.BOTSWAP: 'HHHi',  # source, target, guarantor, garnets
+    Event.CANCEL_BOTSWAP: 'HHHi',  # source, target, guarantor, garnets
+    Event.DONATE: 'HHi',  # donater, target, garnets
+    Event.SWAP: 'HH?',  # source, target, force
+    Event.UNDO: '',
+    Event.BOT_PLAN: 'H',  # bot
+    Event.NEW_ROUND: '',
+    Event.STOP: '',
+}
+
+_STRUCTS = {event: struct.Struct('<B' + fields)
+            for event, fields in FORMATS.items()}
+
+Record = Tuple[Event, Tuple[Any, ...], bytes]
+
+
+class Journal:
+    """The journal at path, opened for appending, created if it doesn't
+    exist. If held, records are only buffered until release."""
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE,
+                 held: bool = False) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.held = held
+        self._buffer = bytearray()
+        self._flush_scheduled = False
+        self._closed = False
+        self._file: Optional[IO[bytes]] = None
+        self._map: Optional[mmap.mmap] = None
+        self._end = _FILE_HEADER.size
+        if not held:
+            self._open()
+
+    def _open(self) -> None:
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as journal_file:
+                journal_file.write(_FILE_HEADER.pack(MAGIC, FORMAT_VERSION))
+                journal_file.truncate(self.chunk_size)
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._end = _end_of_records(self._map)
+
+    @property
+    def empty(self) -> bool:
+        return self._end == _FILE_HEADER.size and not self._buffer
+
+    def release(self) -> None:
+        """Stop holding records back, writing the ones held."""
+        self.held = False
+        self.flush()
+
+    def append(self, event: Event, *values: Any, tail: bytes = b'') -> None:
+        body = _STRUCTS[event].pack(event, *values) + tail
+        self._buffer += _LENGTH.pack(len(body))
+        self._buffer += body
+
+        if len(self._buffer) >= BUFFER_LIMIT:
+            # too much to hold back
+            self.release()
+        elif not self.held and not self._flush_scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_scheduled = True
+            loop.call_soon(self.flush)
+
+    def flush(self) -> None:
+        self._flush_scheduled = False
+        if not self._buffer or self.held or self._closed:
+            return
+        if self._map is None:
+            self._open()
+        assert self._file is not None and self._map is not None
+        end = self._end + len(self._buffer)
+        if end > len(self._map):
+            size = len(self._map)
+            while size < end:
+                size += self.chunk_size
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        self._map[self._end:end] = self._buffer
+        self._end = end
+        self._buffer.clear()
+
+    def close(self) -> None:
+        """Flush, and cut the file down to the records in it."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._buffer.clear()
+        if self._file is None or self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._end)
+        self._file.close()
+
+
+def _records(data: Any, offset: int) -> Iterator[Tuple[int, int]]:
+    """Start and end of the body of each record in data from offset."""
+    size = len(data)
+    while offset + _LENGTH.size <= size:
+        length, = _LENGTH.unpack_from(data, offset)
+        start = offset + _LENGTH.size
+        if length == 0 or start + length > size:
+            return
+        yield start, start + length
+        offset = start + length
+
+
+def _end_of_records(data: Any) -> int:
+    end = _FILE_HEADER.size
+    for _, end in _records(data, end):
+        pass
+    return end
+
+
+def read_journal(path: str) -> Iterator[Record]:
+    """The events in the journal at path, with their fields and tails."""
+    with open(path, 'rb') as journal_file:
+        data = journal_file.read()
+    magic, version = _FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('{} is not a journal of this version.'.format(path))
+
+    # indexed by the event type, which is faster than Event(...)
+    kinds: List[Any] = [None] * (max(Event) + 1)
+    for event, record_struct in _STRUCTS.items():
+        kinds[event] = (event, record_struct.unpack_from, record_struct.size)
+    for start, end in _records(data, _FILE_HEADER.size):
+        event, unpack_from, size = kinds[data[start]]
+        yield event, unpack_from(data, start)[1:], data[start + size:end]
@@ -0,0 +1,489 @@
+#!/usr/bin/python3
+"""Defines LoadTest, which runs the bot against an in-memory Discord, with
+many channels and users sending commands and voting at a target rate, to see
+how it copes without a live Discord.
+
+The bot is a WorkerBot from seat_gateway, with FakeDiscord in place of the
+gateway, so everything from commands to games runs as in production, and
+every message, reaction and user lookup is a request to FakeDiscord. Requests
+take latency seconds, give or take half, and a fraction of them are rate
+limited and retried after RETRY_AFTER seconds, like discord.py does, until
+they fail after TRANSPORT_RETRIES attempts. Sends to a DM channel must be
+to the id of a user, as the bot's DM channels have their user's id.
+
+Each channel has a game with its share of the users. Games are created,
+joined and readied in order, then users send random gameplay commands and
+vote for early rounds, picked at random at the target rate regardless of how
+fast the bot answers. DMs arrive in a DM channel with an id of its own, and
+are turned into what the worker gets the way Gateway does. The report has
+how many commands the bot answered with an error, latency percentiles of
+each command, how late the event loop ran and the requests made of
+Discord.
+
+With more than one worker, the channels, users and rate are split evenly
+over that many LoadTests, each in a process of its own, like the workers
+Gateway shards channels over, and their reports are merged. Comparing the
+events per second and latencies at a rate one worker can't keep up with
+measures how throughput scales with cores, leaving out the hop through the
+gateway.
+
+Run as a script to load test, e.g.
+    ./seat_loadtest.py --channels 500 --users 5000 --rate 200 --duration 60
+    ./seat_loadtest.py --rate 2000 --duration 30 --workers 4"""
+from __future__ import annotations
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import contextlib
+import dataclasses
+import tempfile
+import typing
+from typing import Any, Dict, List, Optional, Sequence, Set
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from discord_game import GameState
+from seat_typing import SeatException
+from seat_gateway import (Transport, WorkerBot, UserInfo, TEXT, DM, SEND,
+                          REACT, UNREACT, FETCH_USER, message_frame,
+                          remote_error, remote_message,
+                          remote_reaction_event)
+
+DEFAULT_LATENCY = 0.05
+DEFAULT_RATE_LIMIT_CHANCE = 0.01
+RETRY_AFTER = 0.5
+TRANSPORT_RETRIES = 5
+LAG_INTERVAL = 0.05
+# how long to wait for every game to start after the last !ready
+START_TIMEOUT = 30
+VOTE_EMOJI = '✅'  # :white_check_mark:
+
+_CHANNEL_IDS = 1 << 40
+_USER_IDS = 1 << 41
+_MESSAGE_IDS = 1 << 42
+_DM_CHANNEL_IDS = 1 << 43
+
+# what users do once their game is running, by weight
+ACTIONS = {
+    'propose': 30,
+    'accept': 15,
+    'cancel': 5,
+    'info': 25,
+    'vote': 20,
+    'unvote': 5,
+}
+# info commands sent in the channel of the game, and by DM
+PUBLIC_INFO_COMMANDS = ('!players', '!seating', '!garnets')
+PRIVATE_INFO_COMMANDS = ('!proposals',)
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """The value at fraction of sorted values."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class FakeDiscord(Transport):
+    """Discord in memory, answering the requests of the bot. Keeps the
+    users, the vote message of each channel, which is the last message the
+    bot reacted to, and who reacted to it."""
+    def __init__(self, latency: float, rate_limit_chance: float,
+                 rng: random.Random) -> None:
+        super().__init__(0, 1)
+        self.latency = latency
+        self.rate_limit_chance = rate_limit_chance
+        self.rng = rng
+        self.users: Dict[int, UserInfo] = {}
+        self.votes: Dict[int, int] = {}
+        self.reactions: Dict[int, Set[int]] = {}
+        self.calls: typing.Counter[str] = Counter()
+        self.rate_limited = 0
+        self.not_found = 0
+        self._message_ids = itertools.count(_MESSAGE_IDS)
+
+    def notify(self, kind: str, *args: Any) -> None:
+        pass
+
+    async def request(self, kind: str, *args: Any) -> Any:
+        name = '{} {}'.format(kind, args[0]) if kind == SEND else kind
+        for attempt in itertools.count(1):
+            self.calls[name] += 1
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+            if self.rng.random() >= self.rate_limit_chance:
+                break
+            self.rate_limited += 1
+            if attempt >= TRANSPORT_RETRIES:
+                raise remote_error(429, 'Too Many Requests',
+                                   {'Retry-After': str(RETRY_AFTER)},
+                                   'rate limited')
+            await asyncio.sleep(RETRY_AFTER)
+        return self._answer(kind, *args)
+
+    def _answer(self, kind: str, *args: Any) -> Any:
+        if kind == SEND:
+            if args[0] == DM and args[1] not in self.users:
+                self.not_found += 1
+                raise remote_error(404, 'Not Found', {}, 'Unknown User')
+            return next(self._message_ids)
+        if kind == REACT:
+            channel_id, message_id, _ = args
+            old = self.votes.get(channel_id)
+            if old is not None:
+                self.reactions.pop(old, None)
+            self.votes[channel_id] = message_id
+            self.reactions[message_id] = set()
+            return None
+        if kind == UNREACT:
+            _, message_id, _, user_id = args
+            self.reactions.get(message_id, set()).discard(user_id)
+            return None
+        if kind == FETCH_USER:
+            return self.users[args[0]]
+        raise ValueError('Unknown request {}'.format(kind))
+
+
+class _LoadBot(WorkerBot):
+    """A WorkerBot counting the commands it answers with an error."""
+    def __init__(self, worker: FakeDiscord) -> None:
+        super().__init__(worker)
+        self.failed = 0
+
+    async def reply_errors(self, message: Any,
+                           errors: List[SeatException]) -> None:
+        self.failed += 1
+        await super().reply_errors(message, errors)
+
+
+@dataclass
+class LoadConfig:
+    channels: int = 500
+    users: int = 5000
+    rate: float = 200.0
+    duration: float = 60.0
+    latency: float = DEFAULT_LATENCY
+    rate_limit_chance: float = DEFAULT_RATE_LIMIT_CHANCE
+    round_length: Optional[int] = None
+    seed: int = 0
+
+
+@dataclass
+class LoadReport:
+    """What was measured, latencies and lags in seconds."""
+    duration: float = 0.0
+    events: int = 0
+    errors: int = 0
+    # commands the bot answered with an error
+    failed: int = 0
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    lags: List[float] = field(default_factory=list)
+    calls: typing.Counter[str] = field(default_factory=Counter)
+    rate_limited: int = 0
+    not_found: int = 0
+    games: typing.Counter[str] = field(default_factory=Counter)
+    # rounds started while under load
+    rounds: int = 0
+
+    def merge(self, other: LoadReport) -> None:
+        """Add the report of a worker run alongside this one."""
+        self.duration = max(self.duration, other.duration)
+        self.events += other.events
+        self.errors += other.errors
+        self.failed += other.failed
+        for name, latencies in other.latencies.items():
+            self.latencies.setdefault(name, []).extend(latencies)
+        self.lags.extend(other.lags)
+        self.calls.update(other.calls)
+        self.rate_limited += other.rate_limited
+        self.not_found += other.not_found
+        self.games.update(other.games)
+        self.rounds += other.rounds
+
+    def summary(self) -> str:
+        lines = ['{} events in {:.1f} s, {:.0f} per second, {} errors, {} '
+                 'commands failed'.format(
+                     self.events, self.duration,
+                     self.events / max(self.duration, 1e-9), self.errors,
+                     self.failed)]
+        lines.append('{:<16}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+            'Latency (ms)', 'count', 'p50', 'p90', 'p99', 'max'))
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            lines.append('{:<16}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'
+                         .format(name, len(latencies),
+                                 *(1000 * percentile(latencies, fraction)
+                                   for fraction in (0.5, 0.9, 0.99, 1.0))))
+        if self.lags:
+            lags = sorted(self.lags)
+            lines.append('Event loop lag: p50 {:.1f} ms, p99 {:.1f} ms, '
+                         'max {:.1f} ms'.format(
+                             1000 * percentile(lags, 0.5),
+                             1000 * percentile(lags, 0.99),
+                             1000 * lags[-1]))
+        lines.append('Requests to Discord, {} rate limited, {} not found:'
+                     ''.format(self.rate_limited, self.not_found))
+        for name, count in self.calls.most_common():
+            lines.append('  {:<14}{:>8}{:>10.1f}/s'.format(
+                name, count, count / max(self.duration, 1e-9)))
+        lines.append('Games: {}, {} rounds started'.format(
+            ', '.join('{} {}'.format(count, state)
+                      for state, count in sorted(self.games.items())),
+            self.rounds))
+        return '\n'.join(lines)
+
+
+class LoadTest:
+    """Users of a WorkerBot on a FakeDiscord, split evenly over channels,
+    each channel with one game."""
+    def __init__(self, config: LoadConfig) -> None:
+        if config.users < config.channels:
+            raise ValueError('Every channel needs at least one user.')
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.discord = FakeDiscord(config.latency, config.rate_limit_chance,
+                                   random.Random(config.seed + 1))
+        self.bot = _LoadBot(self.discord)
+        self.report = LoadReport()
+        self.channels = [_CHANNEL_IDS + i for i in range(config.channels)]
+        self.players: Dict[int, List[int]] = {
+            channel_id: [] for channel_id in self.channels}
+        self.dm_channels: Dict[int, int] = {}
+        for index in range(config.users):
+            user_id = _USER_IDS + index
+            name = 'user{}'.format(index)
+            self.discord.users[user_id] = (user_id, name, name, ())
+            self.dm_channels[user_id] = _DM_CHANNEL_IDS + index
+            self.players[self.channels[index % config.channels]].append(
+                user_id)
+        # events being handled, kept so they aren't garbage collected
+        self._tasks: Set[asyncio.Task[None]] = set()
+
+    def _record(self, name: str, start: float) -> None:
+        self.report.latencies.setdefault(name, []).append(
+            time.perf_counter() - start)
+        self.report.events += 1
+
+    async def message(self, user_id: int, channel_id: Optional[int],
+                      content: str) -> None:
+        """Send content from the user, in channel_id, or by DM if None."""
+        if channel_id is None:
+            # as received by Gateway, then as forwarded to the worker
+            received = remote_message(self.discord, DM,
+                                      self.dm_channels[user_id], '',
+                                      self.discord.users[user_id], content)
+            message = remote_message(self.discord,
+                                     *message_frame(received)[1:])
+        else:
+            message = remote_message(self.discord, TEXT, channel_id,
+                                     str(channel_id),
+                                     self.discord.users[user_id], content)
+        start = time.perf_counter()
+        try:
+            await self.bot.on_message(message)
+        except Exception:  # pylint: disable=broad-except
+            self.report.errors += 1
+        self._record(content.split(' ')[0], start)
+
+    async def react(self, user_id: int, channel_id: int, add: bool) -> None:
+        """Add or remove the user's vote in channel_id, if it has a vote."""
+        message_id = self.discord.votes.get(channel_id)
+        if message_id is None:
+            return
+        reactions = self.discord.reactions[message_id]
+        if add:
+            reactions.add(user_id)
+        else:
+            reactions.discard(user_id)
+        payload = remote_reaction_event(
+            self.discord, channel_id, message_id, VOTE_EMOJI, user_id,
+            self.discord.users[user_id] if add else None)
+        start = time.perf_counter()
+        try:
+            if add:
+                await self.bot.on_raw_reaction_add(payload)
+            else:
+                await self.bot.on_raw_reaction_remove(payload)
+        except Exception:  # pylint: disable=broad-except
+            self.report.errors += 1
+        self._record('vote' if add else 'unvote', start)
+
+    async def _set_up(self, channel_id: int) -> None:
+        players = self.players[channel_id]
+        await self.message(players[0], channel_id, '!create')
+        if self.config.round_length is not None:
+            await self.message(players[0], channel_id,
+                               '!roundlength {}'.format(
+                                   self.config.round_length))
+        for user_id in players:
+            await self.message(user_id, channel_id, '!join')
+        for user_id in players:
+            await self.message(user_id, channel_id, '!ready')
+
+    async def set_up(self) -> None:
+        """Create, join and ready every game, and wait for them to start."""
+        await asyncio.gather(*(self._set_up(channel_id)
+                               for channel_id in self.channels))
+        deadline = time.perf_counter() + START_TIMEOUT
+        while time.perf_counter() < deadline and any(
+                game.state != GameState.RUNNING
+                for game in self.bot.games.values()):
+            await asyncio.sleep(0.5)
+
+    def _random_event(self) -> typing.Coroutine[Any, Any, None]:
+        channel_id = self.rng.choice(self.channels)
+        players = self.players[channel_id]
+        action = self.rng.choices(list(ACTIONS),
+                                  weights=list(ACTIONS.values()))[0]
+        if action in ('vote', 'unvote'):
+            # anyone may react, not only the players
+            user_id = self.rng.choice(players + [
+                _USER_IDS + self.rng.randrange(self.config.users)])
+            return self.react(user_id, channel_id, action == 'vote')
+
+        user_id = self.rng.choice(players)
+        if action == 'info':
+            command = self.rng.choice(PUBLIC_INFO_COMMANDS
+                                      + PRIVATE_INFO_COMMANDS)
+            return self.message(
+                user_id,
+                None if command in PRIVATE_INFO_COMMANDS else channel_id,
+                command)
+        if action == 'propose':
+            target = self.rng.choice([other for other in players
+                                      if other != user_id] or players)
+            return self.message(user_id, None, '!propose {} {}'.format(
+                self.discord.users[target][1], self.rng.randint(0, 2)))
+        return self.message(user_id, None, '!' + action)
+
+    async def _drive(self) -> None:
+        """Start random events at the target rate for the duration."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        started = 0
+        while loop.time() - start < self.config.duration:
+            due = int((loop.time() - start) * self.config.rate) - started
+            for _ in range(due):
+                task = asyncio.create_task(self._random_event())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            started += due
+            await asyncio.sleep(min(1 / self.config.rate, LAG_INTERVAL))
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+        self.report.duration = loop.time() - start
+
+    async def _measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.report.lags.append(loop.time() - before - LAG_INTERVAL)
+
+    async def run(self) -> LoadReport:
+        await self.bot.on_ready()
+        await self.set_up()
+        # only the load is reported, not setting up
+        self.report = LoadReport()
+        calls = Counter(self.discord.calls)
+        rate_limited = self.discord.rate_limited
+        failed = self.bot.failed
+        rounds = sum(game.current_round for game in self.bot.games.values())
+
+        lag = asyncio.create_task(self._measure_lag())
+        await self._drive()
+        lag.cancel()
+
+        report = self.report
+        report.calls = Counter(self.discord.calls)
+        report.calls.subtract(calls)
+        report.rate_limited = self.discord.rate_limited - rate_limited
+        report.failed = self.bot.failed - failed
+        # sends to unknown users are always a bug, so setting up counts too
+        report.not_found = self.discord.not_found
+        report.rounds = -rounds
+        for game in self.bot.games.values():
+            report.games[str(game.state)] += 1
+            report.rounds += game.current_round
+            if game.active:
+                game.stop()
+        return report
+
+
+def split_config(config: LoadConfig, workers: int) -> List[LoadConfig]:
+    """config split evenly over workers, each with a seed of its own."""
+    if config.channels < workers:
+        raise ValueError('Every worker needs at least one channel.')
+
+    def share(total: int, index: int) -> int:
+        return total // workers + (index < total % workers)
+    return [dataclasses.replace(config,
+                                channels=share(config.channels, index),
+                                users=share(config.users, index),
+                                rate=config.rate / workers,
+                                seed=config.seed + index)
+            for index in range(workers)]
+
+
+def _load_test(config: LoadConfig, verbose: bool = False) -> LoadReport:
+    """Run a LoadTest in a temporary directory, for its saves, journals and
+    archives, showing the bot's output if verbose."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, \
+            open(os.devnull, 'w') as devnull:
+        os.chdir(directory)
+        try:
+            with (contextlib.nullcontext() if verbose  # type: ignore
+                  else contextlib.redirect_stdout(devnull)):
+                return asyncio.run(LoadTest(config).run())
+        finally:
+            os.chdir(cwd)
+
+
+def load_test(config: LoadConfig, workers: int = 1,
+              verbose: bool = False) -> LoadReport:
+    """Run config split over workers processes, in this process if only
+    one."""
+    if workers == 1:
+        return _load_test(config, verbose)
+    configs = split_config(config, workers)
+    report = LoadReport()
+    with ProcessPoolExecutor(workers) as pool:
+        for worker_report in pool.map(_load_test, configs,
+                                      [verbose]*workers):
+            report.merge(worker_report)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Load test the bot against an in-memory Discord.')
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=200.0,
+                        help='Events per second.')
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='Seconds each request to Discord takes.')
+    parser.add_argument('--rate-limit-chance', type=float,
+                        default=DEFAULT_RATE_LIMIT_CHANCE,
+                        help='Fraction of requests answered with a 429.')
+    parser.add_argument('--round-length', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes to split channels, users and rate '
+                             'over.')
+    parser.add_argument('--verbose', action='store_true',
+                        help="Show the bot's output.")
+    args = parser.parse_args()
+
+    config = LoadConfig(args.channels, args.users, args.rate, args.duration,
+                        args.latency, args.rate_limit_chance,
+                        args.round_length, args.seed)
+    print(load_test(config, args.workers, args.verbose).summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""Defines outcome_stats, which counts the longest streak and its instances
+over every seating of a small table exactly.
+
+Streaks don't change when the seating is rotated or mirrored around the
+table, so only seatings with number 0 in seat 0 are enumerated, and of each
+mirrored pair only the one with the smaller number in seat 1. Relabelling
+the numbers by rotating or mirroring them moves X along with them, so X sets
+that are relabellings of each other give the same counts and share a cache
+entry.
+
+Seatings are enumerated by their numbers in seats 1 and 2, in worker
+processes, where the rest of each seating is taken from a table of the
+permutations of the remaining numbers computed once per worker, and scored
+with seat_batch.evaluate_streaks. Takes seconds for 11 seats.
+
+Results are cached on disk as json, keyed by number of seats and X set. The
+win length only decides which outcomes end the game, so it's an argument to
+the result instead of part of the key."""
+from __future__ import annotations
+
+import os
+import json
+import math
+import argparse
+import functools
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np  # type: ignore
+
+from seat_batch import evaluate_streaks
+from seat_game import default_win_streak_length, default_x_count
+
+MAX_SIZE = 11
+DEFAULT_CACHE_DIR = 'outcome_cache'
+
+Outcome = Tuple[int, int]
+
+
+@dataclass
+class OutcomeStats:
+    """Number of seatings for each (longest streak, instances) outcome, out
+    of all size! seatings with the numbers in current_x being X."""
+    size: int
+    current_x: Tuple[int, ...]
+    counts: Dict[Outcome, int]
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def longest_distribution(self) -> Dict[int, Fraction]:
+        res: Dict[int, Fraction] = {}
+        for (longest, _), count in sorted(self.counts.items()):
+            res[longest] = res.get(longest, 0) + Fraction(count, self.total)
+        return res
+
+    def game_over_probability(self, win_length: int) -> Fraction:
+        """Probability that a random seating is winning, with the same rules
+        as SeatGame.game_over."""
+        if self.size < 4:
+            return Fraction(1)
+        wins = sum(count for (longest, instances), count
+                   in self.counts.items()
+                   if longest == win_length
+                   and (instances == 1 or self.size == win_length))
+        return Fraction(wins, self.total)
+
+
+def relabelling(size: int, current_x: Iterable[int]) -> Tuple[int, int]:
+    """The sign and offset of the relabelling number -> sign*number + offset
+    (mod size) taking current_x to its smallest form."""
+    x_set = set(current_x)
+    return min(((sign, offset) for sign in (1, -1)
+                for offset in range(size)),
+               key=lambda relabel: sorted(
+                   (relabel[0]*x + relabel[1]) % size for x in x_set))
+
+
+def canonical_x(size: int, current_x: Iterable[int]) -> Tuple[int, ...]:
+    """The smallest relabelling of current_x, by rotating or mirroring the
+    numbers."""
+    x_set = set(current_x)
+    sign, offset = relabelling(size, x_set)
+    return tuple(sorted((sign*x + offset) % size for x in x_set))
+
+
+@functools.lru_cache(maxsize=None)
+def permutations(count: int) -> np.ndarray:
+    """All permutations of range(count) in lexicographic order, so the row
+    is the rank of the permutation."""
+    return np.array(list(itertools.permutations(range(count))),
+                    dtype=np.int64).reshape(math.factorial(count), count)
+
+
+def _count_outcomes(seatings: np.ndarray,
+                    current_x: Tuple[int, ...],
+                    weight: int) -> Dict[Outcome, int]:
+    streaks = evaluate_streaks(seatings, current_x)
+    pairs, counts = np.unique(
+        np.stack((streaks.longest_streak, streaks.instances), axis=1),
+        axis=0, return_counts=True)
+    return {(int(longest), int(instances)): int(count)*weight
+            for (longest, instances), count in zip(pairs, counts)}
+
+
+def _count_prefix(size: int, current_x: Tuple[int, ...],
+                  prefix: Tuple[int, int]) -> Dict[Outcome, int]:
+    """Outcomes of the seatings starting with 0 and prefix, that are the
+    smaller of their mirrored pair, each counting for all its rotations and
+    mirrors."""
+    rest = [number for number in range(1, size) if number not in prefix]
+    seatings = np.empty((math.factorial(len(rest)), size), dtype=np.int64)
+    seatings[:, 0] = 0
+    seatings[:, 1:3] = prefix
+    seatings[:, 3:] = np.array(rest, dtype=np.int64)[
+        permutations(len(rest))]
+
+    seatings = seatings[seatings[:, 1] < seatings[:, -1]]
+    return _count_outcomes(seatings, current_x, 2*size)
+
+
+def _enumerate(size: int, current_x: Tuple[int, ...],
+               workers: Optional[int]) -> Dict[Outcome, int]:
+    if size < 3:
+        return _count_outcomes(permutations(size), current_x, 1)
+
+    prefixes = list(itertools.permutations(range(1, size), 2))
+    res: Dict[Outcome, int] = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for counts in pool.map(_count_prefix,
+                               [size]*len(prefixes),
+                               [current_x]*len(prefixes),
+                               prefixes):
+            for outcome, count in counts.items():
+                res[outcome] = res.get(outcome, 0) + count
+    return res
+
+
+def _cache_path(cache_dir: str, size: int, current_x: Tuple[int, ...]) -> str:
+    return os.path.join(cache_dir, 'outcomes_{}_x{}.json'.format(
+        size, '-'.join(str(x) for x in current_x)))
+
+
+def outcome_stats(size: int,
+                  current_x: Iterable[int] = (),
+                  workers: Optional[int] = None,
+                  cache_dir: Optional[str] = DEFAULT_CACHE_DIR
+                  ) -> OutcomeStats:
+    """Exact outcome counts over all seatings of size seats. Read from
+    cache_dir if there, otherwise enumerated with workers processes and
+    saved. A cache_dir of None disables the cache."""
+    if not 0 <= size <= MAX_SIZE:
+        raise ValueError('size must be between 0 and {}.'.format(MAX_SIZE))
+    x_tuple = tuple(sorted(set(current_x)))
+    if any(not 0 <= x < size for x in x_tuple):
+        raise ValueError('X must be numbers below size.')
+    key = canonical_x(size, x_tuple) if size else ()
+
+    path = _cache_path(cache_dir, size, key) if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path) as cache_file:
+            counts = {(longest, instances): count
+                      for longest, instances, count
+                      in json.load(cache_file)['counts']}
+        return OutcomeStats(size, x_tuple, counts)
+
+    counts = _enumerate(size, key, workers)
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)  # type: ignore
+        # write to a temporary file first, so other processes never read a
+        # partial cache file
+        with open(path + '.tmp', 'w') as cache_file:
+            json.dump({'size': size,
+                       'current_x': list(key),
+                       'counts': [[longest, instances, count]
+                                  for (longest, instances), count
+                                  in sorted(counts.items())]},
+                      cache_file)
+        os.replace(path + '.tmp', path)
+
+    return OutcomeStats(size, x_tuple, counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Exact streak statistics over all seatings.')
+    parser.add_argument('--players', type=int, nargs=2, default=(4, 9),
+                        metavar=('MIN', 'MAX'))
+    parser.add_argument('--x-count', type=int, nargs='+', default=None,
+                        help='X counts to check, default as in the game.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    for size in range(args.players[0], args.players[1]+1):
+        x_counts: List[int] = args.x_count or [default_x_count(size)]
+        win_length = default_win_streak_length(size)
+        for x_count in x_counts:
+            current_x = [(i*size)//x_count for i in range(x_count)]
+            stats = outcome_stats(size, current_x, args.workers,
+                                  args.cache_dir)
+            print('**{} players, {} X, win length {}**'.format(
+                size, x_count, win_length))
+            print('Game over: {:.4%}'.format(
+                float(stats.game_over_probability(win_length))))
+            print('Longest streak: ' + ', '.join(
+                '{}: {:.4%}'.format(longest, float(probability))
+                for longest, probability
+                in stats.longest_distribution().items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/python3
+"""Defines GameStore, which saves every DiscordGame to disk so games survive
+a restart or crash of the bot.
+
+Each game is one file named by its channel id, in a compact binary format:
+the options as json, then seats, numbers, X and garnets as packed bytes like
+SeatSnapshot, then the players, proposals and botswaps, referring to players
+by their index. Files are written to a temporary file, synced to disk and
+renamed over the old one, so a crash while saving leaves the previous save
+in place, and a save that's done survives a crash of the machine.
+
+Games are saved on every transition, and every SAVE_INTERVAL seconds by the
+bot to keep proposals and joins, if they changed since they were last
+saved. Games are dumped on the event loop, and the files written by a
+thread of their own, in order. Finished and stopped games are removed. On
+startup the saved games are loaded, and round timers are re-armed with the
+time the round had left, minus the time the bot was down. Undo history and
+countdowns aren't saved, a game that was starting is loaded as created.
+
+Run as a script to benchmark loading, e.g.
+    ./seat_persistence.py --games 5000 --players 10"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import struct
+import random
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (Any, Awaitable, Callable, Iterable, List, Optional,
+                    Tuple)
+
+from discord_game import (DiscordGame, DiscordPlayer, BotPlayer, BotSwap,
+                          StrategicBotPlayer, CommonPlayer, GameState)
+from seat_game import SeatSnapshot
+from seat_typing import PrivateNumber, Seat, SeatChannel, SeatException
+
+MAGIC = b'SEAT'
+FORMAT_VERSION = 1
+SAVE_INTERVAL = 60
+DEFAULT_SAVE_DIR = 'saved_games'
+
+_HEADER = struct.Struct('<4sBQBdd')
+_PLAYER = struct.Struct('<BQBh')
+
+_DISCORD_PLAYER = 0
+_BOT = 1
+_STRATEGIC_BOT = 2
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+
+    def pack(self, fmt: str, *values: Any) -> None:
+        self.parts.append(struct.pack(fmt, *values))
+
+    def pack_bytes(self, data: bytes) -> None:
+        self.pack('<I', len(data))
+        self.parts.append(data)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.parts)
+
+
+class _Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> Tuple[Any, ...]:
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def unpack_bytes(self) -> bytes:
+        length, = self.unpack('<I')
+        res = bytes(self.data[self.offset:self.offset+length])
+        if len(res) != length:
+            raise SeatException('Saved game is truncated.')
+        self.offset += length
+        return res
+
+
+def dump_game(game: DiscordGame) -> bytes:
+    """The saved form of game."""
+    index = {player: i for i, player in enumerate(game.players)}
+    round_remaining = game.round_remaining
+    writer = _Writer()
+    writer.pack(_HEADER.format, MAGIC, FORMAT_VERSION, game.channel.id,
+                game.state.value, time.time(),
+                -1.0 if round_remaining is None else round_remaining)
+    writer.pack_bytes(json.dumps(game.options).encode())
+
+    snapshot = game.snapshot()
+    writer.pack('<HI', len(game.players), snapshot.current_round)
+    writer.pack_bytes(snapshot.player_seats)
+    writer.pack_bytes(snapshot.seat_numbers)
+    writer.pack_bytes(snapshot.swapped)
+    writer.pack_bytes(bytes(snapshot.current_x))
+    writer.pack('<{}i'.format(len(snapshot.garnets)), *snapshot.garnets)
+
+    for player in game.players:
+        if isinstance(player, DiscordPlayer):
+            writer.pack(_PLAYER.format, _DISCORD_PLAYER, player.user.id,
+                        player.ready, player.public_seat)
+            assigned = [(index[other], number) for other, number
+                        in player.assigned_numbers.items() if other in index]
+            writer.pack('<H', len(assigned))
+            for other, number in assigned:
+                writer.pack('<Hh', other, number)
+        else:
+            assert isinstance(player, BotPlayer)
+            kind = (_STRATEGIC_BOT if isinstance(player, StrategicBotPlayer)
+                    else _BOT)
+            writer.pack(_PLAYER.format, kind, 0, False, player.public_seat)
+            writer.pack_bytes(player.name.encode())
+
+    proposals = list(game.proposal_index)
+    writer.pack('<I', len(proposals))
+    for proposal in proposals:
+        writer.pack('<HHi', index[proposal.source], index[proposal.target],
+                    proposal.garnets)
+
+    botswaps = list(dict.fromkeys(
+        botswap for player in game.players for botswap in player.botswaps
+        if botswap.guarantor is player))
+    writer.pack('<I', len(botswaps))
+    for botswap in botswaps:
+        writer.pack('<HHHi', index[botswap.source], index[botswap.target],
+                    index[botswap.guarantor], botswap.garnets)
+    return writer.getvalue()
+
+
+async def load_game(data: bytes,
+                    get_channel: Callable[[int], Any],
+                    get_user: Callable[[int], Awaitable[Any]]
+                    ) -> Tuple[DiscordGame, Optional[float]]:
+    """A game from its saved form, and the seconds left of its round. The
+    discord channel and users are looked up by id with get_channel and
+    get_user."""
+    reader = _Reader(data)
+    (magic, version, channel_id, state, saved_at,
+     round_remaining) = reader.unpack(_HEADER.format)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise SeatException('Not a saved game of this version.')
+
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise SeatException('Found no channel {}.'.format(channel_id))
+    game = DiscordGame(SeatChannel(channel),
+                       json.loads(reader.unpack_bytes()))
+    game.state = GameState(state)
+    if game.state == GameState.STARTING:
+        game.state = GameState.CREATED
+
+    player_count, current_round = reader.unpack('<HI')
+    player_seats = reader.unpack_bytes()
+    seat_numbers = reader.unpack_bytes()
+    swapped = reader.unpack_bytes()
+    current_x = tuple(reader.unpack_bytes())
+    garnets = reader.unpack('<{}i'.format(player_count))
+
+    players: List[CommonPlayer] = []
+    assigned: List[Tuple[DiscordPlayer, List[Tuple[int, int]]]] = []
+    for _ in range(player_count):
+        kind, user_id, ready, public_seat = reader.unpack(_PLAYER.format)
+        player: CommonPlayer
+        if kind == _DISCORD_PLAYER:
+            user = await get_user(user_id)
+            if user is None:
+                raise SeatException('Found no user {}.'.format(user_id))
+            player = DiscordPlayer(user)
+            player.ready = bool(ready)
+            game.discord_players[user] = player
+            count, = reader.unpack('<H')
+            assigned.append((player, [reader.unpack('<Hh')
+                                      for _ in range(count)]))
+        else:
+            name = reader.unpack_bytes().decode()
+            player = (StrategicBotPlayer(name) if kind == _STRATEGIC_BOT
+                      else BotPlayer(name))
+            game.bots[name] = player
+        player.public_seat = Seat(public_seat)
+        players.append(player)
+
+    game.restore_players(players, SeatSnapshot(
+        player_seats, seat_numbers, swapped, current_x, current_round,
+        garnets))
+
+    for player, numbers in assigned:
+        for other, number in numbers:
+            player.assigned_numbers[players[other]] = PrivateNumber(number)
+
+    # garnets were saved with offers locked up, so give them back before
+    # locking them up again
+    for _ in range(reader.unpack('<I')[0]):
+        source, target, offer = reader.unpack('<HHi')
+        players[source].garnets += offer
+        players[source].add_proposal_to(players[target], offer)
+    for _ in range(reader.unpack('<I')[0]):
+        source, target, guarantor, offer = reader.unpack('<HHHi')
+        players[guarantor].garnets += offer
+        bots = players[source], players[target]
+        assert isinstance(bots[0], BotPlayer)
+        assert isinstance(bots[1], BotPlayer)
+        players[guarantor].add_botswap(
+            BotSwap(bots[0], bots[1], players[guarantor], offer))
+
+    game.dirty = False
+    if round_remaining < 0:
+        return game, None
+    if game.state == GameState.RUNNING:
+        round_remaining = max(round_remaining - (time.time() - saved_at), 0)
+    return game, round_remaining
+
+
+class GameStore:
+    """Saved games in directory, one file per channel."""
+    def __init__(self, directory: str = DEFAULT_SAVE_DIR) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # one thread, so saves of a game are written in order
+        self._writer = ThreadPoolExecutor(1)
+
+    def _path(self, channel_id: int) -> str:
+        return os.path.join(self.directory, '{}.game'.format(channel_id))
+
+    def save(self, game: DiscordGame) -> None:
+        """Save game, or remove its save if it's over. The file is written
+        in the background."""
+        path = self._path(game.channel.id)
+        data = dump_game(game) if game.active else None
+        game.dirty = False
+        self._writer.submit(self._write, path, data).add_done_callback(
+            _report_failure)
+
+    def _write(self, path: str, data: Optional[bytes]) -> None:
+        if data is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        # write to a temporary file first, so a crash never leaves a
+        # partial save, and sync it and the rename, so a crash of the
+        # machine doesn't either
+        with open(path + '.tmp', 'wb') as save_file:
+            save_file.write(data)
+            save_file.flush()
+            os.fsync(save_file.fileno())
+        os.replace(path + '.tmp', path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def save_all(self, games: Iterable[DiscordGame]) -> None:
+        """Save the games that changed since they were last saved."""
+        for game in games:
+            if game.dirty:
+                self.save(game)
+
+    def wait(self) -> None:
+        """Block until every save so far is written."""
+        self._writer.submit(lambda: None).result()
+
+    async def load_all(self,
+                       get_channel: Callable[[int], Any],
+                       get_user: Callable[[int], Awaitable[Any]],
+                       include: Optional[Callable[[int], bool]] = None
+                       ) -> List[Tuple[DiscordGame, Optional[float]]]:
+        """Every saved game that can be loaded, with the seconds left of its
+        round. Only games of channels for which include is true are loaded,
+        if given."""
+        res = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.game'):
+                continue
+            if include is not None and not include(int(filename[:-5])):
+                continue
+            with open(os.path.join(self.directory, filename), 'rb') as save:
+                data = save.read()
+            try:
+                res.append(await load_game(data, get_channel, get_user))
+            except (SeatException, struct.error, ValueError) as error:
+                print('Failed loading {}: {}'.format(filename, error))
+        return res
+
+
+def _report_failure(future: Future[None]) -> None:
+    if future.exception() is not None:
+        print('Failed saving a game: {!r}'.format(future.exception()))
+
+
+class _BenchmarkUser:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id  # pylint: disable=invalid-name
+        self.name = self.display_name = 'user{}'.format(user_id)
+        self.dm_channel = None
+
+    def __hash__(self) -> int:
+        return self.id
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _BenchmarkUser) and other.id == self.id
+
+
+class _BenchmarkChannel:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id  # pylint: disable=invalid-name
+
+
+def _benchmark_game(channel_id: int, players: int,
+                    rng: random.Random) -> DiscordGame:
+    game = DiscordGame(SeatChannel(_BenchmarkChannel(channel_id)), {})
+    users = [DiscordPlayer(_BenchmarkUser(channel_id*100 + i), 10)
+             for i in range(players - 2)]
+    for player in users:
+        game.discord_players[player.user] = player
+    bots = [BotPlayer('bot{}'.format(i)) for i in range(2)]
+    game.bots.update((bot.name, bot) for bot in bots)
+    all_players: List[CommonPlayer] = [*users, *bots]
+    game.add_players(all_players)
+    for seated in all_players:
+        seated.new_round()
+    game.state = GameState.RUNNING
+
+    for player in users:
+        target = rng.choice([p for p in game.players if p is not player])
+        if game.proposal_index.get(player, target) is None:
+            player.add_proposal_to(target, rng.randint(0, 2))
+    users[0].add_botswap(BotSwap(bots[0], bots[1], users[0], 1))
+    return game
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark saving and loading games.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    games = [_benchmark_game(i+1, args.players, rng)
+             for i in range(args.games)]
+    channels = {game.channel.id: _BenchmarkChannel(game.channel.id)
+                for game in games}
+
+    async def get_user(user_id: int) -> _BenchmarkUser:
+        return _BenchmarkUser(user_id)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = GameStore(directory)
+        start = time.perf_counter()
+        store.save_all(games)
+        dumped = time.perf_counter() - start
+        store.wait()
+        saved = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, filename))
+                   for filename in os.listdir(directory))
+
+        start = time.perf_counter()
+        loaded = asyncio.run(store.load_all(channels.get, get_user))
+        restored = time.perf_counter() - start
+
+    snapshots = {game.channel.id: game.snapshot() for game in games}
+    assert len(loaded) == len(games)
+    assert all(game.snapshot() == snapshots[game.channel.id]
+               for game, _ in loaded)
+    print('{} games of {} players, {:.0f} bytes each'.format(
+        args.games, args.players, size / args.games))
+    print('Saved in {:.3f} s, {:.1f} us per game, of which {:.1f} us on '
+          'the event loop'.format(saved, saved / args.games * 1e6,
+                                  dumped / args.games * 1e6))
+    print('Restored in {:.3f} s, {:.1f} us per game'.format(
+        restored, restored / args.games * 1e6))
+
+
+if __name__ == '__main__':
+    main()
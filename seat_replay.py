@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+"""Defines replay, which rebuilds a game from its journal, e.g. to debug a
+game as it was at any point, or for analytics over many finished games.
+
+Events are applied to a ReplayGame, with the game's seed, so everything
+random happens the same as it did in the original game. Players are
+ReplayPlayers, with the id and name the user had when joining, and are never
+sent anything.
+
+Run as a script to replay a journal, or without one to benchmark journaling
+and replaying a generated game, e.g.
+    ./seat_replay.py --rounds 2000 --players 20"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import strings
+from discord_game import (CommonPlayer, BotPlayer, StrategicBotPlayer,
+                          BotSwap, Proposal, ProposalGame,
+                          DiscordGameException)
+from seat_journal import Event, Journal, Record, read_journal
+
+
+class ReplayPlayer(CommonPlayer):
+    def __init__(self,
+                 user_id: int,
+                 name: str,
+                 garnets: int = 0) -> None:
+        super().__init__(garnets)
+        self.user_id = user_id
+        self.name = name
+
+    def __str__(self) -> str:
+        return self.name
+
+    def search_keys(self) -> List[str]:
+        return [self.name.lower(), str(self.user_id)]
+
+    async def send(self, *args: Any, **kwargs: str) -> None:
+        pass
+
+
+class ReplayGame(ProposalGame):
+    """A game without discord, changed only through events, which it
+    records in its own journal if it has one."""
+    def __init__(self,
+                 options: Optional[Dict[str, Any]] = None,
+                 seed: Optional[int] = None) -> None:
+        self.options: Dict[str, Any] = dict(strings.DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        super().__init__(self.options, seed)
+        self.stopped = False
+        # streaks are only needed at the end of each round
+        self._streaks.deferred = True
+
+        self._handlers: Dict[Event, Callable[..., object]] = {
+            Event.OPTION: self._apply_option,
+            Event.JOIN: lambda values, tail: self.join(values[0],
+                                                       tail.decode()),
+            Event.LEAVE: lambda values, _tail: self.leave(
+                self.players[values[0]]),
+            Event.ADD_BOT: lambda values, tail: self.add_bot(tail.decode(),
+                                                             values[0]),
+            Event.REMOVE_BOT: lambda values, _tail: self.remove_bot(
+                self.players[values[0]]),
+            Event.START: lambda values, _tail: self.begin(),
+            Event.PROPOSE: self._apply_propose,
+            Event.ACCEPT: self._apply_accept,
+            Event.CANCEL: self._apply_cancel,
+            Event.BOTSWAP: self._apply_botswap,
+            Event.CANCEL_BOTSWAP: self._apply_cancel_botswap,
+            Event.DONATE: lambda values, _tail: self.players[
+                values[0]].give_garnets(self.players[values[1]], values[2]),
+            Event.SWAP: lambda values, _tail: self.undoable_swap(
+                self.players[values[0]], self.players[values[1]],
+                values[2]),
+            Event.UNDO: lambda values, _tail: self.undo(),
+            Event.BOT_PLAN: self._apply_bot_plan,
+            Event.NEW_ROUND: lambda values, _tail: self.end_round(),
+            Event.STOP: lambda values, _tail: self.stop(),
+        }
+
+    def join(self, user_id: int, name: str) -> ReplayPlayer:
+        player = ReplayPlayer(user_id, name, self.options['start_garnets'])
+        self.record(Event.JOIN, user_id, tail=name.encode())
+        self.add_player(player)
+        return player
+
+    def leave(self, player: CommonPlayer) -> None:
+        self.record(Event.LEAVE, self.players.index(player))
+        self.remove_player(player)
+
+    def add_bot(self, name: str, strategic: bool = False) -> BotPlayer:
+        bot = StrategicBotPlayer(name) if strategic else BotPlayer(name)
+        self.record(Event.ADD_BOT, strategic, tail=name.encode())
+        self.bots[name] = bot
+        self.add_player(bot)
+        return bot
+
+    def remove_bot(self, bot: CommonPlayer) -> None:
+        assert isinstance(bot, BotPlayer)
+        self.record(Event.REMOVE_BOT, self.players.index(bot))
+        self.bots.pop(bot.name)
+        self.remove_player(bot)
+
+    def end_round(self) -> bool:
+        """Resolve the bots and start the next round, returns whether the
+        game is over."""
+        self.record(Event.NEW_ROUND)
+        self.resolve_bots()
+        return self.next_round()
+
+    def stop(self) -> None:
+        self.record(Event.STOP)
+        self.stopped = True
+
+    def apply(self, event: Event, values: Tuple[Any, ...],
+              tail: bytes) -> None:
+        self._handlers[event](values, tail)
+
+    def _apply_option(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        length = values[0]
+        self.set_option(tail[:length].decode(), json.loads(tail[length:]))
+
+    def _proposal_of(self,
+                     values: Tuple[Any, ...]) -> Proposal[CommonPlayer]:
+        proposal = self.proposal_index.get(self.players[values[0]],
+                                           self.players[values[1]])
+        if proposal is None:
+            raise DiscordGameException(
+                'Found no proposal from {} to {}.'.format(
+                    self.players[values[0]], self.players[values[1]]))
+        return proposal
+
+    def _apply_propose(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        source, target, garnets = values
+        self.players[source].add_proposal_to(self.players[target], garnets)
+
+    def _apply_accept(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        self.players[values[1]].accept_proposal(self._proposal_of(values))
+
+    def _apply_cancel(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        self.players[values[0]].cancel_proposal(self._proposal_of(values))
+
+    def _bots(self, values: Tuple[Any, ...]) -> Tuple[BotPlayer, BotPlayer]:
+        source, target = self.players[values[0]], self.players[values[1]]
+        assert isinstance(source, BotPlayer)
+        assert isinstance(target, BotPlayer)
+        return source, target
+
+    def _apply_botswap(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        source, target = self._bots(values)
+        guarantor = self.players[values[2]]
+        guarantor.add_botswap(BotSwap(source, target, guarantor, values[3]))
+
+    def _apply_cancel_botswap(self, values: Tuple[Any, ...],
+                              tail: bytes) -> None:
+        source, target = self._bots(values)
+        guarantor = self.players[values[2]]
+        botswap = next(x for x in guarantor.botswaps
+                       if (x.source, x.target, x.guarantor, x.garnets)
+                       == (source, target, guarantor, values[3]))
+        guarantor.cancel_botswap(botswap)
+
+    def _apply_bot_plan(self, values: Tuple[Any, ...], tail: bytes) -> None:
+        bot = self.players[values[0]]
+        assert isinstance(bot, StrategicBotPlayer)
+        bot.accepted_numbers = set(tail)
+
+
+def replay_records(records: List[Record]) -> ReplayGame:
+    """The game at the end of records, which start with its creation."""
+    if not records or records[0][0] != Event.CREATE:
+        raise DiscordGameException('Journal does not start with a game.')
+    _, values, tail = records[0]
+    game = ReplayGame(json.loads(tail), values[0])
+    apply = game.apply
+    for event, values, tail in records[1:]:
+        apply(event, values, tail)
+    return game
+
+
+def replay(path: str) -> ReplayGame:
+    """The game at the end of the journal at path."""
+    return replay_records(list(read_journal(path)))
+
+
+def _play(game: ReplayGame, rounds: int, players: int,
+          rng: random.Random) -> None:
+    """Play a game with random moves, for benchmarking."""
+    for index in range(players - 2):
+        game.join(index, 'player{}'.format(index))
+    bots = [game.add_bot('bot{}'.format(index)) for index in range(2)]
+    # no streak is long enough to win, so every round is played
+    game.set_option('win_streak_length', game.player_count + 1)
+    game.begin()
+
+    for _ in range(rounds):
+        humans = [p for p in game.players if isinstance(p, ReplayPlayer)]
+        for player in humans:
+            target = rng.choice([p for p in game.players if p is not player])
+            if game.proposal_index.get(player, target) is None:
+                player.add_proposal_to(target,
+                                       rng.randint(0, min(player.garnets, 2)))
+        for player in humans:
+            for proposal in player.incoming_proposals:
+                if rng.random() < 0.2:
+                    player.cancel_proposal(proposal)
+                elif not (player.swapped or proposal.source.swapped
+                          or isinstance(proposal.source, BotPlayer)):
+                    player.accept_proposal(proposal)
+        guarantor = rng.choice(humans)
+        if guarantor.garnets > 0:
+            guarantor.add_botswap(BotSwap(bots[0], bots[1], guarantor, 1))
+        donater = rng.choice(humans)
+        if donater.garnets > 0:
+            donater.give_garnets(rng.choice(humans), 1)
+        game.end_round()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Replay a game journal, or benchmark replaying.')
+    parser.add_argument('journal', nargs='?')
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.journal is not None:
+        game = replay(args.journal)
+        print('Round {}, {} players'.format(game.current_round,
+                                            game.player_count))
+        for player in game.table_layout:
+            print('{:>4} {:>4} {:>6}  {}'.format(
+                player.seat, player.number, player.garnets, player))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.journal')
+        game = ReplayGame({}, args.seed)
+        journal = Journal(path)
+        game.attach_journal(journal)
+        start = time.perf_counter()
+        _play(game, args.rounds, args.players, random.Random(args.seed))
+        played = time.perf_counter() - start
+        game.close_journal()
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        records = list(read_journal(path))
+        read = time.perf_counter() - start
+        start = time.perf_counter()
+        replayed = replay_records(records)
+        applied = time.perf_counter() - start
+
+    assert replayed.snapshot() == game.snapshot()
+    assert ([(p.source.name, p.target.name, p.garnets)  # type: ignore
+             for p in replayed.proposal_index]
+            == [(p.source.name, p.target.name, p.garnets)  # type: ignore
+                for p in game.proposal_index])
+    print('{} events in {} rounds, {:.1f} bytes each'.format(
+        len(records), args.rounds, size / len(records)))
+    print('Played and journaled in {:.3f} s'.format(played))
+    print('Read in {:.3f} s, replayed in {:.3f} s, {:.0f} events/s'.format(
+        read, applied, len(records) / (read + applied)))
+
+
+if __name__ == '__main__':
+    main()
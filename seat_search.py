@@ -0,0 +1,149 @@
+"""Defines search, which looks for the fewest swaps that give a winning
+streak including a given number. Used by StrategicBotPlayer.
+
+Iterative deepening over swaps of any two seats, with a transposition
+table keyed on the seating rotated and reflected so that the searching
+number is first, since streaks don't care where around the table they are.
+Is a plain function of ints so it can run in another process."""
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass, field
+
+from seat_streak import StreakTracker
+
+DEFAULT_MAX_DEPTH = 4
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@dataclass
+class SearchResult:
+    """distance is the number of swaps needed, -1 if no winning streak was
+    found within depth swaps. first_swap is the seats of the first swap of
+    the plan, acceptable the numbers that can be swapped with without
+    shortening the streak of the searching number."""
+    distance: int = -1
+    first_swap: Optional[Tuple[int, int]] = None
+    acceptable: List[int] = field(default_factory=list)
+    depth: int = 0
+
+
+class _Search:
+    def __init__(self,
+                 seat_numbers: Sequence[int],
+                 current_x: Sequence[int],
+                 win_length: int,
+                 number: int,
+                 deadline: float) -> None:
+        self.tracker = StreakTracker(seat_numbers, current_x)
+        self.win_length = win_length
+        self.number = number
+        self.deadline = deadline
+        self.size = len(seat_numbers)
+        # canonical seating -> largest remaining depth known not to win
+        self.table: Dict[Tuple[int, ...], int] = {}
+        self.moves = [(first, second)
+                      for first in range(self.size)
+                      for second in range(first+1, self.size)]
+
+    def canonical(self) -> Tuple[int, ...]:
+        numbers = self.tracker.seat_numbers
+        seat = self.tracker.number_seats[self.number]
+        forward = tuple(numbers[seat:] + numbers[:seat])
+        backward = (forward[0],) + forward[:0:-1]
+        return min(forward, backward)
+
+    def streak_length(self) -> int:
+        """Length of the longest streak through the searching number."""
+        return self.tracker.streak_through(
+            self.tracker.number_seats[self.number])
+
+    def winning(self) -> bool:
+        tracker = self.tracker
+        longest = tracker.longest
+        if longest != self.win_length:
+            return False
+        if tracker.instances(longest) != 1 and self.size != longest:
+            return False
+        return self.streak_length() == longest
+
+    def dfs(self, remaining: int, path: List[Tuple[int, int]]) -> bool:
+        if self.winning():
+            return True
+        if remaining == 0:
+            return False
+        if time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+        key = self.canonical()
+        if self.table.get(key, -1) >= remaining:
+            return False
+
+        for move in self.moves:
+            self.tracker.swap(*move)
+            path.append(move)
+            found = self.dfs(remaining-1, path)
+            self.tracker.swap(*move)
+            if found:
+                return True
+            path.pop()
+
+        self.table[key] = remaining
+        return False
+
+    def order_moves(self) -> List[int]:
+        """Sort moves by the resulting streak through the searching number,
+        returns the acceptable numbers for swaps involving it."""
+        current = self.streak_length()
+        seat = self.tracker.number_seats[self.number]
+        scores: Dict[Tuple[int, int], int] = {}
+        acceptable = []
+        for move in self.moves:
+            self.tracker.swap(*move)
+            scores[move] = self.streak_length()
+            self.tracker.swap(*move)
+            if seat in move and scores[move] >= current:
+                other = move[0] if move[1] == seat else move[1]
+                acceptable.append(self.tracker.seat_numbers[other])
+        self.moves.sort(key=lambda move: scores[move], reverse=True)
+        return acceptable
+
+
+def search(seat_numbers: Sequence[int],
+           current_x: Sequence[int],
+           win_length: int,
+           seat: int,
+           time_budget: float,
+           max_depth: int = DEFAULT_MAX_DEPTH) -> SearchResult:
+    """Search for the fewest swaps giving a winning streak including the
+    number in seat, giving up after time_budget seconds and returning the
+    result of the deepest completed search."""
+    deadline = time.monotonic() + time_budget
+    number = seat_numbers[seat]
+    state = _Search(seat_numbers, current_x, win_length, number, deadline)
+    result = SearchResult(acceptable=state.order_moves())
+
+    if state.winning():
+        result.distance = 0
+        return result
+
+    path: List[Tuple[int, int]] = []
+    try:
+        for depth in range(1, max_depth+1):
+            path.clear()
+            result.depth = depth
+            if state.dfs(depth, path):
+                result.distance = len(path)
+                result.first_swap = path[0]
+                if number in (seat_numbers[path[0][0]],
+                              seat_numbers[path[0][1]]):
+                    other = path[0][0] + path[0][1] - seat
+                    result.acceptable.append(seat_numbers[other])
+                break
+    except SearchTimeout:
+        result.depth -= 1
+    return result
@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+"""Defines simulate, which plays many headless games with simulated players
+to see how options affect rounds to finish, win rates and garnets.
+
+Games are played with SeatGame and the proposal and botswap rules of
+DiscordGame, and are spread over a process pool. Every game is seeded from
+the simulation seed and its own index, so the results are the same
+regardless of the number of workers.
+
+Run as a script to compare player counts, e.g.
+    ./seat_simulation.py --players 6 12 --games 10000 --policy greedy"""
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import typing
+from typing import Any, Dict, List, Optional, Sequence
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import strings
+from discord_game import (CommonPlayer, BotPlayer, BotSwap, Proposal,
+                          ProposalGame)
+
+DEFAULT_MAX_ROUNDS = 100
+CHUNK_SIZE = 500
+
+
+class Policy:
+    """Decides what a simulated player does each round. The default policy
+    never does anything."""
+    name = 'passive'
+
+    def propose(self, game: SimulatedGame, player: SimulatedPlayer,
+                rng: random.Random) -> None:
+        pass
+
+    def accepts(self, game: SimulatedGame, player: SimulatedPlayer,
+                proposal: Proposal[CommonPlayer],
+                rng: random.Random) -> bool:
+        # pylint: disable=unused-argument,no-self-use
+        return False
+
+
+class RandomPolicy(Policy):
+    """Proposes to a random player, sometimes with a few garnets, sponsors
+    the occasional botswap, and accepts half of the proposals it gets."""
+    name = 'random'
+
+    def propose(self, game: SimulatedGame, player: SimulatedPlayer,
+                rng: random.Random) -> None:
+        others = [p for p in game.players if p is not player]
+        if rng.random() < 0.5:
+            target = rng.choice(others)
+            player.add_proposal_to(
+                target, rng.randint(0, min(player.garnets, 3)))
+
+        bots = list(game.bots.values())
+        if len(bots) >= 2 and rng.random() < 0.2:
+            source, target = rng.sample(bots, 2)
+            botswap = BotSwap(source, target, player,
+                              rng.randint(0, min(player.garnets, 3)))
+            player.add_botswap(botswap)
+
+    def accepts(self, game: SimulatedGame, player: SimulatedPlayer,
+                proposal: Proposal[CommonPlayer],
+                rng: random.Random) -> bool:
+        return rng.random() < 0.5
+
+
+class GreedyPolicy(Policy):
+    """Sees the whole table. Proposes the swap giving the longest streak
+    including itself, offering a garnet to bots, and accepts proposals that
+    don't shorten its streak."""
+    name = 'greedy'
+
+    def propose(self, game: SimulatedGame, player: SimulatedPlayer,
+                rng: random.Random) -> None:
+        current = game.streak_through(player.seat)
+        candidates = [p for p in game.players
+                      if p is not player and not p.swapped]
+        rng.shuffle(candidates)
+        best: Optional[CommonPlayer] = None
+        for other in candidates:
+            length = game.streak_after_swap(player.seat, other.seat)
+            if length > current:
+                current = length
+                best = other
+
+        if best is not None:
+            garnets = 1 if isinstance(best, BotPlayer) else 0
+            player.add_proposal_to(best, min(garnets, player.garnets))
+
+    def accepts(self, game: SimulatedGame, player: SimulatedPlayer,
+                proposal: Proposal[CommonPlayer],
+                rng: random.Random) -> bool:
+        return (game.streak_after_swap(player.seat, proposal.source.seat)
+                >= game.streak_through(player.seat))
+
+
+POLICIES: Dict[str, typing.Type[Policy]] = {
+    policy.name: policy for policy in (Policy, RandomPolicy, GreedyPolicy)}
+
+
+class SimulatedPlayer(CommonPlayer):
+    def __init__(self,
+                 name: str,
+                 policy: Policy,
+                 garnets: int = 0) -> None:
+        super().__init__(garnets)
+        self.name = name
+        self.policy = policy
+
+    def __str__(self) -> str:
+        return self.name
+
+    def search_keys(self) -> List[str]:
+        return [self.name.lower()]
+
+    async def send(self, *args: Any, **kwargs: str) -> None:
+        pass
+
+
+class SimulatedGame(ProposalGame):
+    """A game without discord, where each round every simulated player
+    proposes, then answers its incoming proposals, and then bots resolve
+    their proposals and botswaps like in DiscordGame."""
+    def __init__(self,
+                 options: Optional[Dict[str, Any]] = None,
+                 seed: Optional[int] = None) -> None:
+        self.options: Dict[str, Any] = dict(strings.DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        super().__init__(self.options, seed)
+
+    @property
+    def simulated_players(self) -> List[SimulatedPlayer]:
+        return [p for p in self.players if isinstance(p, SimulatedPlayer)]
+
+    def streak_through(self, seat: int) -> int:
+        return self._streaks.streak_through(int(seat))
+
+    def streak_after_swap(self, seat: int, other: int) -> int:
+        """Length of the longest streak including the number in seat, if it
+        was swapped with other."""
+        seat, other = int(seat), int(other)
+        self._streaks.swap(seat, other)
+        res = self._streaks.streak_through(other)
+        self._streaks.swap(seat, other)
+        return res
+
+    def start(self, policies: Sequence[Policy], bot_count: int) -> None:
+        players: List[CommonPlayer] = [
+            SimulatedPlayer('player{}'.format(index), policy,
+                            self.options['start_garnets'])
+            for index, policy in enumerate(policies)]
+        for index in range(bot_count):
+            bot = BotPlayer('bot{}'.format(index))
+            self.bots[bot.name] = bot
+            players.append(bot)
+
+        self.add_players(players)
+        for player in self.players:
+            player.new_round()
+
+    def play_round(self, rng: random.Random) -> bool:
+        """Play one round, returns whether the game is over."""
+        players = self.simulated_players
+        rng.shuffle(players)
+        for player in players:
+            player.policy.propose(self, player, rng)
+
+        rng.shuffle(players)
+        for player in players:
+            for proposal in player.incoming_proposals:
+                if player.swapped:
+                    break
+                if (not proposal.source.swapped
+                        and player.policy.accepts(self, player, proposal,
+                                                  rng)):
+                    player.accept_proposal(proposal)
+
+        self.resolve_bots()
+        return self.next_round()
+
+
+@dataclass
+class SimulationConfig:
+    """One kind of game to simulate. policies has one entry per simulated
+    player, bot_count plain bots are added on top."""
+    policies: Sequence[Policy]
+    bot_count: int = 0
+    options: Dict[str, Any] = field(default_factory=dict)
+    max_rounds: int = DEFAULT_MAX_ROUNDS
+
+    @property
+    def player_count(self) -> int:
+        return len(self.policies) + self.bot_count
+
+
+def _policy_name(player: CommonPlayer) -> str:
+    if isinstance(player, SimulatedPlayer):
+        return player.policy.name
+    return 'bot'
+
+
+@dataclass
+class SimulationStats:
+    """Totals over many games, which can be merged. rounds only counts
+    finished games, and garnets are final garnets by policy."""
+    games: int = 0
+    finished: int = 0
+    rounds: typing.Counter[int] = field(default_factory=Counter)
+    players: typing.Counter[str] = field(default_factory=Counter)
+    wins: typing.Counter[str] = field(default_factory=Counter)
+    garnets: Dict[str, typing.Counter[int]] = field(default_factory=dict)
+
+    def add_game(self, game: SimulatedGame, finished: bool) -> None:
+        self.games += 1
+        winners = set(id(p) for p in game.winners) if finished else set()
+        if finished:
+            self.finished += 1
+            self.rounds[game.current_round] += 1
+
+        for player in game.players:
+            name = _policy_name(player)
+            self.players[name] += 1
+            if id(player) in winners:
+                self.wins[name] += 1
+            self.garnets.setdefault(name, Counter())[player.garnets] += 1
+
+    def merge(self, other: SimulationStats) -> None:
+        self.games += other.games
+        self.finished += other.finished
+        self.rounds.update(other.rounds)
+        self.players.update(other.players)
+        self.wins.update(other.wins)
+        for name, garnets in other.garnets.items():
+            self.garnets.setdefault(name, Counter()).update(garnets)
+
+    def summary(self) -> str:
+        lines = ['{} games, {:.1%} finished'.format(
+            self.games, self.finished / max(self.games, 1))]
+        if self.rounds:
+            rounds = sorted(self.rounds.elements())
+            lines.append(
+                'Rounds to finish: mean {:.2f}, median {}, '
+                '90th percentile {}'.format(
+                    statistics.mean(rounds),
+                    _percentile(rounds, 0.5), _percentile(rounds, 0.9)))
+        for name in sorted(self.players):
+            garnets = sorted(self.garnets[name].elements())
+            lines.append(
+                '{}: win rate {:.1%}, garnets mean {:.2f}, '
+                '10/50/90th percentile {}/{}/{}'.format(
+                    name, self.wins[name] / self.players[name],
+                    statistics.mean(garnets),
+                    _percentile(garnets, 0.1), _percentile(garnets, 0.5),
+                    _percentile(garnets, 0.9)))
+        return '\n'.join(lines)
+
+
+def _percentile(values: Sequence[int], fraction: float) -> int:
+    return values[min(int(fraction * len(values)), len(values)-1)]
+
+
+def play_game(config: SimulationConfig,
+              seed: str) -> typing.Tuple[SimulatedGame, bool]:
+    """Play one game, returns the game and whether it finished."""
+    # The game and its bots have their own generator, policies another.
+    rng = random.Random(seed + ':policies')
+
+    game = SimulatedGame(config.options, random.Random(seed).getrandbits(63))
+    game.start(config.policies, config.bot_count)
+    while game.current_round <= config.max_rounds:
+        if game.play_round(rng):
+            return game, True
+    return game, False
+
+
+def _simulate_chunk(config: SimulationConfig, seed: int,
+                    start: int, stop: int) -> SimulationStats:
+    stats = SimulationStats()
+    for index in range(start, stop):
+        stats.add_game(*play_game(config, '{}:{}'.format(seed, index)))
+    return stats
+
+
+def simulate(config: SimulationConfig,
+             games: int,
+             seed: int = 0,
+             workers: Optional[int] = None) -> SimulationStats:
+    """Play games games of config in a process pool with workers processes,
+    all cores by default."""
+    starts = range(0, games, CHUNK_SIZE)
+    stops = [min(start + CHUNK_SIZE, games) for start in starts]
+
+    stats = SimulationStats()
+    with ProcessPoolExecutor(workers) as pool:
+        for chunk in pool.map(_simulate_chunk,
+                              [config]*len(starts), [seed]*len(starts),
+                              starts, stops):
+            stats.merge(chunk)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Simulate seat exchange games for a range of player '
+                    'counts.')
+    parser.add_argument('--players', type=int, nargs=2, default=(5, 12),
+                        metavar=('MIN', 'MAX'))
+    parser.add_argument('--bots', type=int, default=0,
+                        help='Number of bots in each game.')
+    parser.add_argument('--policy', choices=sorted(POLICIES),
+                        nargs='+', default=['greedy'],
+                        help='Policies given to players in turn.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-rounds', type=int, default=DEFAULT_MAX_ROUNDS)
+    parser.add_argument('--option', nargs=2, action='append', default=[],
+                        metavar=('NAME', 'VALUE'),
+                        help='Game option as an integer, e.g. '
+                             '--option win_garnets 15')
+    args = parser.parse_args()
+
+    options = {name: int(value) for name, value in args.option}
+    for player_count in range(args.players[0], args.players[1]+1):
+        policies = [POLICIES[args.policy[i % len(args.policy)]]()
+                    for i in range(player_count - args.bots)]
+        config = SimulationConfig(policies, args.bots, options,
+                                  args.max_rounds)
+        stats = simulate(config, args.games, args.seed, args.workers)
+        print('**{} players**'.format(player_count))
+        print(stats.summary())
+
+
+if __name__ == '__main__':
+    main()
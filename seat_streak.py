@@ -0,0 +1,390 @@
+"""Defines StreakTracker, which keeps the longest streak of a seating up to
+date as seats are swapped and X changes.
+
+Seats are in a circle, edge e is between seat e and seat e+1 (mod n).
+For each direction we keep a sorted list of *breaks*, the edges where the
+numbers in the two seats are not adjacent when walking in that direction.
+The seats between two consecutive breaks form one streak, so a swap or a
+new X only needs to recheck the edges around the seats involved, and only
+the streaks ending at those breaks are recounted.
+
+Everything is plain ints internally, Seat is only created for the result.
+A number of -1 is unknown, it's never adjacent to anything."""
+from __future__ import annotations
+
+import bisect
+import heapq
+import typing
+from typing import Dict, List, Set, Tuple, Iterable, Sequence
+from dataclasses import dataclass
+
+from seat_typing import Seat
+
+DIRECTIONS = (1, -1)
+
+
+def next_number(number: int, size: int,
+                current_x: typing.Container[int]) -> int:
+    """The number following number when skipping X, -1 if there is none."""
+    for i in range(1, size):
+        res = (number + i) % size
+        if res not in current_x:
+            return res
+    return -1
+
+
+def next_numbers(size: int, current_x: typing.Container[int]) -> List[int]:
+    """next_number for every number, -1 for X's."""
+    return [-1 if number in current_x
+            else next_number(number, size, current_x)
+            for number in range(size)]
+
+
+@dataclass
+class StreakResult:
+    longest_streak: int
+    instances: int
+    starting_seat: Seat
+    direction: int
+
+    def __lt__(self, other: typing.Any) -> bool:
+        if isinstance(other, StreakResult):
+            return self.longest_streak < other.longest_streak
+        if isinstance(other, int):
+            return self.longest_streak < other
+        return NotImplemented
+
+    def __le__(self, other: typing.Any) -> bool:
+        if isinstance(other, StreakResult):
+            return self.longest_streak <= other.longest_streak
+        if isinstance(other, int):
+            return self.longest_streak <= other
+        return NotImplemented
+
+    def __eq__(self, other: typing.Any) -> bool:
+        if isinstance(other, StreakResult):
+            return self.longest_streak == other.longest_streak
+        if isinstance(other, int):
+            return self.longest_streak == other
+        return NotImplemented
+
+
+class StreakTracker:
+    """Incrementally tracks streaks of a seat-to-number permutation.
+
+    Gives the same result as checking the streak from every seat in both
+    directions, where the streak is capped at the number of seats.
+
+    While deferred, e.g. when replaying a game, swaps and new X only change
+    the seating, and streaks are recounted once when next asked for."""
+
+    def __init__(self,
+                 seat_numbers: Sequence[int] = (),
+                 current_x: Iterable[int] = ()) -> None:
+        self.seat_numbers: List[int] = []
+        self.number_seats: List[int] = []
+        self._x: Set[int] = set()
+        self._breaks: Dict[int, List[int]] = {}
+        self._rings: Set[int] = set()
+
+        # (direction, break) of the streak ending at that break,
+        # grouped by length.
+        self._streaks: Dict[int, Set[Tuple[int, int]]] = {}
+        self._lengths: Dict[Tuple[int, int], int] = {}
+        self._heap: List[int] = []
+
+        self.deferred = False
+        self._stale = False
+
+        self.reset(seat_numbers, current_x)
+
+    @property
+    def size(self) -> int:
+        return len(self.seat_numbers)
+
+    def reset(self,
+              seat_numbers: Sequence[int],
+              current_x: Iterable[int]) -> None:
+        size = len(seat_numbers)
+        self._stale = False
+        self.seat_numbers = list(seat_numbers)
+        self.number_seats = [0] * size
+        for seat, number in enumerate(self.seat_numbers):
+            if number >= 0:
+                self.number_seats[number] = seat
+        self._x = set(current_x)
+
+        self._rings.clear()
+        self._streaks.clear()
+        self._lengths.clear()
+        self._heap.clear()
+
+        # the same as _linked for every edge, without walking past X for
+        # each of them
+        following = next_numbers(size, self._x)
+        numbers = self.seat_numbers
+        for direction in DIRECTIONS:
+            breaks: List[int] = []
+            for edge in range(size):
+                first, second = numbers[edge], numbers[(edge+1) % size]
+                if direction == -1:
+                    first, second = second, first
+                if first < 0 or second < 0 or following[first] != second:
+                    breaks.append(edge)
+            self._breaks[direction] = breaks
+            if not breaks:
+                if size:
+                    self._rings.add(direction)
+                continue
+            # as _count, but everything starts out empty
+            for index, end in enumerate(breaks):
+                length = self._streak_length(breaks[index-1], end)
+                if length:
+                    self._lengths[direction, end] = length
+                    self._streaks.setdefault(length, set()).add(
+                        (direction, end))
+
+        self._heap += [-length for length in self._streaks]
+        if self._rings:
+            self._heap.append(-size)
+        heapq.heapify(self._heap)
+
+    def _refresh(self) -> None:
+        if self._stale:
+            self.reset(self.seat_numbers, self._x)
+
+    def is_x(self, number: int) -> bool:
+        return number in self._x
+
+    def next_number(self, number: int) -> int:
+        return next_number(number, self.size, self._x)
+
+    def _previous_number(self, number: int) -> int:
+        size = self.size
+        for i in range(1, size):
+            res = (number - i) % size
+            if res not in self._x:
+                return res
+        return -1
+
+    def adjacent(self, first: int, second: int) -> bool:
+        """Same as SeatGame._adjacent_numbers with delta 1."""
+        if min(first, second) < 0 or first in self._x or second in self._x:
+            return False
+        return self.next_number(first) == second
+
+    def _linked(self, edge: int, direction: int) -> bool:
+        size = self.size
+        first = self.seat_numbers[edge]
+        second = self.seat_numbers[(edge+1) % size]
+        if direction == -1:
+            first, second = second, first
+        return self.adjacent(first, second)
+
+    def _streak_length(self, previous: int, end: int) -> int:
+        """Length of the streak between two breaks, 0 if it's only an X."""
+        length = (end - previous - 1) % self.size + 1
+        if length == 1 and self.seat_numbers[end] in self._x:
+            return 0
+        return length
+
+    def _count(self, direction: int, previous: int, end: int) -> None:
+        key = (direction, end)
+        self._uncount(key)
+        length = self._streak_length(previous, end)
+        if not length:
+            return
+        self._lengths[key] = length
+        if length not in self._streaks:
+            self._streaks[length] = set()
+        if not self._streaks[length]:
+            heapq.heappush(self._heap, -length)
+        self._streaks[length].add(key)
+
+    def _uncount(self, key: Tuple[int, int]) -> None:
+        length = self._lengths.pop(key, 0)
+        if length:
+            self._streaks[length].discard(key)
+
+    def _neighbour_breaks(self, direction: int,
+                          index: int) -> Tuple[int, int]:
+        breaks = self._breaks[direction]
+        return breaks[index-1], breaks[(index+1) % len(breaks)]
+
+    def _add_break(self, direction: int, edge: int) -> None:
+        breaks = self._breaks[direction]
+        if not breaks:
+            self._rings.discard(direction)
+            breaks.append(edge)
+            self._count(direction, edge, edge)
+            return
+
+        index = bisect.bisect_left(breaks, edge)
+        breaks.insert(index, edge)
+        previous, following = self._neighbour_breaks(direction, index)
+        self._count(direction, previous, edge)
+        self._count(direction, edge, following)
+
+    def _remove_break(self, direction: int, edge: int) -> None:
+        breaks = self._breaks[direction]
+        index = bisect.bisect_left(breaks, edge)
+        self._uncount((direction, edge))
+        if len(breaks) == 1:
+            breaks.clear()
+            self._rings.add(direction)
+            heapq.heappush(self._heap, -self.size)
+            return
+
+        previous, following = self._neighbour_breaks(direction, index)
+        del breaks[index]
+        self._count(direction, previous, following)
+
+    def _is_break(self, direction: int, edge: int) -> bool:
+        breaks = self._breaks[direction]
+        index = bisect.bisect_left(breaks, edge)
+        return index < len(breaks) and breaks[index] == edge
+
+    def linked(self, edge: int, direction: int) -> bool:
+        """Whether the numbers on both sides of edge are adjacent."""
+        self._refresh()
+        return not self._is_break(direction, edge)
+
+    def streak_through(self, seat: int) -> int:
+        """Length of the longest streak including seat, 0 if it's X."""
+        size = self.size
+        if self.seat_numbers[seat] in self._x:
+            return 0
+        res = 1
+        for direction in DIRECTIONS:
+            length = 1
+            edge = seat
+            while length < size and self.linked(edge, direction):
+                length += 1
+                edge = (edge+1) % size
+            edge = (seat-1) % size
+            while length < size and self.linked(edge, direction):
+                length += 1
+                edge = (edge-1) % size
+            res = max(res, length)
+        return res
+
+    def link_count(self, direction: int) -> int:
+        self._refresh()
+        return self.size - len(self._breaks[direction])
+
+    def _update(self, edges: Iterable[int], seats: Iterable[int]) -> None:
+        """Recheck edges, and recount single seat streaks in seats."""
+        edge_set = set(edges)
+        seat_set = set(seats)
+        for direction in DIRECTIONS:
+            for edge in edge_set:
+                linked = self._linked(edge, direction)
+                if linked == self._is_break(direction, edge):
+                    if linked:
+                        self._remove_break(direction, edge)
+                    else:
+                        self._add_break(direction, edge)
+
+            breaks = self._breaks[direction]
+            for seat in seat_set:
+                index = bisect.bisect_left(breaks, seat)
+                if index < len(breaks) and breaks[index] == seat:
+                    self._count(direction, breaks[index-1], seat)
+
+    def _edges_around(self, seat: int) -> Tuple[int, int]:
+        return (seat-1) % self.size, seat
+
+    def swap(self, first: int, second: int) -> None:
+        numbers = self.seat_numbers
+        numbers[first], numbers[second] = numbers[second], numbers[first]
+        for seat in first, second:
+            if numbers[seat] >= 0:
+                self.number_seats[numbers[seat]] = seat
+
+        if self.deferred or self._stale:
+            self._stale = True
+            return
+        self._update(self._edges_around(first) + self._edges_around(second),
+                     (first, second))
+
+    def swap_outcomes(self) -> Dict[Tuple[int, int], Tuple[int, int]]:
+        """Longest streak and its number of instances after swapping each
+        pair of seats, found by swapping and swapping back."""
+        res: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for first in range(self.size):
+            for second in range(first+1, self.size):
+                self.swap(first, second)
+                longest = self.longest
+                res[first, second] = (longest, self.instances(longest))
+                self.swap(first, second)
+        return res
+
+    def set_x(self, current_x: Iterable[int]) -> None:
+        """Change X, only rechecking seats next to the numbers that changed
+        and the numbers before them."""
+        new_x = set(current_x)
+        if self.deferred or self._stale:
+            self._x = new_x
+            self._stale = True
+            return
+        changed = self._x ^ new_x
+        if not changed:
+            return
+
+        numbers = set(changed)
+        numbers.update(self._previous_number(x) for x in changed)
+        self._x = new_x
+        numbers.update(self._previous_number(x) for x in changed)
+        numbers.discard(-1)
+
+        edges: List[int] = []
+        for number in numbers:
+            edges += self._edges_around(self.number_seats[number])
+        self._update(edges, (self.number_seats[x] for x in changed))
+
+    def instances(self, length: int) -> int:
+        self._refresh()
+        res = len(self._streaks.get(length, ()))
+        if length == self.size:
+            res += length * len(self._rings)
+        return res
+
+    @property
+    def longest(self) -> int:
+        self._refresh()
+        while self._heap and not self.instances(-self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return 0
+        return -self._heap[0]
+
+    def _first_start(self, longest: int) -> Tuple[int, int]:
+        """First seat and direction where a longest streak starts, checking
+        increasing seats in direction 1 before decreasing in direction -1.
+        """
+        size = self.size
+        for direction in DIRECTIONS:
+            if direction in self._rings and longest == size:
+                return (0, 1) if direction == 1 else (size-1, -1)
+
+            ends = [end for key_direction, end
+                    in self._streaks.get(longest, ())
+                    if key_direction == direction]
+            if not ends:
+                continue
+            if direction == -1:
+                return max(ends), direction
+
+            breaks = self._breaks[direction]
+            starts = [(breaks[bisect.bisect_left(breaks, end)-1] + 1) % size
+                      for end in ends]
+            return min(starts), direction
+        raise AssertionError('No streak of length {}'.format(longest))
+
+    def result(self) -> StreakResult:
+        longest = self.longest
+        if not longest:
+            return StreakResult(0, 0, Seat(0), 0)
+        seat, direction = self._first_start(longest)
+        return StreakResult(longest, self.instances(longest),
+                            Seat(seat), direction)
@@ -0,0 +1,133 @@
+"""Defines Scheduler, which runs every timer of the bot, e.g. round deadlines
+and start countdowns, from a single task.
+
+Timers are kept in a heap by deadline, and the task sleeps until the first
+one is due or an earlier one is added. Cancelling, rescheduling or pausing a
+timer leaves its old entry in the heap, which is skipped when it comes up,
+so every operation is O(log n) in the number of timers."""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import typing
+from typing import Any, Callable, Coroutine, List, Optional, Tuple
+
+Callback = Callable[[], Coroutine[Any, Any, None]]
+
+
+class Timer:
+    """A callback run by a Scheduler at a deadline in event loop time. A
+    paused timer has no deadline, but keeps the time it had remaining."""
+    def __init__(self, scheduler: Scheduler, callback: Callback) -> None:
+        self.scheduler = scheduler
+        self.callback = callback
+        self.deadline: Optional[float] = None
+        self.paused_remaining: Optional[float] = None
+        # bumped on every change, so entries in the heap from before are
+        # recognised as stale
+        self.version = 0
+
+    @property
+    def active(self) -> bool:
+        return self.deadline is not None
+
+    @property
+    def paused(self) -> bool:
+        return self.paused_remaining is not None
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the timer fires, or None if it's cancelled or
+        has fired."""
+        if self.deadline is not None:
+            return max(self.deadline - self.scheduler.time(), 0.0)
+        return self.paused_remaining
+
+    def cancel(self) -> None:
+        self.version += 1
+        self.deadline = None
+        self.paused_remaining = None
+
+    def reschedule(self, delay: float) -> None:
+        self.scheduler.push(self, self.scheduler.time() + delay)
+
+    def pause(self) -> None:
+        remaining = self.remaining
+        if self.deadline is None or remaining is None:
+            return
+        self.cancel()
+        self.paused_remaining = remaining
+
+    def resume(self) -> None:
+        if self.paused_remaining is not None:
+            self.reschedule(self.paused_remaining)
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, int, Timer]] = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task[None]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # callbacks running, kept so they aren't garbage collected
+        self._running: typing.Set[asyncio.Task[None]] = set()
+
+    @staticmethod
+    def time() -> float:
+        return asyncio.get_running_loop().time()
+
+    def __len__(self) -> int:
+        """Number of timers waiting, including stale entries not yet
+        skipped."""
+        return len(self._heap)
+
+    def schedule(self, delay: float, callback: Callback) -> Timer:
+        """Run callback in delay seconds."""
+        timer = Timer(self, callback)
+        timer.reschedule(delay)
+        return timer
+
+    def push(self, timer: Timer, deadline: float) -> None:
+        timer.cancel()
+        timer.deadline = deadline
+        heapq.heappush(self._heap,
+                       (deadline, next(self._counter), timer.version, timer))
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        elif self._heap[0][3] is timer and self._wakeup is not None:
+            self._wakeup.set()
+
+    @staticmethod
+    def _is_stale(entry: Tuple[float, int, int, Timer]) -> bool:
+        return entry[2] != entry[3].version
+
+    async def _run(self) -> None:
+        self._wakeup = asyncio.Event()
+        while True:
+            while self._heap and self._is_stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._task = None
+                return
+
+            delay = self._heap[0][0] - self.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            timer = heapq.heappop(self._heap)[3]
+            timer.cancel()
+            task = asyncio.create_task(timer.callback())
+            self._running.add(task)
+            task.add_done_callback(self._finish_callback)
+
+    def _finish_callback(self, task: asyncio.Task[None]) -> None:
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print('timer failed: {!r}'.format(task.exception()))
@@ -66,6 +66,171 @@ class Seat(int):
             yield cls(i)
 
 
+MESSAGE_LIMIT = 2000
+COALESCE_WINDOW = 0.1
+MAX_FLUSH_ATTEMPTS = 3
+
+# Tasks of sends not waited for, kept so they aren't garbage collected
+# before they're done.
+_pending_sends: typing.Set[asyncio.Task[typing.Any]] = set()
+
+
+def _finish_send(task: asyncio.Task[typing.Any]) -> None:
+    _pending_sends.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print('failed to send: {}'.format(task.exception()))
+
+
+def merge_messages(contents: typing.Sequence[str],
+                   limit: int = MESSAGE_LIMIT
+                   ) -> typing.List[typing.Tuple[int, str]]:
+    """Pack contents in order, joined by newlines, into as few messages of at
+    most limit characters as possible, splitting contents too long for one
+    message at a newline if there is one. Each message is paired with the
+    index of the content it starts in."""
+    res: typing.List[typing.Tuple[int, str]] = []
+    current, start = '', 0
+    for index, content in enumerate(contents):
+        if current and len(current) + 1 + len(content) <= limit:
+            current += '\n' + content
+            continue
+        if current:
+            res.append((start, current))
+        while len(content) > limit:
+            cut = content.rfind('\n', 0, limit+1)
+            if cut <= 0:
+                res.append((index, content[:limit]))
+                content = content[limit:]
+            else:
+                res.append((index, content[:cut]))
+                content = content[cut+1:]
+        current, start = content, index
+    if current:
+        res.append((start, current))
+    return res
+
+
+class Outbox:
+    """Messages waiting to be sent to a channel. Messages sent within window
+    seconds of each other are merged into as few messages as fit under the
+    length limit, and sent in order.
+
+    If sending queued messages fails they're tried again with the next
+    flush, up to MAX_FLUSH_ATTEMPTS times. If the channel refuses them, the
+    error is raised by the next add, once its content is queued, as nobody
+    waits for the flush."""
+    def __init__(self,
+                 channel: DiscordChannel,
+                 window: float = COALESCE_WINDOW) -> None:
+        self._channel = channel
+        self.window = window
+        self._pending: typing.List[str] = []
+        self._timer: typing.Optional[asyncio.Task[None]] = None
+        self._lock: typing.Optional[asyncio.Lock] = None
+        self._users = 0
+        self._failed_flushes = 0
+        self.error: typing.Optional[discord.errors.Forbidden] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # created on first use, as older versions of asyncio bind it to the
+        # event loop running when it's created
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def add(self, content: str) -> None:
+        """Queue content to be sent at the end of the window, then raise the
+        error a previous flush failed with, if any."""
+        self._pending.append(content)
+        self._schedule()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+            _pending_sends.add(self._timer)
+            self._timer.add_done_callback(_finish_send)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._users += 1
+        self._timer = None
+        try:
+            async with self.lock:
+                await self._flush()
+        finally:
+            self._users -= 1
+            self._release()
+
+    async def _flush(self) -> None:
+        try:
+            await self._send_merged(self._take(), requeue_last=True)
+        except discord.errors.Forbidden as error:
+            self._pending.clear()
+            self.error = error
+        except Exception as error:  # pylint: disable=broad-except
+            self._failed_flushes += 1
+            if self._failed_flushes >= MAX_FLUSH_ATTEMPTS:
+                print('failed to send to {}, dropping {} messages: {}'
+                      ''.format(self._channel, len(self._pending), error))
+                self._pending.clear()
+                self._failed_flushes = 0
+            else:
+                print('failed to send to {}, retrying: {}'.format(
+                    self._channel, error))
+                self._schedule()
+        else:
+            self._failed_flushes = 0
+
+    def _take(self) -> typing.List[str]:
+        res, self._pending = self._pending, []
+        return res
+
+    async def _send_merged(self, contents: typing.List[str],
+                           requeue_last: bool) -> discord.Message:
+        message = None
+        for start, merged in merge_messages(contents):
+            try:
+                message = await self._channel.send(merged)
+            except Exception:
+                # put back queued contents not sent, to be retried. The
+                # caller of send_now retries the last content itself.
+                self._pending[:0] = contents[
+                    start:None if requeue_last else -1]
+                raise
+        return message
+
+    async def send_now(self, content: str) -> discord.Message:
+        """Send content straight away, after and merged with any queued
+        messages, returning the message with the end of content."""
+        self._users += 1
+        self.error = None
+        try:
+            async with self.lock:
+                return await self._send_merged(self._take() + [content],
+                                               requeue_last=False)
+        finally:
+            self._users -= 1
+            self._release()
+
+    def _release(self) -> None:
+        """Forget the outbox once nothing is queued or being sent with it, a
+        later send to its channel makes a new one."""
+        if (self._users == 0 and self._timer is None and not self._pending
+                and self.error is None):
+            channel_id = self._channel.id
+            if _outboxes.get(channel_id) is self:
+                del _outboxes[channel_id]
+
+
+# Outboxes by channel id, as SeatChannel is created anew for every message.
+# Only channels with messages queued or being sent have one.
+_outboxes: typing.Dict[int, Outbox] = {}
+
+
 class SeatChannel:
     def __init__(self,
                  channel: DiscordChannel):
@@ -83,6 +248,17 @@ class SeatChannel:
     def __str__(self) -> str:
         return str(self._channel)
 
+    @property
+    def id(self) -> int:  # pylint: disable=invalid-name
+        return self._channel.id  # type: ignore # discord untyped
+
+    @property
+    def outbox(self) -> Outbox:
+        outbox = _outboxes.get(self.id)
+        if outbox is None:
+            outbox = _outboxes[self.id] = Outbox(self._channel)
+        return outbox
+
     def __hash__(self) -> int:
         """Default hash function takes the id (memory address) of the instance
         and we want different instances of SeatChannel with the same channel
@@ -104,10 +280,7 @@ class SeatChannel:
                    start: str = '',
                    end: str = '') -> None:
         try:
-            asyncio.create_task(
-                self._channel.send(
-                    start + sep.join(str(arg) for arg in args) + end)
-            )
+            self.outbox.add(start + sep.join(str(arg) for arg in args) + end)
         except discord.errors.Forbidden:
             print('blocked by {}'.format(self._channel))
             raise SeatException(
@@ -122,7 +295,7 @@ class SeatChannel:
                         start: str = '',
                         end: str = '') -> discord.Message:
         try:
-            return await self._channel.send(
+            return await self.outbox.send_now(
                 start + sep.join(str(arg) for arg in args) + end)
         except discord.errors.Forbidden:
             print('blocked by {}'.format(self._channel))